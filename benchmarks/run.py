@@ -0,0 +1,210 @@
+"""Offline benchmark of every obe source against the local stand-in server.
+
+Each (source, AOI size) case runs the ``obe`` CLI in a fresh subprocess
+pointed at the stand-in from ``tests/standin.py`` and reads the per-stage
+metrics it writes with ``--metrics-out``, so timings and peak memory are not
+affected by the server or by earlier cases. Results are written as JSON
+together with the commit they were measured at:
+
+    python benchmarks/run.py --output before.json
+    git checkout my-branch
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.standin import MICROSOFT_LOCATION, StandIn, World  # noqa: E402
+
+SOURCES = ["google", "microsoft", "osm", "overture"]
+
+# Side length of the square AOI in degrees for each size.
+AOI_SIZES = {"small": 0.01, "medium": 0.05, "large": 0.2}
+
+# Centre of the synthetic world; every AOI is centred on it.
+CENTER = (83.97, 28.2)
+
+
+def square(side):
+    cx, cy = CENTER
+    half = side / 2
+    return (cx - half, cy - half, cx + half, cy + half)
+
+
+def aoi_geojson(bounds):
+    minx, miny, maxx, maxy = bounds
+    ring = [[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {},
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+            }
+        ],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_case(standin_env, source, size, workdir):
+    input_path = os.path.join(workdir, f"aoi_{size}.geojson")
+    with open(input_path, "w") as f:
+        json.dump(aoi_geojson(square(AOI_SIZES[size])), f)
+    output_path = os.path.join(workdir, f"{source}_{size}.parquet")
+    metrics_path = os.path.join(workdir, f"{source}_{size}.json")
+
+    cmd = [
+        sys.executable,
+        "-m",
+        "obe.app",
+        "--source",
+        source,
+        "--input",
+        input_path,
+        "--output",
+        output_path,
+        "--metrics-out",
+        metrics_path,
+    ]
+    if source == "microsoft":
+        cmd += ["--location", MICROSOFT_LOCATION]
+
+    # Keep stand-in throughput out of the history used by `obe --dry-run`.
+    throughput_path = os.path.join(workdir, "throughput.json")
+    env = {**os.environ, **standin_env, "OBE_THROUGHPUT_FILE": throughput_path}
+    start = time.perf_counter()
+    subprocess.run(cmd, env=env, check=True, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+
+    with open(metrics_path) as f:
+        metrics = json.load(f)
+    stages = metrics["stages"]
+    rows = stages.get("write", {}).get("rows_in", 0)
+    return {
+        "seconds": seconds,
+        "run_seconds": metrics["total_seconds"],
+        "rows": rows,
+        "bytes": stages.get("download", {}).get("bytes", 0),
+        "peak_rss_bytes": metrics["peak_rss_bytes"],
+        "stages": {name: stage["seconds"] for name, stage in stages.items()},
+    }
+
+
+def summarize(source, size, runs):
+    seconds = statistics.median(run["seconds"] for run in runs)
+    best = min(runs, key=lambda run: run["seconds"])
+    return {
+        "source": source,
+        "size": size,
+        "aoi_side_degrees": AOI_SIZES[size],
+        "repeat": len(runs),
+        "seconds": seconds,
+        "rows": best["rows"],
+        "bytes": best["bytes"],
+        "rows_per_second": best["rows"] / seconds if seconds else None,
+        "bytes_per_second": best["bytes"] / seconds if seconds else None,
+        "peak_rss_bytes": max(run["peak_rss_bytes"] or 0 for run in runs),
+        "stages": best["stages"],
+    }
+
+
+def compare(results, baseline):
+    previous = {(r["source"], r["size"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    print(f"{'case':<20}{'seconds':>10}{'before':>10}{'ratio':>8}{'peak MB':>10}{'before':>10}")
+    for result in results:
+        old = previous.get((result["source"], result["size"]))
+        if old is None:
+            continue
+        case = f"{result['source']}/{result['size']}"
+        print(
+            f"{case:<20}{result['seconds']:>10.2f}{old['seconds']:>10.2f}"
+            f"{result['seconds'] / old['seconds']:>8.2f}"
+            f"{result['peak_rss_bytes'] / 2**20:>10.1f}{old['peak_rss_bytes'] / 2**20:>10.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sources", nargs="+", default=SOURCES, choices=SOURCES)
+    parser.add_argument(
+        "--sizes", nargs="+", default=list(AOI_SIZES), choices=list(AOI_SIZES)
+    )
+    parser.add_argument(
+        "--density",
+        type=float,
+        default=1_000_000,
+        help="Synthetic buildings per square degree",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Path of the JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    largest = max(AOI_SIZES[size] for size in args.sizes)
+    world = World(square(largest * 1.1), density=args.density, seed=args.seed)
+    print(f"Synthetic world with {len(world):,} buildings")
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        overture_dataset = world.write_overture(os.path.join(workdir, "overture"))
+        with StandIn(world) as standin:
+            standin_env = standin.env(overture_dataset=overture_dataset)
+            for source in args.sources:
+                for size in args.sizes:
+                    runs = [
+                        run_case(standin_env, source, size, workdir)
+                        for _ in range(args.repeat)
+                    ]
+                    result = summarize(source, size, runs)
+                    results.append(result)
+                    print(
+                        f"{source:<10}{size:<8}{result['rows']:>9,} rows"
+                        f"{result['seconds']:>8.2f}s"
+                        f"{result['peak_rss_bytes'] / 2**20:>9.1f} MB peak"
+                    )
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "density": args.density,
+        "seed": args.seed,
+        "results": results,
+    }
+    output = args.output or f"benchmark-{(report['commit'] or 'unknown')[:8]}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
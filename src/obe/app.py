@@ -1,10 +1,12 @@
 import argparse
 import os
+import sys
 
-from .google import process_building_footprints as process_google
-from .microsoft import process_building_footprints as process_microsoft
-from .osm import process_osm_data
-from .overture import process_building_footprints as process_overture
+from . import metrics
+
+# Source modules pull in geopandas, pandas, shapely and friends, so they are
+# imported inside download_buildings() only once a source has been chosen.
+# This keeps `import obe.app` and `obe --help` cheap.
 
 
 def get_output_extension(file_format):
@@ -15,6 +17,7 @@ def get_output_extension(file_format):
         "shapefile": ".shp",
         "geojsonseq": ".geojsonseq",
         "geoparquet": ".parquet",
+        "geoparquet-dataset": "",
     }
     return file_format_extensions[file_format]
 
@@ -31,59 +34,403 @@ def infer_format_from_extension(output_path):
     return ext_map.get(ext)
 
 
+# Hive partition column of each source's native tiles in geoparquet-dataset
+# output; sources without native tiles are partitioned on a quadkey grid.
+PARTITION_COLUMNS = {
+    "google": "s2_token",
+    "microsoft": "quadkey",
+    "osm": "quadkey",
+    "overture": "quadkey",
+}
+
+
+def iter_buildings(
+    source,
+    aoi,
+    location=None,
+    clip_mode="within",
+    compact=None,
+    max_in_flight=None,
+    return_type="geopandas",
+):
+    """Yield (tile key, GeoDataFrame) batches of clipped buildings from ``source``.
+
+    ``aoi`` is a GeoJSON file path or dictionary. Batches are yielded as soon
+    as each tile is ready, keyed by S2 token (google) or quadkey (microsoft);
+    osm and overture yield one batch per AOI feature with key None; with
+    return_type "arrow" the batches are pyarrow Tables (see obe.arrow).
+    Downloads run at most max_in_flight tiles ahead of the consumer, so a
+    slow consumer pauses them and memory stays flat::
+
+        for key, gdf in iter_buildings("google", "aoi.geojson"):
+            gdf.to_postgis("buildings", engine, if_exists="append")
+    """
+    source = source.lower()
+    if source == "google":
+        from .google import iter_building_footprints
+
+        return iter_building_footprints(
+            aoi, clip_mode, compact, max_in_flight, return_type
+        )
+    elif source == "microsoft":
+        if not location:
+            raise ValueError("Location is required for Microsoft data source.")
+        from .microsoft import iter_building_footprints
+
+        return iter_building_footprints(
+            aoi, location, clip_mode, compact, max_in_flight, return_type
+        )
+    elif source == "osm":
+        from .osm import iter_osm_data
+
+        return iter_osm_data(aoi, clip_mode, compact, return_type)
+    elif source == "overture":
+        from .overture import iter_building_footprints
+
+        return iter_building_footprints(aoi, clip_mode, compact, return_type)
+    else:
+        raise ValueError(f"Unknown source: {source}")
+
+
+def write_dataset(source, batches, output_path, partition_zoom, parquet_options):
+    """Write batches as a partitioned dataset while they arrive; return them all."""
+    from .output import GeoParquetDatasetWriter, concat_batches
+
+    writer = GeoParquetDatasetWriter(
+        output_path,
+        partition_column=PARTITION_COLUMNS[source],
+        partition_zoom=partition_zoom,
+        parquet_options=parquet_options,
+    )
+    collected = []
+    try:
+        for key, gdf in batches:
+            writer.submit(key, gdf)
+            collected.append(gdf)
+    except BaseException:
+        writer.abort()
+        raise
+    index = writer.close()
+    print(f"Wrote {len(index['files'])} partition files to {output_path}")
+    with metrics.stage("concat") as record:
+        result_gdf = concat_batches(collected)
+        record.rows_out = len(result_gdf)
+    return result_gdf
+
+
+def resolve_output(source, input_path, output_path, file_format):
+    """Return (format, path) of the output, inferring whichever is missing."""
+    file_format = file_format.lower() if file_format else None
+
+    if output_path and not file_format:
+        file_format = infer_format_from_extension(output_path)
+        if not file_format:
+            raise ValueError(f"Cannot infer format from output file: {output_path}")
+
+    if file_format and not output_path:
+        input_filename = os.path.splitext(os.path.basename(input_path))[0]
+        extension = get_output_extension(file_format)
+        output_path = f"{input_filename}_{source}_buildings{extension}"
+
+    return file_format, output_path
+
+
 def download_buildings(
     source,
     input_path,
     output_path,
     format=None,
     location=None,
+    clip_mode="within",
+    parquet_options=None,
+    partition_zoom=None,
+    compact=None,
+    update=False,
+    return_type="geopandas",
 ):
+    """Download buildings from ``source`` for the AOI and optionally save them.
+
+    parquet_options is a dict of obe.output.write_geoparquet arguments
+    (compression, compression_level, row_group_size, precision,
+    bbox_covering, hilbert) used for the geoparquet and geoparquet-dataset
+    formats; its precision also rounds geojson and geojsonseq coordinates.
+    partition_zoom makes geoparquet-dataset output partition every
+    source on a quadkey grid of that zoom instead of its native tiles.
+    compact selects the compact attribute dtypes of obe.schema; the default
+    None uses them for AOIs larger than schema.COMPACT_MIN_AREA_KM2.
+    update keeps the tiles of the output next to it and refetches only the
+    tiles that changed since the last run, see obe.update. return_type
+    "arrow" returns a pyarrow Table with WKB geometry instead of a
+    GeoDataFrame, see obe.arrow.
+    """
     source = source.lower()
-    file_format = format.lower() if format else None
+    metrics.annotate("source", source)
+    file_format, output_path = resolve_output(source, input_path, output_path, format)
+
+    if return_type == "arrow":
+        if update or file_format == "geoparquet-dataset":
+            raise ValueError(
+                "return_type='arrow' does not support update mode or "
+                "geoparquet-dataset output"
+            )
+        return download_table(
+            source,
+            input_path,
+            output_path,
+            file_format,
+            location,
+            clip_mode,
+            parquet_options,
+            compact,
+        )
+
+    if update:
+        if not file_format:
+            raise ValueError("Update mode needs an output file.")
+        from .update import update_buildings
+
+        return update_buildings(
+            source,
+            input_path,
+            output_path,
+            file_format,
+            location,
+            clip_mode,
+            compact,
+            parquet_options,
+        )
+
+    if file_format == "geoparquet-dataset":
+        metrics.annotate("format", file_format)
+        batches = iter_buildings(source, input_path, location, clip_mode, compact)
+        result_gdf = write_dataset(
+            source, batches, output_path, partition_zoom, parquet_options
+        )
+        print(f"Processed {len(result_gdf)} building footprints.")
+        return result_gdf
+
     if source == "google":
-        result_gdf = process_google(input_path)
+        from .google import process_building_footprints as process_google
+
+        result_gdf = process_google(input_path, clip_mode, compact)
     elif source == "microsoft":
         if not location:
             raise ValueError("Location is required for Microsoft data source.")
-        result_gdf = process_microsoft(input_path, location)
+        from .microsoft import process_building_footprints as process_microsoft
+
+        result_gdf = process_microsoft(input_path, location, clip_mode, compact)
     elif source == "osm":
-        result_gdf = process_osm_data(input_path)
+        from .osm import process_osm_data
+
+        result_gdf = process_osm_data(input_path, clip_mode, compact)
     elif source == "overture":
-        result_gdf = process_overture(input_path)
+        from .overture import process_building_footprints as process_overture
+
+        result_gdf = process_overture(input_path, clip_mode, compact)
     else:
         raise ValueError(f"Unknown source: {source}")
 
     print(f"Processed {len(result_gdf)} building footprints.")
 
-    file_format = format.lower() if format else None
-    if output_path and not file_format:
-        file_format = infer_format_from_extension(output_path)
+    if file_format:
+        print(f"Saving results to {output_path}...")
+        metrics.annotate("format", file_format)
+        from .output import write_buildings
+
+        write_buildings(result_gdf, output_path, file_format, parquet_options)
+
+    return result_gdf
+
+
+def download_table(
+    source,
+    input_path,
+    output_path,
+    file_format,
+    location=None,
+    clip_mode="within",
+    parquet_options=None,
+    compact=None,
+):
+    """download_buildings with return_type="arrow"."""
+    if source == "google":
+        from .google import process_building_footprints as process_google
+
+        table = process_google(input_path, clip_mode, compact, "arrow")
+    elif source == "microsoft":
+        if not location:
+            raise ValueError("Location is required for Microsoft data source.")
+        from .microsoft import process_building_footprints as process_microsoft
+
+        table = process_microsoft(input_path, location, clip_mode, compact, "arrow")
+    elif source == "osm":
+        from .osm import process_osm_data
+
+        table = process_osm_data(input_path, clip_mode, compact, "arrow")
+    elif source == "overture":
+        from .overture import process_building_footprints as process_overture
+
+        table = process_overture(input_path, clip_mode, compact, "arrow")
+    else:
+        raise ValueError(f"Unknown source: {source}")
+
+    print(f"Processed {len(table)} building footprints.")
+
+    if file_format:
+        print(f"Saving results to {output_path}...")
+        metrics.annotate("format", file_format)
+        from .arrow import write_table
+
+        write_table(table, output_path, file_format, parquet_options)
+
+    return table
+
+
+def iter_buildings_async(
+    source,
+    aoi,
+    location=None,
+    clip_mode="within",
+    compact=None,
+    max_in_flight=None,
+):
+    """Async generator version of iter_buildings for asyncio services::
+
+        async for key, gdf in iter_buildings_async("google", "aoi.geojson"):
+            await load(gdf)
+    """
+    source = source.lower()
+    if source == "google":
+        from .google import iter_building_footprints_async
+
+        return iter_building_footprints_async(aoi, clip_mode, compact, max_in_flight)
+    elif source == "microsoft":
+        if not location:
+            raise ValueError("Location is required for Microsoft data source.")
+        from .microsoft import iter_building_footprints_async
+
+        return iter_building_footprints_async(
+            aoi, location, clip_mode, compact, max_in_flight
+        )
+    elif source == "osm":
+        from .osm import iter_osm_data_async
+
+        return iter_osm_data_async(aoi, clip_mode, compact)
+    elif source == "overture":
+        from .overture import iter_building_footprints_async
+
+        return iter_building_footprints_async(aoi, clip_mode, compact)
+    else:
+        raise ValueError(f"Unknown source: {source}")
+
+
+async def download_buildings_async(
+    source,
+    input_path,
+    output_path,
+    format=None,
+    location=None,
+    clip_mode="within",
+    parquet_options=None,
+    partition_zoom=None,
+    compact=None,
+    update=False,
+):
+    """download_buildings for asyncio code; it never blocks the event loop.
+
+    Network requests, parsing and writing run in threads, OSM tasks are
+    polled with asyncio.sleep and the Overture CLI runs as an asyncio
+    subprocess, so many extractions can run concurrently in one process.
+    Arguments are the same as for download_buildings.
+    """
+    import asyncio
+
+    source = source.lower()
+    metrics.annotate("source", source)
+    file_format, output_path = resolve_output(source, input_path, output_path, format)
+
+    if update:
         if not file_format:
-            raise ValueError(f"Cannot infer format from output file: {output_path}")
+            raise ValueError("Update mode needs an output file.")
+        from .update import update_buildings
+
+        return await asyncio.to_thread(
+            update_buildings,
+            source,
+            input_path,
+            output_path,
+            file_format,
+            location,
+            clip_mode,
+            compact,
+            parquet_options,
+        )
+
+    if file_format == "geoparquet-dataset":
+        metrics.annotate("format", file_format)
+        batches = [
+            batch
+            async for batch in iter_buildings_async(
+                source, input_path, location, clip_mode, compact
+            )
+        ]
+        result_gdf = await asyncio.to_thread(
+            write_dataset, source, batches, output_path, partition_zoom, parquet_options
+        )
+        print(f"Processed {len(result_gdf)} building footprints.")
+        return result_gdf
+
+    if source == "google":
+        from .google import process_building_footprints_async as process_google
+
+        result_gdf = await process_google(input_path, clip_mode, compact)
+    elif source == "microsoft":
+        if not location:
+            raise ValueError("Location is required for Microsoft data source.")
+        from .microsoft import process_building_footprints_async as process_microsoft
+
+        result_gdf = await process_microsoft(input_path, location, clip_mode, compact)
+    elif source == "osm":
+        from .osm import process_osm_data_async
+
+        result_gdf = await process_osm_data_async(input_path, clip_mode, compact)
+    elif source == "overture":
+        from .overture import process_building_footprints_async as process_overture
+
+        result_gdf = await process_overture(input_path, clip_mode, compact)
+    else:
+        raise ValueError(f"Unknown source: {source}")
+
+    print(f"Processed {len(result_gdf)} building footprints.")
 
     if file_format:
-        if not output_path:
-            input_filename = os.path.splitext(os.path.basename(input_path))[0]
-            extension = get_output_extension(file_format)
-            output_path = f"{input_filename}_{source}_buildings{extension}"
         print(f"Saving results to {output_path}...")
-        if file_format == "geojson":
-            result_gdf.to_file(output_path, driver="GeoJSON")
-        elif file_format == "geopackage":
-            result_gdf.to_file(output_path, driver="GPKG")
-        elif file_format == "shapefile":
-            result_gdf.to_file(output_path, driver="ESRI Shapefile")
-        elif file_format == "geojsonseq":
-            result_gdf.to_file(output_path, driver="GeoJSONSeq")
-        elif file_format == "geoparquet":
-            result_gdf.to_parquet(output_path)
+        metrics.annotate("format", file_format)
+        from .output import write_buildings
+
+        await asyncio.to_thread(
+            write_buildings, result_gdf, output_path, file_format, parquet_options
+        )
 
     return result_gdf
 
 
-def main():
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "batch":
+        from .batch import main as batch_main
+
+        return batch_main(argv[1:])
+    if argv and argv[0] in ("coordinate", "worker", "merge"):
+        from .distributed import main as distributed_main
+
+        return distributed_main(argv)
+
     parser = argparse.ArgumentParser(
-        description="Downloads open building footprints from various data sources within a given area of interest (AOI)."
+        description="Downloads open building footprints from various data sources within a given area of interest (AOI).",
+        epilog="Run `obe batch --help` to extract many AOIs with shared tile "
+        "downloads, and `obe coordinate|worker|merge --help` to spread one "
+        "extraction over several machines.",
     )
     parser.add_argument(
         "--source",
@@ -102,23 +449,163 @@ def main():
     )
     parser.add_argument(
         "--format",
-        help="Output file_format: geojson, geojsonseq, geoparquet, geopackage, or shapefile",
-        choices=["geojson", "geojsonseq", "geoparquet", "geopackage", "shapefile"],
+        help="Output file_format: geojson, geojsonseq, geoparquet, geoparquet-dataset "
+        "(a directory partitioned by tile), geopackage, or shapefile",
+        choices=[
+            "geojson",
+            "geojsonseq",
+            "geoparquet",
+            "geoparquet-dataset",
+            "geopackage",
+            "shapefile",
+        ],
     )
     parser.add_argument(
         "--location",
         help="Location to filter the dataset (required for Microsoft data source)",
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--clip-mode",
+        help="How buildings are matched against the AOI: within (default), "
+        "intersects, centroid, or clip (cut at the AOI boundary)",
+        default="within",
+        choices=["within", "intersects", "centroid", "clip"],
+    )
+    parser.add_argument(
+        "--compact",
+        help="Store attributes as float32, categorical and Arrow string columns "
+        "to save memory (default: only for AOIs larger than 10,000 km²)",
+        action=argparse.BooleanOptionalAction,
+    )
+    parquet = parser.add_argument_group("GeoParquet options")
+    parquet.add_argument(
+        "--compression",
+        help="Parquet compression codec (default: snappy)",
+        default="snappy",
+        choices=["snappy", "zstd", "gzip", "brotli", "lz4", "none"],
+    )
+    parquet.add_argument(
+        "--compression-level",
+        help="Codec specific compression level, e.g. 1-22 for zstd",
+        type=int,
+    )
+    parquet.add_argument(
+        "--row-group-size",
+        help="Maximum number of rows per Parquet row group",
+        type=int,
+    )
+    parquet.add_argument(
+        "--precision",
+        help="Round coordinates to this many decimal places (7 is ~1 cm); "
+        "also applies to geojson and geojsonseq output",
+        type=int,
+    )
+    parquet.add_argument(
+        "--bbox-covering",
+        help="Write a GeoParquet 1.1 bbox covering column for row-group pruning",
+        action="store_true",
+    )
+    parquet.add_argument(
+        "--hilbert",
+        help="Sort rows along a Hilbert curve so row groups are spatially compact",
+        action="store_true",
+    )
+    parquet.add_argument(
+        "--partition-zoom",
+        help="Partition geoparquet-dataset output on a quadkey grid of this zoom "
+        "instead of the source's native tiles (default for osm/overture: 8)",
+        type=int,
+    )
+    parser.add_argument(
+        "--update",
+        help="Keep per-tile results and a manifest next to the output and, when "
+        "they exist, refetch only the tiles that changed since the last run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--dry-run",
+        help="Only list the tiles that would be fetched with their estimated "
+        "size, buildings and runtime",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-connections-per-host",
+        help="Upper bound of the adaptive number of parallel downloads per host "
+        "(default: 16)",
+        type=int,
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        help="Memory budget for the bytes of tiles in transit, parsed tiles "
+        "not included (default: 1024)",
+        type=int,
+    )
+    parser.add_argument(
+        "--record-throughput",
+        help="Record the throughput of the run for --dry-run estimates in "
+        "OBE_THROUGHPUT_FILE (default: on; an empty OBE_THROUGHPUT_FILE also "
+        "turns it off)",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Print per-stage timing, throughput and memory after the run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics-out",
+        help="Path to write the per-stage metrics as JSON",
+    )
+
+    args = parser.parse_args(argv)
+
+    from .concurrency import CONTROLLER
 
-    download_buildings(
-        args.source,
-        args.input,
-        args.output,
-        args.format,
-        args.location,
+    CONTROLLER.configure(
+        max_per_host=args.max_connections_per_host,
+        memory_budget=args.memory_budget_mb and args.memory_budget_mb * 1024**2,
     )
+    if args.dry_run:
+        from .plan import plan_extraction
+
+        plan = plan_extraction(args.source, args.input, args.location)
+        print(plan.summary())
+        return
+
+    with metrics.collect() as run:
+        download_buildings(
+            args.source,
+            args.input,
+            args.output,
+            args.format,
+            args.location,
+            args.clip_mode,
+            parquet_options={
+                "compression": args.compression,
+                "compression_level": args.compression_level,
+                "row_group_size": args.row_group_size,
+                "precision": args.precision,
+                "bbox_covering": args.bbox_covering,
+                "hilbert": args.hilbert,
+            },
+            partition_zoom=args.partition_zoom,
+            compact=args.compact,
+            update=args.update,
+        )
+        CONTROLLER.report()
+
+    if args.record_throughput:
+        from .plan import record_throughput
+
+        record_throughput(args.source, run.to_dict())
+
+    if args.profile:
+        print(run.summary())
+    if args.metrics_out:
+        run.write_json(args.metrics_out)
+        print(f"Metrics written to {args.metrics_out}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+"""Arrow-native results: pyarrow Tables with GeoArrow WKB geometry.
+
+With ``return_type="arrow"`` the sources keep attributes in pyarrow and
+store geometries as WKB in a ``geometry`` column tagged as ``geoarrow.wkb``,
+instead of building a GeoDataFrame of Python geometry objects. Shapely
+geometries are only created for the clip and dropped right after it, so
+Arrow-based consumers (DuckDB, Polars, pyarrow datasets) get the buildings
+without the pandas and shapely overhead. ``geopandas.GeoDataFrame.from_arrow``
+turns such a table into a GeoDataFrame when one is needed after all.
+"""
+
+import json
+from functools import lru_cache
+
+import numpy as np
+import pyarrow as pa
+import shapely
+
+from . import metrics
+
+RETURN_TYPES = ("geopandas", "arrow")
+
+GEOMETRY = "geometry"
+
+# GeoParquet options that need the geometries as shapely objects.
+_GEOMETRY_OPTIONS = ("precision", "bbox_covering", "hilbert")
+
+
+def check_return_type(return_type):
+    if return_type not in RETURN_TYPES:
+        raise ValueError(
+            f"Invalid return type: {return_type}. "
+            f"Accepted values are: {', '.join(RETURN_TYPES)}"
+        )
+    return return_type
+
+
+@lru_cache(maxsize=None)
+def _crs_json():
+    from pyproj import CRS
+
+    return CRS("EPSG:4326").to_json_dict()
+
+
+def geometry_field():
+    """The WKB geometry field, with GeoArrow extension metadata in EPSG:4326."""
+    return pa.field(
+        GEOMETRY,
+        pa.binary(),
+        metadata={
+            "ARROW:extension:name": "geoarrow.wkb",
+            "ARROW:extension:metadata": json.dumps({"crs": _crs_json()}),
+        },
+    )
+
+
+def to_table(attributes, geometries):
+    """Append shapely ``geometries`` to the ``attributes`` table as WKB."""
+    wkb = shapely.to_wkb(np.asarray(geometries), output_dimension=2)
+    return attributes.append_column(geometry_field(), pa.array(wkb, pa.binary()))
+
+
+def geometries(table):
+    """Shapely geometries of a table's WKB geometry column."""
+    return shapely.from_wkb(np.asarray(table[GEOMETRY].to_numpy(zero_copy_only=False)))
+
+
+def geojson_geometries(geometry):
+    """Shapely geometries of GeoJSON geometry structs read by pyarrow.json.
+
+    Polygons, which is what the building sources serve, are built straight
+    from the coordinate buffers; other geometries go through JSON.
+    """
+    import pyarrow.compute as pc
+
+    if isinstance(geometry, pa.ChunkedArray):
+        geometry = geometry.combine_chunks()
+    coordinates = geometry.field("coordinates")
+    if geometry.null_count == 0 and pc.all(
+        pc.equal(geometry.field("type"), "Polygon")
+    ).as_py():
+        rings = coordinates.flatten()
+        points = rings.flatten()
+        point_offsets = np.asarray(points.offsets)
+        if np.all(np.diff(point_offsets) == 2):
+            ring_offsets = np.asarray(rings.offsets, dtype=np.int64)
+            polygon_offsets = np.asarray(coordinates.offsets, dtype=np.int64)
+            return shapely.from_ragged_array(
+                shapely.GeometryType.POLYGON,
+                points.flatten().to_numpy().reshape(-1, 2),
+                (ring_offsets - ring_offsets[0], polygon_offsets - polygon_offsets[0]),
+            )
+    return shapely.from_geojson([json.dumps(value) for value in geometry.to_pylist()])
+
+
+def clip_table(attributes, geometries, aoi, mode="within"):
+    """Arrow version of obe.clip.clip_buildings.
+
+    ``attributes`` is a table without geometry and ``geometries`` the shapely
+    geometries of its rows; returns the selected rows with WKB geometry.
+    """
+    from .clip import clip_geometries, clip_indices
+
+    with metrics.stage("clip", rows_in=len(geometries)) as record:
+        geometries = np.asarray(geometries)
+        indices = clip_indices(geometries, aoi, mode)
+        attributes = attributes.take(pa.array(indices, pa.int64()))
+        geometries = geometries[indices]
+        if mode == "clip" and len(geometries):
+            geometries = clip_geometries(geometries, aoi)
+            keep = ~shapely.is_empty(geometries)
+            attributes = attributes.filter(pa.array(keep))
+            geometries = geometries[keep]
+        record.rows_out = len(geometries)
+    return to_table(attributes, geometries)
+
+
+def from_geodataframe(gdf):
+    """Table of a GeoDataFrame, for sources that only produce GeoDataFrames."""
+    attributes = pa.Table.from_pandas(
+        gdf.drop(columns=gdf.geometry.name), preserve_index=False
+    )
+    return to_table(attributes.replace_schema_metadata(None), gdf.geometry.values)
+
+
+def with_ids(table, start):
+    """Set the ``id`` column to start, start + 1, ..."""
+    ids = pa.array(np.arange(start, start + len(table)), pa.int64())
+    if "id" in table.column_names:
+        return table.set_column(table.column_names.index("id"), "id", ids)
+    return table.append_column("id", ids)
+
+
+def concat_tables(tables):
+    """Concatenate per-tile tables, or an empty table with only a geometry."""
+    if not tables:
+        return pa.schema([geometry_field()]).empty_table()
+    with metrics.stage("concat") as record:
+        result = pa.concat_tables(tables, promote_options="permissive")
+        record.rows_out = len(result)
+    return result
+
+
+def to_geodataframe(table):
+    import geopandas as gpd
+
+    return gpd.GeoDataFrame.from_arrow(table)
+
+
+def write_table(table, output_path, file_format, parquet_options=None):
+    """Write a table like obe.output.write_buildings.
+
+    GeoParquet is written straight from Arrow; the other formats, and the
+    GeoParquet options that need shapely geometries, go through a GeoDataFrame.
+    """
+    import os
+
+    import pyarrow.parquet as pq
+
+    from .output import write_buildings
+
+    options = dict(parquet_options or {})
+    if file_format != "geoparquet" or any(
+        options.get(name) for name in _GEOMETRY_OPTIONS
+    ):
+        write_buildings(to_geodataframe(table), output_path, file_format, options)
+        return
+
+    with metrics.stage("write", rows_in=len(table)) as record:
+        geo = {
+            "version": "1.0.0",
+            "primary_column": GEOMETRY,
+            "columns": {
+                GEOMETRY: {"encoding": "WKB", "geometry_types": [], "crs": _crs_json()}
+            },
+        }
+        metadata = dict(table.schema.metadata or {}, geo=json.dumps(geo))
+        compression = options.get("compression", "snappy")
+        pq.write_table(
+            table.replace_schema_metadata(metadata),
+            output_path,
+            compression=None if compression == "none" else compression,
+            compression_level=options.get("compression_level"),
+            row_group_size=options.get("row_group_size"),
+        )
+        record.bytes = os.path.getsize(output_path)
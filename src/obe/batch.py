@@ -0,0 +1,354 @@
+"""Batch extraction of buildings for many AOIs with shared tile downloads.
+
+Running obe once per AOI downloads and parses every tile again for each AOI
+that touches it. In batch mode the tiles needed by the whole AOI collection
+are planned up front, each one is fetched and parsed exactly once and its
+buildings are assigned to all AOIs with one bulk spatial join.
+
+Google S2 cells and Microsoft quadkeys partition the buildings, so they are
+the unit of download. OSM and Overture have no native tiles: their AOIs are
+grouped on a quadkey grid of GROUP_ZOOM and each group is requested once.
+
+    obe batch --source google --input catchments.geojson --id-column name \\
+        --output-dir buildings/ --format geoparquet
+"""
+
+import argparse
+import hashlib
+import os
+import re
+from collections import Counter
+
+import numpy as np
+import shapely
+
+from . import metrics
+from .clip import check_clip_mode, join_buildings, read_aoi
+from .concurrency import CONTROLLER, bounded_map
+from .output import concat_batches, write_buildings
+from .schema import resolve_compact
+
+AOI_ID_COLUMN = "aoi_id"
+
+# Zoom of the quadkey grid grouping AOIs of sources without native tiles.
+GROUP_ZOOM = 9
+
+FORMATS = ["geojson", "geojsonseq", "geoparquet", "geopackage", "shapefile"]
+
+
+def aoi_ids(aoi_gdf, id_column=None):
+    """Ids of the AOIs: the values of id_column, or their row positions."""
+    if id_column is None:
+        return np.arange(len(aoi_gdf))
+    if id_column not in aoi_gdf.columns:
+        raise ValueError(f"AOI id column not found: {id_column}")
+    ids = aoi_gdf[id_column].to_numpy()
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"AOI id column has duplicate values: {id_column}")
+    return ids
+
+
+def group_keys(aois, zoom=GROUP_ZOOM):
+    """Quadkey of the grid cell holding the centroid of every AOI."""
+    import mercantile
+
+    centroids = shapely.centroid(aois)
+    return [
+        mercantile.quadkey(mercantile.tile(x, y, zoom))
+        for x, y in zip(shapely.get_x(centroids), shapely.get_y(centroids))
+    ]
+
+
+def tile_groups(source, aois):
+    """Map each tile key of ``source`` to the positions of the AOIs that need it.
+
+    Keys are S2 tokens (google), quadkeys (microsoft) or GROUP_ZOOM grid cells
+    (osm, overture).
+    """
+    groups = {}
+    if source == "google":
+        from .google import get_s2_tiles
+
+        for position, aoi in enumerate(aois):
+            for token in get_s2_tiles(aoi.bounds):
+                groups.setdefault(token, []).append(position)
+    elif source == "microsoft":
+        from .microsoft import covering_quadkeys
+
+        for position, aoi in enumerate(aois):
+            for quad_key in covering_quadkeys(aoi.bounds):
+                groups.setdefault(quad_key, []).append(position)
+    elif source in ("osm", "overture"):
+        for position, key in enumerate(group_keys(aois)):
+            groups.setdefault(key, []).append(position)
+    else:
+        raise ValueError(f"Unknown source: {source}")
+    return {key: np.array(positions) for key, positions in groups.items()}
+
+
+def plan_tiles(source, aois, location=None, compact=False):
+    """Plan the downloads of a batch.
+
+    Returns ``(groups, fetch)``: groups is :func:`tile_groups`, and
+    ``fetch(key)`` returns the unclipped buildings of that tile (or None).
+    """
+    if source == "microsoft" and not location:
+        raise ValueError("Location is required for Microsoft data source.")
+    groups = tile_groups(source, aois)
+    if source == "google":
+        from .google import read_tile
+
+        def fetch(key):
+            return read_tile(key, compact)
+
+    elif source == "microsoft":
+        from .microsoft import download_tile_buildings, load_dataset_links, tile_urls
+
+        urls = tile_urls(load_dataset_links(location), location, list(groups))
+
+        def fetch(key):
+            return download_tile_buildings(urls[key], compact)
+
+    elif source == "osm":
+        from .osm import fetch_snapshot, get_geometry
+
+        def fetch(key):
+            union = shapely.union_all(aois[groups[key]])
+            return fetch_snapshot(get_geometry(union), compact)
+
+    else:
+        from .overture import read_bbox
+
+        def fetch(key):
+            bbox = tuple(shapely.total_bounds(aois[groups[key]]))
+            return read_bbox(bbox, compact)
+
+    return groups, fetch
+
+
+def iter_batch(
+    source,
+    aoi_input,
+    location=None,
+    clip_mode="within",
+    compact=None,
+    id_column=None,
+    max_in_flight=None,
+):
+    """Yield (tile key, GeoDataFrame) of the buildings of every AOI, per tile.
+
+    Each tile is fetched once; its buildings are joined to all AOIs that need
+    it and carry the AOI's id (see :func:`aoi_ids`) in the aoi_id column. A
+    building in several overlapping AOIs is returned once per AOI.
+    """
+    source = source.lower()
+    check_clip_mode(clip_mode)
+    aoi_gdf = read_aoi(aoi_input)
+    ids = aoi_ids(aoi_gdf, id_column)
+    compact = resolve_compact(compact, aoi_gdf)
+    aois = np.asarray(aoi_gdf.geometry.values)
+
+    with metrics.stage("plan"):
+        groups, fetch = plan_tiles(source, aois, location, compact)
+    separate = sum(len(positions) for positions in groups.values())
+    print(
+        f"{len(aois)} AOIs need {len(groups)} tiles "
+        f"({separate} tile requests when extracted one by one)"
+    )
+    metrics.annotate("aois", len(aois))
+    metrics.annotate("tiles", len(groups))
+
+    def process(key):
+        gdf = fetch(key)
+        if gdf is None or gdf.empty:
+            return None
+        positions = groups[key]
+        return join_buildings(gdf, aois[positions], ids[positions], clip_mode)
+
+    for key, gdf in bounded_map(process, list(groups), max_in_flight=max_in_flight):
+        if gdf is not None and not gdf.empty:
+            yield key, gdf
+
+
+def process_batch(
+    source,
+    aoi_input,
+    location=None,
+    clip_mode="within",
+    compact=None,
+    id_column=None,
+):
+    """Buildings of every AOI in one GeoDataFrame with an aoi_id column."""
+    batches = [
+        gdf
+        for _, gdf in iter_batch(
+            source, aoi_input, location, clip_mode, compact, id_column
+        )
+    ]
+    with metrics.stage("concat") as record:
+        combined_gdf = concat_batches(batches)
+        if len(combined_gdf):
+            combined_gdf = combined_gdf.sort_values(
+                AOI_ID_COLUMN, kind="stable"
+            ).reset_index(drop=True)
+        record.rows_out = len(combined_gdf)
+    return combined_gdf
+
+
+def output_filenames(ids, file_format):
+    """File names of the AOIs' outputs, safe for any id value.
+
+    Ids whose names would clash once made safe, or on a case-insensitive file
+    system (e.g. "a/b" and "a_b", or "A" and "a"), get a short hash of the id
+    appended, so no AOI overwrites another one's file.
+    """
+    from .app import get_output_extension
+
+    names = [re.sub(r"[^\w.-]", "_", str(aoi_id)) for aoi_id in ids]
+    counts = Counter(name.casefold() for name in names)
+    extension = get_output_extension(file_format)
+    filenames = []
+    for aoi_id, name in zip(ids, names):
+        if counts[name.casefold()] > 1:
+            name += "-" + hashlib.sha1(str(aoi_id).encode()).hexdigest()[:8]
+        filenames.append(f"{name}{extension}")
+    return filenames
+
+
+def write_per_aoi(gdf, output_dir, file_format, ids=None):
+    """Write one file per AOI into output_dir; returns the paths written.
+
+    ``ids`` are the ids of all AOIs (see :func:`aoi_ids`); AOIs without
+    buildings get an empty file, so every AOI processed has an output.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if AOI_ID_COLUMN not in gdf.columns:
+        gdf = gdf.assign(**{AOI_ID_COLUMN: []})
+    groups = {
+        aoi_id: aoi_gdf for aoi_id, aoi_gdf in gdf.groupby(AOI_ID_COLUMN, sort=False)
+    }
+    if ids is None:
+        ids = list(groups)
+    paths = []
+    for aoi_id, filename in zip(ids, output_filenames(ids, file_format)):
+        path = os.path.join(output_dir, filename)
+        aoi_gdf = groups.get(aoi_id, gdf.iloc[:0])
+        write_buildings(aoi_gdf.reset_index(drop=True), path, file_format)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="obe batch",
+        description="Extract buildings for every AOI of a collection, downloading "
+        "each tile only once.",
+    )
+    parser.add_argument(
+        "--source",
+        help="Data source: google, microsoft, osm, overture",
+        required=True,
+        choices=["google", "microsoft", "osm", "overture"],
+    )
+    parser.add_argument(
+        "--input",
+        help="Path to the GeoJSON file (or any OGR file) with one AOI per feature",
+        required=True,
+    )
+    parser.add_argument(
+        "--id-column",
+        help="AOI attribute identifying each AOI (default: the feature's position)",
+    )
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument(
+        "--output",
+        help="Path of a single output file with an aoi_id column",
+    )
+    output.add_argument(
+        "--output-dir",
+        help="Directory to write one output file per AOI into",
+    )
+    parser.add_argument(
+        "--format",
+        help="Output format (default: inferred from --output, geojson for --output-dir)",
+        choices=FORMATS,
+    )
+    parser.add_argument(
+        "--location",
+        help="Location to filter the dataset (required for Microsoft data source)",
+    )
+    parser.add_argument(
+        "--clip-mode",
+        help="How buildings are matched against each AOI: within (default), "
+        "intersects, centroid, or clip (cut at the AOI boundary)",
+        default="within",
+        choices=["within", "intersects", "centroid", "clip"],
+    )
+    parser.add_argument(
+        "--compact",
+        help="Store attributes as float32, categorical and Arrow string columns "
+        "to save memory (default: only for AOIs larger than 10,000 km² in total)",
+        action=argparse.BooleanOptionalAction,
+    )
+    parser.add_argument(
+        "--max-connections-per-host",
+        help="Upper bound of the adaptive number of parallel downloads per host "
+        "(default: 16)",
+        type=int,
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        help="Memory budget for tiles being downloaded at once (default: 1024)",
+        type=int,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Print per-stage timing, throughput and memory after the run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics-out",
+        help="Path to write the per-stage metrics as JSON",
+    )
+
+    args = parser.parse_args(argv)
+
+    from .app import infer_format_from_extension
+
+    file_format = args.format
+    if args.output and not file_format:
+        file_format = infer_format_from_extension(args.output)
+        if not file_format:
+            parser.error(f"Cannot infer format from output file: {args.output}")
+    file_format = file_format or "geojson"
+
+    CONTROLLER.configure(
+        max_per_host=args.max_connections_per_host,
+        memory_budget=args.memory_budget_mb and args.memory_budget_mb * 1024**2,
+    )
+    with metrics.collect() as run:
+        metrics.annotate("source", args.source)
+        metrics.annotate("format", file_format)
+        result_gdf = process_batch(
+            args.source,
+            args.input,
+            args.location,
+            args.clip_mode,
+            args.compact,
+            args.id_column,
+        )
+        print(f"Processed {len(result_gdf)} building footprints.")
+        if args.output:
+            print(f"Saving results to {args.output}...")
+            write_buildings(result_gdf, args.output, file_format)
+        else:
+            ids = aoi_ids(read_aoi(args.input), args.id_column)
+            paths = write_per_aoi(result_gdf, args.output_dir, file_format, ids)
+            print(f"Wrote {len(paths)} files to {args.output_dir}")
+        CONTROLLER.report()
+
+    if args.profile:
+        print(run.summary())
+    if args.metrics_out:
+        run.write_json(args.metrics_out)
+        print(f"Metrics written to {args.metrics_out}")
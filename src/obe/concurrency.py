@@ -0,0 +1,310 @@
+"""Bounded concurrent work for tile downloads.
+
+:func:`bounded_map` runs a function over tiles in a thread pool but keeps at
+most ``max_in_flight`` results that have not been consumed yet. Because it is
+a generator, no new work is submitted while the consumer is busy with a
+batch, so a slow consumer pauses the downloads instead of letting finished
+tiles pile up in memory. :func:`bounded_map_async` is the same for asyncio
+code: the calls run in threads and the event loop is never blocked.
+
+How many of those calls actually hit a server at the same time is decided by
+the :class:`AdaptiveController` shared by all sources (see :data:`CONTROLLER`):
+an AIMD limit per host that grows while throughput improves and halves on
+throttling (429, 5xx, timeouts), capped per host and by a memory budget for
+the tiles being downloaded. The budget only covers bytes in transit: a tile's
+reservation is released as soon as its download returns, and parsed tiles
+waiting for the consumer are bounded by ``max_in_flight`` instead.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from . import metrics
+
+INITIAL_LIMIT = 4
+MAX_PER_HOST = int(os.getenv("OBE_MAX_CONNECTIONS_PER_HOST", 16))
+MEMORY_BUDGET = int(os.getenv("OBE_MEMORY_BUDGET_MB", 1024)) * 1024**2
+
+
+def bounded_map(fn, items, max_workers=None, max_in_flight=None, ordered=False):
+    """Yield ``(item, fn(item))`` with at most ``max_in_flight`` pending calls.
+
+    Results are yielded as they complete, or in the order of ``items`` when
+    ``ordered`` is set. max_workers defaults to the controller's per-host cap:
+    threads mostly wait on the network and the controller decides how many of
+    them fetch at once. max_in_flight defaults to twice max_workers. Pending
+    calls are cancelled when the generator is closed early.
+    """
+    max_workers = max_workers or CONTROLLER.max_per_host
+    max_in_flight = max(max_in_flight or 2 * max_workers, 1)
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+
+    def fill():
+        while len(pending) < max_in_flight:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            pending.append((item, metrics.submit(executor, fn, item)))
+
+    try:
+        fill()
+        while pending:
+            if ordered:
+                item, future = pending.popleft()
+            else:
+                wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+                position = next(i for i, (_, f) in enumerate(pending) if f.done())
+                item, future = pending[position]
+                del pending[position]
+            result = future.result()
+            yield item, result
+            fill()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+async def bounded_map_async(fn, items, max_in_flight=None, ordered=False):
+    """Async generator version of :func:`bounded_map`.
+
+    Each call runs in the default executor via ``asyncio.to_thread``, at most
+    ``max_in_flight`` of them ahead of the consumer.
+    """
+    max_in_flight = max(max_in_flight or 2 * CONTROLLER.max_per_host, 1)
+    items = iter(items)
+    pending = deque()
+
+    def fill():
+        while len(pending) < max_in_flight:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            task = asyncio.ensure_future(asyncio.to_thread(fn, item))
+            pending.append((item, task))
+
+    try:
+        fill()
+        while pending:
+            if ordered:
+                item, task = pending.popleft()
+            else:
+                await asyncio.wait(
+                    [task for _, task in pending], return_when=asyncio.FIRST_COMPLETED
+                )
+                position = next(i for i, (_, t) in enumerate(pending) if t.done())
+                item, task = pending[position]
+                del pending[position]
+            result = await task
+            yield item, result
+            fill()
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+
+class Throttled(Exception):
+    """Raised inside a controller slot when the server asks us to slow down."""
+
+
+class HostState:
+    """AIMD state of one host."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = limit
+        self.increases = 0
+        self.decreases = 0
+        self.last_decrease = 0.0
+        self.last_reason = "initial"
+        self.window_bytes = 0
+        self.window_count = 0
+        self.window_start = time.perf_counter()
+        self.last_throughput = None
+
+    def to_dict(self):
+        return {
+            "limit": self.limit,
+            "peak": self.peak,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "last_decision": self.last_reason,
+        }
+
+
+class AdaptiveController:
+    """AIMD concurrency limits per host with a global memory budget.
+
+    Every fetch runs inside :meth:`slot`, which blocks until the host is below
+    its limit and the bytes reserved for in-flight tiles (estimated from the
+    tiles fetched so far) fit in ``memory_budget``. After each window of
+    ``limit`` successful fetches the host's throughput is compared with the
+    previous window: the limit grows by one while throughput improves by at
+    least ``growth_threshold`` and otherwise holds. A throttled fetch halves
+    the limit, at most once per ``cooldown`` seconds. Decisions are reported
+    through :func:`obe.metrics.annotate` under ``concurrency``.
+    """
+
+    def __init__(
+        self,
+        initial_limit=INITIAL_LIMIT,
+        max_per_host=MAX_PER_HOST,
+        memory_budget=MEMORY_BUDGET,
+        growth_threshold=0.05,
+        cooldown=1.0,
+    ):
+        self.initial_limit = initial_limit
+        self.max_per_host = max_per_host
+        self.memory_budget = memory_budget
+        self.growth_threshold = growth_threshold
+        self.cooldown = cooldown
+        self.hosts = {}
+        self.reserved = 0
+        self.tile_estimate = 0
+        self._condition = threading.Condition()
+
+    def configure(self, max_per_host=None, memory_budget=None):
+        """Change the caps; existing host limits are clamped to the new cap."""
+        with self._condition:
+            if max_per_host is not None:
+                self.max_per_host = max(int(max_per_host), 1)
+                for state in self.hosts.values():
+                    state.limit = min(state.limit, self.max_per_host)
+            if memory_budget is not None:
+                self.memory_budget = memory_budget
+            self._condition.notify_all()
+
+    def limit(self, url_or_host):
+        host = urlsplit(url_or_host).netloc or url_or_host
+        with self._condition:
+            state = self.hosts.get(host)
+            return state.limit if state else min(self.initial_limit, self.max_per_host)
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            limit = min(self.initial_limit, self.max_per_host)
+            state = self.hosts[host] = HostState(limit)
+        return state
+
+    @contextmanager
+    def slot(self, url, tile=True):
+        """Hold one fetch slot for ``url``; set ``record.bytes`` when done.
+
+        Raise :class:`Throttled` (or let a 429/5xx/timeout error escape) to
+        make the host back off. Only ``tile`` fetches reserve memory and feed
+        the tile size estimate and the throughput windows; small requests
+        (HEAD, status polls, indexes) just take a slot. The reservation is
+        released when the slot is, so it does not count the parsed tile.
+        """
+        host = urlsplit(url).netloc
+        with self._condition:
+            state = self._state(host)
+            estimate = self.tile_estimate if tile else 0
+            while state.in_flight >= state.limit or (
+                tile and self.reserved and self.reserved + estimate > self.memory_budget
+            ):
+                self._condition.wait()
+            state.in_flight += 1
+            self.reserved += estimate
+        record = metrics.StageRecord()
+        try:
+            yield record
+        except BaseException as exc:
+            self._release(host, estimate, None, throttled=is_throttling(exc))
+            raise
+        else:
+            self._release(host, estimate, record.bytes if tile else None)
+
+    def _release(self, host, estimate, nbytes, throttled=False):
+        with self._condition:
+            state = self.hosts[host]
+            state.in_flight -= 1
+            self.reserved -= estimate
+            if nbytes is not None:
+                self.tile_estimate = (
+                    nbytes if not self.tile_estimate
+                    else 0.8 * self.tile_estimate + 0.2 * nbytes
+                )
+                self._observe(state, nbytes)
+            elif throttled:
+                self._decrease(host, state)
+            self._condition.notify_all()
+
+    def _observe(self, state, nbytes):
+        state.window_bytes += nbytes
+        state.window_count += 1
+        if state.window_count < state.limit:
+            return
+        now = time.perf_counter()
+        throughput = state.window_bytes / max(now - state.window_start, 1e-9)
+        previous = state.last_throughput
+        if state.limit < self.max_per_host and (
+            previous is None or throughput >= previous * (1 + self.growth_threshold)
+        ):
+            state.limit += 1
+            state.increases += 1
+            state.peak = max(state.peak, state.limit)
+            state.last_reason = f"increase to {state.limit}: {_rate(throughput)}"
+            self._report()
+        state.last_throughput = throughput
+        state.window_bytes = 0
+        state.window_count = 0
+        state.window_start = now
+
+    def _decrease(self, host, state):
+        now = time.perf_counter()
+        if now - state.last_decrease < self.cooldown:
+            return
+        state.last_decrease = now
+        state.limit = max(state.limit // 2, 1)
+        state.decreases += 1
+        state.last_reason = f"back off to {state.limit}: throttled"
+        state.last_throughput = None
+        state.window_bytes = 0
+        state.window_count = 0
+        state.window_start = now
+        self._report()
+
+    def _report(self):
+        if self.hosts:
+            metrics.annotate(
+                "concurrency",
+                {host: state.to_dict() for host, state in self.hosts.items()},
+            )
+
+    def report(self):
+        """Publish the current per-host limits to the active metrics."""
+        with self._condition:
+            self._report()
+
+
+def is_throttling(exc):
+    """Whether ``exc`` means the server is overloaded (429, 5xx, timeout)."""
+    import requests
+
+    if isinstance(exc, Throttled):
+        return True
+    if isinstance(exc, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return False
+
+
+def _rate(bytes_per_second):
+    return f"{bytes_per_second / 1024**2:.1f} MB/s"
+
+
+# Shared by every source, so limits learnt in one run carry over to the next
+# in long-running processes.
+CONTROLLER = AdaptiveController()
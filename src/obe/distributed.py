@@ -0,0 +1,449 @@
+"""One extraction spread over several processes or machines.
+
+A coordinator plans the tiles of an extraction and puts them into a work
+queue: a SQLite database in a queue directory that every machine can reach
+(e.g. on a shared filesystem). Any number of workers claim tiles from it,
+each for a lease that they renew while working. A tile whose worker crashed
+becomes claimable again once its lease expires, and failed tiles are retried
+up to ``max_attempts`` times. Workers write each tile's buildings to
+``tiles/<key>.parquet`` in the queue directory and a final merge step
+combines them into one output:
+
+    obe coordinate --source google --input continent.geojson --queue /shared/run
+    obe worker --queue /shared/run        # on as many hosts as you like
+    obe merge --queue /shared/run --output buildings.parquet
+
+Only Google and Microsoft are supported: their S2 tiles and quadkeys
+partition the buildings, so the per-tile results never overlap.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from . import metrics
+
+SOURCES = ["google", "microsoft"]
+
+# Tile statuses in the queue.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+QUEUE_FILE = "queue.sqlite"
+TILES_DIR = "tiles"
+
+# Seconds a claimed tile belongs to its worker without a renewal.
+LEASE_SECONDS = 300
+# Attempts of a tile before it is marked as failed.
+MAX_ATTEMPTS = 3
+# Seconds an idle worker waits before checking the other workers' tiles.
+POLL_INTERVAL = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS tiles (
+    key TEXT PRIMARY KEY,
+    aois TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    rows INTEGER,
+    error TEXT
+);
+"""
+
+
+class WorkQueue:
+    """Tiles of one extraction in a SQLite database inside ``queue_dir``.
+
+    Every method opens its own connection, so a queue can be used from any
+    thread and by processes on other hosts at the same time.
+    """
+
+    def __init__(self, queue_dir):
+        self.queue_dir = str(queue_dir)
+        self.path = os.path.join(self.queue_dir, QUEUE_FILE)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def create(self, job, tiles):
+        """Store the job parameters and queue ``tiles`` ({key: AOI positions})."""
+        if os.path.exists(self.path):
+            raise ValueError(f"Queue already exists: {self.queue_dir}")
+        os.makedirs(os.path.join(self.queue_dir, TILES_DIR), exist_ok=True)
+        with closing(self._connect()) as db:
+            db.executescript(_SCHEMA)
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "INSERT INTO job VALUES (?, ?)",
+                [(name, json.dumps(value)) for name, value in job.items()],
+            )
+            db.executemany(
+                "INSERT INTO tiles (key, aois, status) VALUES (?, ?, ?)",
+                [(key, json.dumps(aois), QUEUED) for key, aois in tiles.items()],
+            )
+            db.execute("COMMIT")
+
+    def job(self):
+        if not os.path.exists(self.path):
+            raise ValueError(f"No work queue in {self.queue_dir}")
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT name, value FROM job").fetchall()
+        return {row["name"]: json.loads(row["value"]) for row in rows}
+
+    def claim(self, worker, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        """Lease the next queued or expired tile to worker.
+
+        Returns ``(key, aoi positions)``, or None if no tile can be claimed.
+        Tiles whose lease expired after their last attempt are marked failed.
+        """
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "UPDATE tiles SET status = ?, error = 'lease expired', worker = NULL"
+                " WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, RUNNING, now, max_attempts),
+            )
+            row = db.execute(
+                "SELECT key, aois FROM tiles"
+                " WHERE status = ? OR (status = ? AND lease_expires < ?)"
+                " ORDER BY key LIMIT 1",
+                (QUEUED, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE tiles SET status = ?, worker = ?, lease_expires = ?,"
+                    " attempts = attempts + 1 WHERE key = ?",
+                    (RUNNING, worker, now + lease_seconds, row["key"]),
+                )
+            db.execute("COMMIT")
+        return None if row is None else (row["key"], json.loads(row["aois"]))
+
+    def renew(self, worker, lease_seconds=LEASE_SECONDS):
+        """Extend the leases of every tile worker is processing."""
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE tiles SET lease_expires = ? WHERE status = ? AND worker = ?",
+                (time.time() + lease_seconds, RUNNING, worker),
+            )
+
+    def complete(self, key, worker, rows):
+        """Mark key done; False if worker lost its lease to another worker."""
+        with closing(self._connect()) as db:
+            cursor = db.execute(
+                "UPDATE tiles SET status = ?, rows = ?, error = NULL, worker = NULL"
+                " WHERE key = ? AND status = ? AND worker = ?",
+                (DONE, rows, key, RUNNING, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, key, worker, error, max_attempts=MAX_ATTEMPTS):
+        """Queue key again, or mark it failed after max_attempts."""
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE tiles SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+                " error = ?, worker = NULL, lease_expires = NULL"
+                " WHERE key = ? AND status = ? AND worker = ?",
+                (max_attempts, FAILED, QUEUED, error, key, RUNNING, worker),
+            )
+
+    def counts(self):
+        """Number of tiles per status."""
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT status, COUNT(*) AS n FROM tiles GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def tiles(self):
+        """All tiles as dicts, ordered by key."""
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT * FROM tiles ORDER BY key").fetchall()
+        return [dict(row) for row in rows]
+
+    def tile_path(self, key):
+        return os.path.join(self.queue_dir, TILES_DIR, f"{key}.parquet")
+
+
+def create_queue(
+    queue_dir,
+    source,
+    aoi_input,
+    location=None,
+    clip_mode="within",
+    compact=None,
+    max_attempts=MAX_ATTEMPTS,
+):
+    """Plan the tiles of an extraction and queue them in queue_dir.
+
+    Returns the number of tiles queued.
+    """
+    import numpy as np
+
+    from .batch import plan_tiles
+    from .clip import check_clip_mode, read_aoi
+    from .schema import resolve_compact
+
+    source = source.lower()
+    if source not in SOURCES:
+        raise ValueError(f"Distributed extraction supports {SOURCES}, not {source}")
+    check_clip_mode(clip_mode)
+    aoi_gdf = read_aoi(aoi_input)
+    with metrics.stage("plan"):
+        groups, _ = plan_tiles(source, np.asarray(aoi_gdf.geometry.values), location)
+    job = {
+        "source": source,
+        "aoi": json.loads(aoi_gdf[[aoi_gdf.geometry.name]].to_json()),
+        "location": location,
+        "clip_mode": clip_mode,
+        "compact": resolve_compact(compact, aoi_gdf),
+        "max_attempts": max_attempts,
+    }
+    WorkQueue(queue_dir).create(
+        job, {key: positions.tolist() for key, positions in groups.items()}
+    )
+    return len(groups)
+
+
+def run_worker(queue_dir, worker=None, parallel=4, lease_seconds=LEASE_SECONDS):
+    """Process tiles of the queue in queue_dir until none are left.
+
+    Up to ``parallel`` tiles are processed at once. The worker keeps polling
+    while other workers hold tiles, so it can take over the tiles of a
+    worker that died. Returns the number of tiles this worker completed.
+    """
+    import numpy as np
+
+    from .batch import plan_tiles
+    from .clip import join_buildings, read_aoi
+    from .concurrency import bounded_map
+    from .output import write_geoparquet
+
+    queue = WorkQueue(queue_dir)
+    job = queue.job()
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    max_attempts = job["max_attempts"]
+    aois = np.asarray(read_aoi(job["aoi"]).geometry.values)
+    _, fetch = plan_tiles(job["source"], aois, job["location"], job["compact"])
+
+    def process(claimed):
+        key, positions = claimed
+        try:
+            gdf = fetch(key)
+            if gdf is None or gdf.empty:
+                return 0, None
+            gdf = join_buildings(gdf, aois[positions], positions, job["clip_mode"])
+            gdf = gdf.drop(columns="aoi_id")
+            if gdf.empty:
+                return 0, None
+            path = queue.tile_path(key)
+            partial = f"{path}.{worker}.partial"
+            with metrics.stage("write", rows_in=len(gdf)) as record:
+                write_geoparquet(gdf, partial)
+                record.bytes = os.path.getsize(partial)
+            os.replace(partial, path)
+            return len(gdf), None
+        except Exception as exc:
+            return None, f"{type(exc).__name__}: {exc}"
+
+    def claims():
+        while True:
+            claimed = queue.claim(worker, lease_seconds, max_attempts)
+            if claimed is None:
+                return
+            yield claimed
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(lease_seconds / 3):
+            queue.renew(worker, lease_seconds)
+
+    renewer = threading.Thread(target=heartbeat, daemon=True)
+    renewer.start()
+    completed = 0
+    try:
+        while True:
+            results = bounded_map(
+                process, claims(), max_workers=parallel, max_in_flight=parallel
+            )
+            for (key, _), (rows, error) in results:
+                if error is not None:
+                    print(f"{worker}: tile {key} failed: {error}")
+                    queue.fail(key, worker, error, max_attempts)
+                elif queue.complete(key, worker, rows):
+                    completed += 1
+            if not queue.counts().get(RUNNING):
+                break
+            time.sleep(POLL_INTERVAL)
+    finally:
+        stop.set()
+        renewer.join()
+    metrics.annotate("tiles", completed)
+    return completed
+
+
+def merge(queue_dir, output_path=None, file_format=None):
+    """Combine the tiles of a finished queue into one GeoDataFrame.
+
+    Raises ValueError while tiles are still queued, running or failed. The
+    result is written to output_path when given.
+    """
+    import geopandas as gpd
+
+    from .app import infer_format_from_extension
+    from .output import write_buildings
+
+    queue = WorkQueue(queue_dir)
+    job = queue.job()
+    tiles = queue.tiles()
+    unfinished = [tile for tile in tiles if tile["status"] != DONE]
+    if unfinished:
+        failed = [
+            f"{tile['key']}: {tile['error']}"
+            for tile in unfinished
+            if tile["status"] == FAILED
+        ]
+        raise ValueError(
+            f"{len(unfinished)} of {len(tiles)} tiles are not done {queue.counts()}"
+            + "".join(f"\n  {line}" for line in failed)
+        )
+
+    if job["source"] == "google":
+        from .google import combine_buildings
+    else:
+        from .microsoft import combine_buildings
+
+    with metrics.stage("read") as record:
+        batches = [
+            gpd.read_parquet(queue.tile_path(tile["key"]))
+            for tile in tiles
+            if tile["rows"]
+        ]
+        record.rows_out = sum(len(gdf) for gdf in batches)
+    result = combine_buildings(batches)
+    if job["source"] == "microsoft":
+        result["id"] = range(len(result))
+
+    if output_path:
+        file_format = file_format or infer_format_from_extension(output_path)
+        if not file_format:
+            raise ValueError(f"Cannot infer format from output file: {output_path}")
+        write_buildings(result, output_path, file_format)
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="obe",
+        description="Run one extraction across several workers through a shared "
+        "work queue.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    coordinate = commands.add_parser(
+        "coordinate", help="Plan the tiles of an extraction and queue them"
+    )
+    coordinate.add_argument("--source", required=True, choices=SOURCES)
+    coordinate.add_argument(
+        "--input", help="Path to the GeoJSON file containing the AOI", required=True
+    )
+    coordinate.add_argument(
+        "--location",
+        help="Location to filter the dataset (required for Microsoft data source)",
+    )
+    coordinate.add_argument(
+        "--clip-mode",
+        help="How buildings are matched against the AOI: within (default), "
+        "intersects, centroid, or clip (cut at the AOI boundary)",
+        default="within",
+        choices=["within", "intersects", "centroid", "clip"],
+    )
+    coordinate.add_argument(
+        "--compact",
+        help="Store attributes in compact dtypes (default: only for large AOIs)",
+        action=argparse.BooleanOptionalAction,
+    )
+    coordinate.add_argument(
+        "--max-attempts",
+        help=f"Attempts of a tile before it is marked failed (default: {MAX_ATTEMPTS})",
+        type=int,
+        default=MAX_ATTEMPTS,
+    )
+
+    worker = commands.add_parser("worker", help="Process queued tiles")
+    worker.add_argument(
+        "--worker-id", help="Name of this worker (default: hostname and process id)"
+    )
+    worker.add_argument(
+        "--parallel",
+        help="Tiles processed at once by this worker (default: 4)",
+        type=int,
+        default=4,
+    )
+    worker.add_argument(
+        "--lease-seconds",
+        help=f"Seconds before an unrenewed tile can be taken over by another "
+        f"worker (default: {LEASE_SECONDS})",
+        type=float,
+        default=LEASE_SECONDS,
+    )
+    worker.add_argument(
+        "--profile",
+        help="Print per-stage timing, throughput and memory after the run",
+        action="store_true",
+    )
+
+    merge_parser = commands.add_parser(
+        "merge", help="Combine the tiles of a finished queue into one output"
+    )
+    merge_parser.add_argument(
+        "--output", help="Path of the output file", required=True
+    )
+    merge_parser.add_argument(
+        "--format",
+        help="Output format (default: inferred from --output)",
+        choices=["geojson", "geojsonseq", "geoparquet", "geopackage", "shapefile"],
+    )
+
+    for command in (coordinate, worker, merge_parser):
+        command.add_argument(
+            "--queue", help="Directory of the work queue", required=True
+        )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "coordinate":
+        count = create_queue(
+            args.queue,
+            args.source,
+            args.input,
+            args.location,
+            args.clip_mode,
+            args.compact,
+            args.max_attempts,
+        )
+        print(f"Queued {count} tiles in {args.queue}")
+    elif args.command == "worker":
+        with metrics.collect() as run:
+            completed = run_worker(
+                args.queue, args.worker_id, args.parallel, args.lease_seconds
+            )
+        print(f"Completed {completed} tiles.")
+        if args.profile:
+            print(run.summary())
+    else:
+        result = merge(args.queue, args.output, args.format)
+        print(f"Merged {len(result)} building footprints into {args.output}")
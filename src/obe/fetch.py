@@ -0,0 +1,78 @@
+"""HTTP helpers shared by the source modules."""
+
+import threading
+import time
+
+import requests
+
+from . import metrics
+from .concurrency import CONTROLLER, is_throttling
+
+_local = threading.local()
+
+# Attempts of a throttled request (429, 5xx, timeout) before giving up.
+RETRIES = 3
+RETRY_DELAY = 0.5
+# Longest wait before a retry, whatever Retry-After asks for.
+MAX_RETRY_DELAY = 60
+
+# (connect, read) timeout in seconds of requests that do not pass their own;
+# a timeout counts as throttling and is retried.
+TIMEOUT = (10, 120)
+
+
+def get_session():
+    """A per-thread requests session, so tile downloads reuse connections."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        _local.session = session
+    return session
+
+
+def retry_delay(exc, attempt):
+    """Seconds to wait before retrying: Retry-After if given, else exponential.
+
+    Never more than MAX_RETRY_DELAY.
+    """
+    delay = RETRY_DELAY * 2**attempt
+    response = getattr(exc, "response", None)
+    if response is not None:
+        try:
+            delay = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            pass
+    return min(max(delay, 0), MAX_RETRY_DELAY)
+
+
+def request(method, url, tile=False, **kwargs):
+    """Send a request through the shared concurrency controller.
+
+    Throttled requests make the host back off and are retried up to RETRIES
+    times; other HTTP errors are raised immediately. Set ``tile`` for tile
+    downloads, the only requests the controller sizes its estimates on.
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    for attempt in range(RETRIES + 1):
+        try:
+            with CONTROLLER.slot(url, tile) as slot:
+                response = get_session().request(method, url, **kwargs)
+                response.raise_for_status()
+                slot.bytes = len(response.content)
+            return response
+        except Exception as exc:
+            if attempt == RETRIES or not is_throttling(exc):
+                raise
+            metrics.increment("retries")
+            time.sleep(retry_delay(exc, attempt))
+
+
+def fetch_bytes(url, tile=True, **kwargs):
+    """GET ``url`` and return the response body, recorded as a download stage.
+
+    Pass ``tile=False`` for bodies that are not building data, like indexes.
+    """
+    with metrics.stage("download") as record:
+        content = request("GET", url, tile, **kwargs).content
+        record.bytes = len(content)
+    return content
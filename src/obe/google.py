@@ -1,16 +1,29 @@
 import argparse
+import asyncio
+import io
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
 from urllib.parse import urljoin
 
 import geopandas as gpd
 import pandas as pd
 import s2sphere
+import shapely
 from shapely import wkt
 from tqdm import tqdm
 
-BUILDING_BASE_URL = "https://storage.googleapis.com/open-buildings-data/v3/polygons_s2_level_6_gzip_no_header/"
+from . import metrics
+from .arrow import check_return_type
+from .clip import check_clip_mode, clip_buildings, read_aoi
+from .concurrency import bounded_map, bounded_map_async
+from .fetch import fetch_bytes
+from .output import concat_batches
+from .schema import SCHEMAS, resolve_compact
+
+BUILDING_BASE_URL = os.getenv(
+    "OBE_GOOGLE_BASE_URL",
+    "https://storage.googleapis.com/open-buildings-data/v3/polygons_s2_level_6_gzip_no_header/",
+)
 
 
 def get_s2_tiles(bounds):
@@ -39,45 +52,127 @@ def get_s2_tiles(bounds):
     return [cell.to_token() for cell in covering]
 
 
-def download_tile_buildings(
-    tile_id: str, region_geometry
-) -> Optional[gpd.GeoDataFrame]:
-    """Download buildings for a single S2 tile."""
-    # try:
-    tile_url = urljoin(BUILDING_BASE_URL, f"{tile_id}_buildings.csv.gz")
-    df = pd.read_csv(tile_url, compression="gzip", header=None)
+TILE_COLUMNS = [
+    "latitude",
+    "longitude",
+    "area_in_meters",
+    "confidence",
+    "geometry_wkt",
+    "full_plus_code",
+]
+
+
+def read_tile(tile_id: str, compact: bool = False) -> Optional[gpd.GeoDataFrame]:
+    """Download and parse every building of a single S2 tile, None if empty.
+
+    With compact the attributes are parsed straight into SCHEMAS["google"].
+    """
+    return parse_tile(fetch_bytes(tile_url(tile_id)), compact)
+
+
+def tile_url(tile_id: str) -> str:
+    return urljoin(BUILDING_BASE_URL, f"{tile_id}_buildings.csv.gz")
+
+
+def parse_tile(content: bytes, compact: bool = False) -> Optional[gpd.GeoDataFrame]:
+    """Parse the gzipped CSV of a downloaded S2 tile, None if empty."""
+    dtype = {**SCHEMAS["google"], "geometry_wkt": object} if compact else None
+    with metrics.stage("decompress") as record:
+        try:
+            df = pd.read_csv(
+                io.BytesIO(content),
+                compression="gzip",
+                header=None,
+                names=TILE_COLUMNS,
+                dtype=dtype,
+            )
+        except pd.errors.EmptyDataError:
+            return None
+        record.rows_out = len(df)
 
     if len(df) == 0:
         return None
 
-    df.columns = [
-        "latitude",
-        "longitude",
-        "area_in_meters",
-        "confidence",
-        "geometry_wkt",
-        "full_plus_code",
-    ]
-    geometries = df["geometry_wkt"].apply(wkt.loads)
+    with metrics.stage("parse", rows_in=len(df)) as record:
+        geometries = df["geometry_wkt"].apply(wkt.loads)
 
-    gdf = gpd.GeoDataFrame(
-        df.drop("geometry_wkt", axis=1), geometry=geometries, crs="EPSG:4326"
-    )
-    return gdf[gdf.geometry.within(region_geometry)]
+        gdf = gpd.GeoDataFrame(
+            df.drop("geometry_wkt", axis=1), geometry=geometries, crs="EPSG:4326"
+        )
+        record.rows_out = len(gdf)
+    return gdf
 
 
-def process_building_footprints(aoi_input):
-    """Process building footprints with concurrent downloads."""
-    if isinstance(aoi_input, str):
-        aoi_gdf = gpd.read_file(aoi_input)
-    elif isinstance(aoi_input, dict):
-        aoi_gdf = gpd.GeoDataFrame.from_features(aoi_input["features"])
-    else:
-        raise ValueError(
-            "aoi_input must be either a file path (str) or a GeoJSON dictionary"
+def parse_tile_table(content, region_geometry, clip_mode="within", compact=False):
+    """Arrow version of parse_tile, clipped to region_geometry; None if empty.
+
+    The CSV is read by pyarrow and the WKT parsed only for the clip.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as csv
+
+    from .arrow import clip_table
+    from .schema import compact_table
+
+    with metrics.stage("decompress") as record:
+        try:
+            table = csv.read_csv(
+                pa.CompressedInputStream(pa.BufferReader(content), "gzip"),
+                read_options=csv.ReadOptions(column_names=TILE_COLUMNS),
+                convert_options=csv.ConvertOptions(
+                    column_types={"full_plus_code": pa.string()}
+                ),
+            )
+        except pa.ArrowInvalid as exc:
+            if "Empty CSV file" in str(exc):
+                return None
+            raise
+        record.rows_out = len(table)
+
+    if len(table) == 0:
+        return None
+
+    with metrics.stage("parse", rows_in=len(table)) as record:
+        geometries = shapely.from_wkt(
+            table["geometry_wkt"].to_numpy(zero_copy_only=False)
         )
+        attributes = table.drop_columns(["geometry_wkt"])
+        if compact:
+            attributes = compact_table(attributes, "google")
+        record.rows_out = len(attributes)
+    return clip_table(attributes, geometries, region_geometry, clip_mode)
+
+
+def download_tile_buildings(
+    tile_id: str, region_geometry, clip_mode: str = "within", compact: bool = False
+) -> Optional[gpd.GeoDataFrame]:
+    """Download buildings for a single S2 tile, clipped to region_geometry."""
+    gdf = read_tile(tile_id, compact)
+    if gdf is None:
+        return None
+    return clip_buildings(gdf, region_geometry, clip_mode)
+
+
+def iter_building_footprints(
+    aoi_input,
+    clip_mode="within",
+    compact=None,
+    max_in_flight=None,
+    return_type="geopandas",
+):
+    """Yield (S2 token, GeoDataFrame) for every tile as soon as it is processed.
+
+    clip_mode selects how buildings are matched against the AOI, see obe.clip.
+    compact selects compact attribute dtypes, see obe.schema; None enables
+    them for large AOIs. At most max_in_flight tiles are downloaded ahead of
+    the consumer, see obe.concurrency.bounded_map. With return_type "arrow"
+    pyarrow Tables are yielded instead, see obe.arrow.
+    """
+    check_clip_mode(clip_mode)
+    check_return_type(return_type)
+    aoi_gdf = read_aoi(aoi_input)
+    compact = resolve_compact(compact, aoi_gdf)
 
-    all_buildings = []
     for aoi_row in aoi_gdf.itertuples():
         region_geometry = aoi_row.geometry
         bounds = region_geometry.bounds
@@ -85,29 +180,30 @@ def process_building_footprints(aoi_input):
 
         print(f"Found {len(tile_ids)} S2 tiles covering the AOI")
 
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            future_to_tile = {
-                executor.submit(
-                    download_tile_buildings, tile_id, region_geometry
-                ): tile_id
-                for tile_id in tile_ids
-            }
-
-            for future in tqdm(
-                as_completed(future_to_tile),
-                total=len(tile_ids),
-                desc="Downloading tiles",
-            ):
-                # try:
-                gdf = future.result()
-                if gdf is not None and not gdf.empty:
-                    all_buildings.append(gdf)
-            # except Exception as e:
-            #     # raise e
-            #     print(f"Error processing tile: {e}")
+        def download(tile_id):
+            if return_type == "arrow":
+                return parse_tile_table(
+                    fetch_bytes(tile_url(tile_id)), region_geometry, clip_mode, compact
+                )
+            return download_tile_buildings(
+                tile_id, region_geometry, clip_mode, compact
+            )
 
+        results = bounded_map(download, tile_ids, max_in_flight=max_in_flight)
+        for tile_id, gdf in tqdm(
+            results, total=len(tile_ids), desc="Downloading tiles"
+        ):
+            if gdf is not None and len(gdf):
+                yield tile_id, gdf
+
+
+def combine_buildings(all_buildings):
+    """Concatenate tile batches, or an empty frame with the Google columns."""
     if all_buildings:
-        return pd.concat(all_buildings, ignore_index=True)
+        with metrics.stage("concat") as record:
+            result = concat_batches(all_buildings)
+            record.rows_out = len(result)
+        return result
     else:
         return gpd.GeoDataFrame(
             columns=[
@@ -122,6 +218,66 @@ def process_building_footprints(aoi_input):
         )
 
 
+def process_building_footprints(
+    aoi_input, clip_mode="within", compact=None, return_type="geopandas"
+):
+    """Process building footprints with concurrent downloads.
+
+    See iter_building_footprints for clip_mode, compact and return_type.
+    """
+    all_buildings = [
+        gdf
+        for _, gdf in iter_building_footprints(
+            aoi_input, clip_mode, compact, return_type=return_type
+        )
+    ]
+    if return_type == "arrow":
+        from .arrow import concat_tables
+
+        return concat_tables(all_buildings)
+    return combine_buildings(all_buildings)
+
+
+async def iter_building_footprints_async(
+    aoi_input, clip_mode="within", compact=None, max_in_flight=None
+):
+    """Async version of iter_building_footprints for use in an event loop.
+
+    Tiles are downloaded and parsed in threads, so the loop is never blocked.
+    """
+    check_clip_mode(clip_mode)
+    aoi_gdf = await asyncio.to_thread(read_aoi, aoi_input)
+    compact = resolve_compact(compact, aoi_gdf)
+
+    for aoi_row in aoi_gdf.itertuples():
+        region_geometry = aoi_row.geometry
+        tile_ids = get_s2_tiles(region_geometry.bounds)
+
+        def download(tile_id):
+            return download_tile_buildings(
+                tile_id, region_geometry, clip_mode, compact
+            )
+
+        async for tile_id, gdf in bounded_map_async(
+            download, tile_ids, max_in_flight=max_in_flight
+        ):
+            if gdf is not None and not gdf.empty:
+                yield tile_id, gdf
+
+
+async def process_building_footprints_async(
+    aoi_input, clip_mode="within", compact=None
+):
+    """Async version of process_building_footprints."""
+    all_buildings = [
+        gdf
+        async for _, gdf in iter_building_footprints_async(
+            aoi_input, clip_mode, compact
+        )
+    ]
+    return await asyncio.to_thread(combine_buildings, all_buildings)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Process Google global building footprints within a given area of interest (AOI)."
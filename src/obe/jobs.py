@@ -0,0 +1,168 @@
+"""Background extraction jobs with a bounded result cache.
+
+Used by the Streamlit app so that extractions run outside the script thread,
+concurrent users do not block each other, and identical requests (same AOI
+geometry, source, format and location) are served from the cache or attach
+to the job already computing them instead of downloading everything again.
+Every request gets its own output directory under ``work_dir``.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def aoi_hash(aoi_gdf):
+    """Stable hash of the AOI geometries, ignoring properties and ordering.
+
+    Vertices and features are normalized, so reordering either gives the
+    same hash.
+    """
+    import shapely
+
+    geometries = shapely.normalize(aoi_gdf.to_crs("EPSG:4326").geometry.values)
+    digest = hashlib.sha256()
+    for wkb in sorted(shapely.to_wkb(geometries, output_dimension=2)):
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def job_key(aoi_gdf, source, file_format, location=None):
+    params = json.dumps([source, file_format, location or ""])
+    return hashlib.sha256(f"{aoi_hash(aoi_gdf)}:{params}".encode()).hexdigest()[:24]
+
+
+class Job:
+    """State of one extraction, updated by the worker thread."""
+
+    def __init__(self, key, source, file_format, location, output_path):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.source = source
+        self.file_format = file_format
+        self.location = location
+        self.output_path = output_path
+        self.status = QUEUED
+        self.error = None
+        self.result = None
+        self.metrics = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED)
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def progress(self):
+        """Current stage, elapsed seconds and counts so far, for display."""
+        stages = self.metrics.to_dict()["stages"] if self.metrics else {}
+        end = self.finished or time.time()
+        return {
+            "status": self.status,
+            "stage": self.metrics.current_stage if self.metrics else None,
+            "elapsed": end - (self.started or self.submitted),
+            "bytes_downloaded": stages.get("download", {}).get("bytes", 0),
+            "buildings": stages.get("clip", {}).get("rows_out", 0),
+        }
+
+
+class JobManager:
+    """Run extractions in a worker pool and cache the finished ones.
+
+    At most ``cache_size`` finished jobs are kept; the least recently used
+    one is evicted together with its output directory.
+    """
+
+    def __init__(self, work_dir, max_workers=2, cache_size=32):
+        self.work_dir = str(work_dir)
+        self.cache_size = cache_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = {}
+        self._by_key = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def submit(self, aoi_gdf, source, file_format, location=None):
+        """Return the job for this request, starting it only on a cache miss."""
+        from .app import get_output_extension
+
+        key = job_key(aoi_gdf, source, file_format, location)
+        with self._lock:
+            job = self._by_key.get(key)
+            if job is not None:
+                if job.status != FAILED:
+                    self._by_key.move_to_end(key)
+                    return job
+                del self._by_key[key]  # retry failed requests
+                self._jobs.pop(job.id, None)
+
+            output_dir = os.path.join(self.work_dir, key)
+            os.makedirs(output_dir, exist_ok=True)
+            output_path = os.path.join(
+                output_dir,
+                f"buildings_{source}{get_output_extension(file_format)}",
+            )
+            job = Job(key, source, file_format, location, output_path)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self._evict()
+
+        aoi = json.loads(aoi_gdf.to_crs("EPSG:4326").to_json())
+        self.executor.submit(self._run, job, aoi)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, aoi):
+        from .app import download_buildings
+
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            with metrics.collect() as run:
+                job.metrics = run
+                job.result = download_buildings(
+                    job.source,
+                    aoi,
+                    job.output_path,
+                    job.file_format,
+                    job.location,
+                )
+            job.status = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            job._done.set()
+
+    def _evict(self):
+        finished = [key for key, job in self._by_key.items() if job.done]
+        while len(finished) > self.cache_size:
+            key = finished.pop(0)
+            job = self._by_key.pop(key)
+            self._jobs.pop(job.id, None)
+            shutil.rmtree(os.path.dirname(job.output_path), ignore_errors=True)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
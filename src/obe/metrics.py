@@ -0,0 +1,309 @@
+"""Lightweight per-stage instrumentation for obe runs.
+
+Collection is opt-in: wrap a run in :func:`collect` and every instrumented
+stage (download, parse, clip, concat, write, ...) executed inside it records
+wall time, bytes transferred, rows in/out and the peak resident memory of the
+process while the stage ran, sampled every ``SAMPLE_INTERVAL`` seconds by a
+background thread. Outside of :func:`collect` the instrumentation is a no-op.
+
+    from obe import metrics
+    from obe.app import download_buildings
+
+    with metrics.collect() as run:
+        download_buildings("google", "aoi.geojson", "out.parquet")
+    print(run.summary())
+    run.write_json("metrics.json")
+"""
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_current = contextvars.ContextVar("obe_metrics", default=None)
+
+# Seconds between two memory samples of the running stages.
+SAMPLE_INTERVAL = 0.05
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_bytes():
+    """Current resident set size of this process in bytes, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class StageRecord:
+    """Counters for one execution of a stage, filled in by the caller."""
+
+    __slots__ = ("bytes", "rows_in", "rows_out")
+
+    def __init__(self, rows_in=0):
+        self.bytes = 0
+        self.rows_in = rows_in or 0
+        self.rows_out = 0
+
+
+class Metrics:
+    """Aggregated per-stage measurements of one run.
+
+    Stages may run concurrently (e.g. tile downloads in a thread pool), in
+    which case their summed wall time can exceed the total run time and a
+    memory sample counts towards the peak of every stage running at the time.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.info = {}
+        self.current_stage = None
+        self.started = time.perf_counter()
+        self.finished = None
+        self._running = {}
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def _entry(self, stage):
+        return self.stages.setdefault(
+            stage,
+            {
+                "calls": 0,
+                "seconds": 0.0,
+                "bytes": 0,
+                "rows_in": 0,
+                "rows_out": 0,
+                "peak_rss_bytes": None,
+            },
+        )
+
+    def add(self, stage, seconds=0.0, bytes=0, rows_in=0, rows_out=0, calls=1):
+        with self._lock:
+            entry = self._entry(stage)
+            entry["calls"] += calls
+            entry["seconds"] += seconds
+            entry["bytes"] += bytes
+            entry["rows_in"] += rows_in
+            entry["rows_out"] += rows_out
+
+    def enter(self, stage):
+        """Mark ``stage`` as running, so memory samples count towards it."""
+        with self._lock:
+            self._running[stage] = self._running.get(stage, 0) + 1
+        self.sample()
+
+    def leave(self, stage):
+        self.sample()
+        with self._lock:
+            self._running[stage] -= 1
+            if not self._running[stage]:
+                del self._running[stage]
+
+    def sample(self):
+        """Record the current memory use as a peak candidate of running stages."""
+        rss = rss_bytes()
+        if rss is None:
+            return
+        with self._lock:
+            for stage in self._running:
+                entry = self._entry(stage)
+                entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"] or 0, rss)
+
+    def start_sampling(self, interval=SAMPLE_INTERVAL):
+        """Sample the memory of running stages every ``interval`` seconds."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.sample()
+
+        thread = threading.Thread(target=run, name="obe-metrics", daemon=True)
+        thread.start()
+        self._sampler = thread, stop
+
+    def stop_sampling(self):
+        if self._sampler is not None:
+            thread, stop = self._sampler
+            stop.set()
+            thread.join()
+            self._sampler = None
+
+    def annotate(self, key, value):
+        """Attach run-level information (source, format, ...) to the report."""
+        with self._lock:
+            self.info[key] = value
+
+    def increment(self, key, amount=1):
+        """Add ``amount`` to the counter ``key`` of the report."""
+        with self._lock:
+            self.info[key] = self.info.get(key, 0) + amount
+
+    @property
+    def total_seconds(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    def to_dict(self):
+        with self._lock:
+            stages = {}
+            for name, entry in self.stages.items():
+                stage = dict(entry)
+                seconds = stage["seconds"]
+                stage["bytes_per_second"] = (
+                    stage["bytes"] / seconds if seconds and stage["bytes"] else None
+                )
+                stage["rows_per_second"] = (
+                    max(stage["rows_in"], stage["rows_out"]) / seconds
+                    if seconds and (stage["rows_in"] or stage["rows_out"])
+                    else None
+                )
+                stages[name] = stage
+            info = dict(self.info)
+        return {
+            "total_seconds": self.total_seconds,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "info": info,
+            "stages": stages,
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self):
+        """Human readable table of the recorded stages."""
+        data = self.to_dict()
+        header = f"{'Stage':<14}{'Calls':>7}{'Time (s)':>10}{'Rows in':>11}{'Rows out':>11}{'Bytes':>11}{'Peak RSS':>11}"
+        lines = [header, "-" * len(header)]
+        for name, stage in data["stages"].items():
+            lines.append(
+                f"{name:<14}{stage['calls']:>7}{stage['seconds']:>10.2f}"
+                f"{_count(stage['rows_in']):>11}{_count(stage['rows_out']):>11}"
+                f"{_size(stage['bytes']):>11}{_size(stage['peak_rss_bytes']):>11}"
+            )
+        lines.append("-" * len(header))
+        lines.append(
+            f"Total {data['total_seconds']:.2f}s, peak memory {_size(data['peak_rss_bytes'])}"
+        )
+        for key, value in data["info"].items():
+            if isinstance(value, dict):
+                lines.append(f"{key}:")
+                for name, item in value.items():
+                    if isinstance(item, dict):
+                        item = ", ".join(f"{k} {v}" for k, v in item.items())
+                    lines.append(f"  {name}: {item}")
+            else:
+                lines.append(f"{key}: {value}")
+        return "\n".join(lines)
+
+
+def _count(value):
+    return f"{value:,}" if value else "-"
+
+
+def _size(value):
+    if not value:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024 or unit == "GB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+
+
+@contextmanager
+def collect():
+    """Collect metrics for everything run inside the ``with`` block."""
+    run = Metrics()
+    token = _current.set(run)
+    run.start_sampling()
+    try:
+        yield run
+    finally:
+        run.finished = time.perf_counter()
+        run.stop_sampling()
+        _current.reset(token)
+
+
+@contextmanager
+def sampling_paused():
+    """Stop the memory sampling thread inside the block, e.g. to fork safely.
+
+    Stages running meanwhile are still sampled when they start and end.
+    """
+    run = _current.get()
+    if run is None or run._sampler is None:
+        yield
+        return
+    run.stop_sampling()
+    try:
+        yield
+    finally:
+        run.start_sampling()
+
+
+def current():
+    """The active :class:`Metrics`, or None when nothing is being collected."""
+    return _current.get()
+
+
+def annotate(key, value):
+    run = _current.get()
+    if run is not None:
+        run.annotate(key, value)
+
+
+def increment(key, amount=1):
+    run = _current.get()
+    if run is not None:
+        run.increment(key, amount)
+
+
+@contextmanager
+def stage(name, rows_in=0):
+    """Time a stage; the yielded record takes bytes and rows_out counts."""
+    run = _current.get()
+    record = StageRecord(rows_in)
+    if run is None:
+        yield record
+        return
+    run.current_stage = name
+    run.enter(name)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        run.leave(name)
+        run.add(
+            name,
+            seconds=time.perf_counter() - start,
+            bytes=record.bytes,
+            rows_in=record.rows_in,
+            rows_out=record.rows_out,
+        )
+
+
+def submit(executor, fn, *args, **kwargs):
+    """``executor.submit`` that keeps the active metrics in the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
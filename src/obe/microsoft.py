@@ -1,6 +1,8 @@
 import argparse
+import asyncio
+import gzip
+import io
 import os
-import tempfile
 
 import geopandas as gpd
 import mercantile
@@ -8,80 +10,233 @@ import pandas as pd
 from shapely import geometry
 from tqdm import tqdm
 
-DATASET_SOURCE_URL = (
-    "https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv"
+from . import metrics
+from .arrow import check_return_type, concat_tables, with_ids
+from .clip import check_clip_mode, clip_buildings, read_aoi
+from .concurrency import bounded_map, bounded_map_async
+from .output import concat_batches
+from .schema import compact_frame, resolve_compact
+from .fetch import fetch_bytes
+
+DATASET_SOURCE_URL = os.getenv(
+    "OBE_MICROSOFT_DATASET_URL",
+    "https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv",
 )
 
 
-def process_building_footprints(aoi_input, location):
-    if isinstance(aoi_input, str):
-        aoi_gdf = gpd.read_file(aoi_input)
-    elif isinstance(aoi_input, dict):
-        aoi_gdf = gpd.GeoDataFrame.from_features(aoi_input["features"])
-    else:
-        raise ValueError(
-            "aoi_input must be either a file path (str) or a GeoJSON dictionary"
+def download_tile_buildings(url, compact=False):
+    """Download and parse one Microsoft tile of line-delimited GeoJSON."""
+    return parse_tile(fetch_bytes(url), compact, gzipped=url.endswith(".gz"))
+
+
+def parse_tile(content, compact=False, gzipped=True):
+    """Parse the line-delimited GeoJSON of a downloaded tile."""
+    with metrics.stage("parse") as record:
+        df = pd.read_json(
+            io.BytesIO(content),
+            lines=True,
+            compression="gzip" if gzipped else None,
         )
 
+        properties_list = []
+        geometries = []
+
+        for _, row in df.iterrows():
+            properties_list.append(row["properties"])
+            geometries.append(geometry.shape(row["geometry"]))
+
+        properties_df = pd.DataFrame(properties_list)
+        if compact:
+            compact_frame(properties_df, "microsoft")
+        gdf = gpd.GeoDataFrame(properties_df, geometry=geometries, crs=4326)
+        record.rows_out = len(gdf)
+    return gdf
+
+
+def parse_tile_table(content, aoi, clip_mode="within", compact=False, gzipped=True):
+    """Arrow version of parse_tile, clipped to aoi; None if the tile is empty.
+
+    The features are read by pyarrow and the polygons built from the
+    coordinate buffers, only for the clip.
+    """
+    import pyarrow as pa
+    import pyarrow.json as pa_json
+
+    from .arrow import clip_table, geojson_geometries
+    from .schema import compact_table
+
+    with metrics.stage("parse") as record:
+        if gzipped:
+            content = gzip.decompress(content)
+        if not content.strip():
+            return None
+        table = pa_json.read_json(pa.BufferReader(content))
+        properties = table["properties"].combine_chunks()
+        attributes = pa.Table.from_arrays(
+            properties.flatten(), names=[field.name for field in properties.type]
+        )
+        if compact:
+            attributes = compact_table(attributes, "microsoft")
+        geometries = geojson_geometries(table["geometry"])
+        record.rows_out = len(attributes)
+    return clip_table(attributes, geometries, aoi, clip_mode)
+
+
+def load_dataset_links(location):
+    """Read dataset-links.csv and check that ``location`` is in it."""
     df = pd.read_csv(
-        DATASET_SOURCE_URL,
+        io.BytesIO(fetch_bytes(DATASET_SOURCE_URL, tile=False)),
         dtype=str,
     )
     if location not in df["Location"].unique():
         raise ValueError(
             f"Invalid location: {location}. Accepted values are: {df['Location'].unique()}"
         )
+    return df
+
+
+def covering_quadkeys(bounds):
+    """Zoom 9 quadkeys of the dataset tiles covering ``bounds``, sorted."""
+    minx, miny, maxx, maxy = bounds
+    quad_keys = set()
+    for tile in list(mercantile.tiles(minx, miny, maxx, maxy, zooms=9)):
+        quad_keys.add(mercantile.quadkey(tile))
+    return sorted(quad_keys)
+
+
+def tile_urls(links, location, quad_keys):
+    """URL of the dataset tile of every quadkey for ``location``."""
+    urls = {}
+    for quad_key in quad_keys:
+        rows = links[(links["QuadKey"] == quad_key) & (links["Location"] == location)]
+        if rows.shape[0] == 1:
+            urls[quad_key] = rows.iloc[0]["Url"]
+        elif rows.shape[0] > 1:
+            raise ValueError(f"Multiple rows found for QuadKey: {quad_key}")
+        else:
+            raise ValueError(f"QuadKey not found in dataset: {quad_key}")
+    return urls
+
+
+def iter_building_footprints(
+    aoi_input,
+    location,
+    clip_mode="within",
+    compact=None,
+    max_in_flight=None,
+    return_type="geopandas",
+):
+    """Yield (quadkey, GeoDataFrame) for every tile as soon as it is processed.
+
+    Tiles are downloaded concurrently, at most max_in_flight of them ahead of
+    the consumer. With return_type "arrow" pyarrow Tables are yielded
+    instead, see obe.arrow.
+    """
+    check_clip_mode(clip_mode)
+    check_return_type(return_type)
+    aoi_gdf = read_aoi(aoi_input)
+    compact = resolve_compact(compact, aoi_gdf)
+    links = load_dataset_links(location)
 
-    combined_gdf = gpd.GeoDataFrame()
     idx = 0
 
     for aoi_row in aoi_gdf.itertuples():
         aoi_shape = aoi_row.geometry
-        minx, miny, maxx, maxy = aoi_shape.bounds
-
-        quad_keys = set()
-        for tile in list(mercantile.tiles(minx, miny, maxx, maxy, zooms=9)):
-            quad_keys.add(mercantile.quadkey(tile))
-        quad_keys = list(quad_keys)
+        quad_keys = covering_quadkeys(aoi_shape.bounds)
         print(f"The input area spans {len(quad_keys)} tiles: {quad_keys}")
+        urls = tile_urls(links, location, quad_keys)
+
+        def download(quad_key):
+            url = urls[quad_key]
+            if return_type == "arrow":
+                return parse_tile_table(
+                    fetch_bytes(url), aoi_shape, clip_mode, compact, url.endswith(".gz")
+                )
+            gdf = download_tile_buildings(url, compact)
+            return clip_buildings(gdf, aoi_shape, clip_mode)
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmp_fns = []
-            for quad_key in tqdm(quad_keys):
-                rows = df[(df["QuadKey"] == quad_key) & (df["Location"] == location)]
-                if rows.shape[0] == 1:
-                    url = rows.iloc[0]["Url"]
-
-                    df2 = pd.read_json(url, lines=True)
-
-                    properties_list = []
-                    geometries = []
-
-                    for _, row in df2.iterrows():
-                        properties_list.append(row["properties"])
-                        geometries.append(geometry.shape(row["geometry"]))
-
-                    properties_df = pd.DataFrame(properties_list)
-                    gdf = gpd.GeoDataFrame(properties_df, geometry=geometries, crs=4326)
-                    fn = os.path.join(tmpdir, f"{quad_key}.geojson")
-                    tmp_fns.append(fn)
-                    if not os.path.exists(fn):
-                        gdf.to_file(fn, driver="GeoJSON")
-                elif rows.shape[0] > 1:
-                    raise ValueError(f"Multiple rows found for QuadKey: {quad_key}")
-                else:
-                    raise ValueError(f"QuadKey not found in dataset: {quad_key}")
-
-            for fn in tmp_fns:
-                gdf = gpd.read_file(fn)
-                gdf = gdf[gdf.geometry.within(aoi_shape)]
+        # Tiles are yielded in order so that ids are stable between runs.
+        results = bounded_map(
+            download, quad_keys, max_in_flight=max_in_flight, ordered=True
+        )
+        for quad_key, gdf in tqdm(results, total=len(quad_keys)):
+            if gdf is None or not len(gdf):
+                continue
+            if return_type == "arrow":
+                gdf = with_ids(gdf, idx)
+            else:
                 gdf["id"] = range(idx, idx + len(gdf))
-                idx += len(gdf)
-                combined_gdf = pd.concat([combined_gdf, gdf], ignore_index=True)
+            idx += len(gdf)
+            yield quad_key, gdf
+
+
+def combine_buildings(batches):
+    with metrics.stage("concat") as record:
+        combined_gdf = concat_batches(batches)
+        record.rows_out = len(combined_gdf)
+
+    return combined_gdf.to_crs("EPSG:4326")
+
+
+def process_building_footprints(
+    aoi_input, location, clip_mode="within", compact=None, return_type="geopandas"
+):
+    batches = [
+        gdf
+        for _, gdf in iter_building_footprints(
+            aoi_input, location, clip_mode, compact, return_type=return_type
+        )
+    ]
+    if return_type == "arrow":
+        return concat_tables(batches)
+    return combine_buildings(batches)
+
+
+async def iter_building_footprints_async(
+    aoi_input, location, clip_mode="within", compact=None, max_in_flight=None
+):
+    """Async version of iter_building_footprints for use in an event loop.
 
-    combined_gdf = combined_gdf.to_crs("EPSG:4326")
+    Downloads and parsing run in threads, so the loop is never blocked.
+    """
+    check_clip_mode(clip_mode)
+    aoi_gdf = await asyncio.to_thread(read_aoi, aoi_input)
+    compact = resolve_compact(compact, aoi_gdf)
+    links = await asyncio.to_thread(load_dataset_links, location)
 
-    return combined_gdf
+    idx = 0
+
+    for aoi_row in aoi_gdf.itertuples():
+        aoi_shape = aoi_row.geometry
+        quad_keys = covering_quadkeys(aoi_shape.bounds)
+        print(f"The input area spans {len(quad_keys)} tiles: {quad_keys}")
+        urls = tile_urls(links, location, quad_keys)
+
+        def download(quad_key):
+            gdf = download_tile_buildings(urls[quad_key], compact)
+            return clip_buildings(gdf, aoi_shape, clip_mode)
+
+        async for quad_key, gdf in bounded_map_async(
+            download, quad_keys, max_in_flight=max_in_flight, ordered=True
+        ):
+            if gdf.empty:
+                continue
+            gdf["id"] = range(idx, idx + len(gdf))
+            idx += len(gdf)
+            yield quad_key, gdf
+
+
+async def process_building_footprints_async(
+    aoi_input, location, clip_mode="within", compact=None
+):
+    """Async version of process_building_footprints."""
+    batches = [
+        gdf
+        async for _, gdf in iter_building_footprints_async(
+            aoi_input, location, clip_mode, compact
+        )
+    ]
+    return await asyncio.to_thread(combine_buildings, batches)
 
 
 def main():
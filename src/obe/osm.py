@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import io
 import json
 import os
@@ -6,10 +7,19 @@ import time
 import zipfile
 
 import geopandas as gpd
-import pandas as pd
-import requests
 
-OSM_API_URL = "https://api-prod.raw-data.hotosm.org/v1"
+from . import metrics
+from .arrow import check_return_type, concat_tables, with_ids
+from .clip import check_clip_mode, clip_buildings, read_aoi
+from .concurrency import bounded_map
+from .fetch import fetch_bytes, request
+from .output import concat_batches
+from .schema import compact_frame, resolve_compact
+
+OSM_API_URL = os.getenv("OBE_OSM_API_URL", "https://api-prod.raw-data.hotosm.org/v1")
+
+# Seconds between task status requests.
+POLL_INTERVAL = 2
 
 
 def get_geometry(geometry):
@@ -29,7 +39,8 @@ def request_osm_data(geometry, feature_type="building"):
         "geometryType": ["polygon"],
     }
 
-    response = requests.post(
+    response = request(
+        "POST",
         f"{OSM_API_URL}/snapshot/",
         json=payload,
         headers={
@@ -38,66 +49,197 @@ def request_osm_data(geometry, feature_type="building"):
             "Referer": "obe-python-lib",
         },
     )
-    response.raise_for_status()
     return response.json()
 
 
 def poll_task_status(task_link):
-    while True:
-        response = requests.get(f"{OSM_API_URL}{task_link}")
-        response.raise_for_status()
-        res = response.json()
-        if res["status"] in ["SUCCESS", "FAILED"]:
-            return res
-        time.sleep(2)
+    with metrics.stage("wait"):
+        while True:
+            res = request("GET", f"{OSM_API_URL}{task_link}").json()
+            if res["status"] in ["SUCCESS", "FAILED"]:
+                return res
+            time.sleep(POLL_INTERVAL)
+
+
+async def poll_task_status_async(task_link):
+    """poll_task_status that waits with asyncio.sleep instead of blocking."""
+    with metrics.stage("wait"):
+        while True:
+            response = await asyncio.to_thread(
+                request, "GET", f"{OSM_API_URL}{task_link}"
+            )
+            res = response.json()
+            if res["status"] in ["SUCCESS", "FAILED"]:
+                return res
+            await asyncio.sleep(POLL_INTERVAL)
 
 
 def download_snapshot(download_url):
-    response = requests.get(download_url)
-    response.raise_for_status()
-    with zipfile.ZipFile(io.BytesIO(response.content), "r") as zip_ref:
-        with zip_ref.open("obe.geojson") as file:
-            return json.load(file)
-
-
-def process_osm_data(aoi_input):
-    if isinstance(aoi_input, str):
-        aoi_gdf = gpd.read_file(aoi_input)
-    elif isinstance(aoi_input, dict):
-        aoi_gdf = gpd.GeoDataFrame.from_features(aoi_input["features"])
-    else:
-        raise ValueError(
-            "aoi_input must be either a file path (str) or a GeoJSON dictionary"
+    content = fetch_bytes(download_url)
+    with metrics.stage("decompress"):
+        with zipfile.ZipFile(io.BytesIO(content), "r") as zip_ref:
+            with zip_ref.open("obe.geojson") as file:
+                return json.load(file)
+
+
+def parse_snapshot(osm_data, compact=False):
+    with metrics.stage("parse") as record:
+        gdf = gpd.GeoDataFrame.from_features(osm_data["features"], crs=4326)
+        if compact:
+            compact_frame(gdf, "osm")
+        record.rows_out = len(gdf)
+    return gdf
+
+
+def parse_snapshot_table(osm_data, aoi, clip_mode="within", compact=False):
+    """Arrow version of parse_snapshot, clipped to aoi."""
+    import pandas as pd
+    import pyarrow as pa
+    import shapely
+
+    from .arrow import clip_table
+    from .schema import compact_table
+
+    with metrics.stage("parse") as record:
+        features = osm_data["features"]
+        # Every tag of any feature becomes a column, as with from_features.
+        properties = pd.DataFrame([feature["properties"] for feature in features])
+        columns = {}
+        for name, column in properties.items():
+            try:
+                columns[name] = pa.array(column, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Values of mixed types, e.g. numbers and strings.
+                values = column.astype(str).where(column.notna(), None)
+                columns[name] = pa.array(values, pa.string(), from_pandas=True)
+        attributes = pa.table(columns)
+        if compact:
+            attributes = compact_table(attributes, "osm")
+        geometries = shapely.from_geojson(
+            [json.dumps(feature["geometry"]) for feature in features]
         )
+        record.rows_out = len(attributes)
+    return clip_table(attributes, geometries, aoi, clip_mode)
+
+
+def fetch_snapshot(geometry, compact=False):
+    """Request, wait for and parse a snapshot of geometry; None if it failed."""
+    osm_data = fetch_snapshot_data(geometry)
+    return None if osm_data is None else parse_snapshot(osm_data, compact)
+
+
+def fetch_snapshot_data(geometry):
+    """Request and wait for a snapshot of geometry; its GeoJSON or None."""
+    with metrics.stage("request"):
+        task_response = request_osm_data(geometry)
+    task_link = task_response.get("track_link")
+
+    if not task_link:
+        raise RuntimeError("No task link found in API response")
+
+    result = poll_task_status(task_link)
+
+    if result["status"] == "SUCCESS" and result["result"].get("download_url"):
+        return download_snapshot(result["result"]["download_url"])
+    return None
+
+
+def iter_osm_data(aoi_input, clip_mode="within", compact=None, return_type="geopandas"):
+    """Yield (None, GeoDataFrame) per AOI feature; OSM has no native tiles.
+
+    Snapshots of the AOI features are requested concurrently and yielded in
+    order. With return_type "arrow" pyarrow Tables are yielded instead, see
+    obe.arrow.
+    """
+    check_clip_mode(clip_mode)
+    check_return_type(return_type)
+    aoi_gdf = read_aoi(aoi_input)
+    compact = resolve_compact(compact, aoi_gdf)
+
+    def fetch(aoi_shape):
+        osm_data = fetch_snapshot_data(get_geometry(aoi_shape))
+        if osm_data is None:
+            return None
+        if return_type == "arrow":
+            return parse_snapshot_table(osm_data, aoi_shape, clip_mode, compact)
+        gdf = parse_snapshot(osm_data, compact)
+        return clip_buildings(gdf, aoi_shape, clip_mode)
+
+    idx = 0
+
+    for _, gdf in bounded_map(fetch, aoi_gdf.geometry, ordered=True):
+        if gdf is None or not len(gdf):
+            continue
+        if return_type == "arrow":
+            gdf = with_ids(gdf, idx)
+        else:
+            gdf["id"] = range(idx, idx + len(gdf))
+        idx += len(gdf)
+        yield None, gdf
+
+
+def combine_buildings(batches):
+    with metrics.stage("concat") as record:
+        combined_gdf = concat_batches(batches)
+        record.rows_out = len(combined_gdf)
+
+    return combined_gdf.to_crs("EPSG:4326")
+
+
+def process_osm_data(
+    aoi_input, clip_mode="within", compact=None, return_type="geopandas"
+):
+    batches = [
+        gdf for _, gdf in iter_osm_data(aoi_input, clip_mode, compact, return_type)
+    ]
+    if return_type == "arrow":
+        return concat_tables(batches)
+    return combine_buildings(batches)
+
+
+async def iter_osm_data_async(aoi_input, clip_mode="within", compact=None):
+    """Async version of iter_osm_data for use in an event loop.
+
+    Requests run in threads, the task is polled with asyncio.sleep and
+    parsing and clipping are offloaded to threads as well.
+    """
+    check_clip_mode(clip_mode)
+    aoi_gdf = await asyncio.to_thread(read_aoi, aoi_input)
+    compact = resolve_compact(compact, aoi_gdf)
 
-    combined_gdf = gpd.GeoDataFrame()
     idx = 0
 
     for aoi_row in aoi_gdf.itertuples():
         aoi_shape = aoi_row.geometry
         geometry = get_geometry(aoi_shape)
 
-        task_response = request_osm_data(geometry)
+        with metrics.stage("request"):
+            task_response = await asyncio.to_thread(request_osm_data, geometry)
         task_link = task_response.get("track_link")
 
         if not task_link:
             raise RuntimeError("No task link found in API response")
 
-        result = poll_task_status(task_link)
+        result = await poll_task_status_async(task_link)
 
         if result["status"] == "SUCCESS" and result["result"].get("download_url"):
             download_url = result["result"]["download_url"]
-            osm_data = download_snapshot(download_url)
-
-            gdf = gpd.GeoDataFrame.from_features(osm_data["features"], crs=4326)
-            gdf = gdf[gdf.geometry.within(aoi_shape)]
+            osm_data = await asyncio.to_thread(download_snapshot, download_url)
+            gdf = await asyncio.to_thread(parse_snapshot, osm_data, compact)
+            gdf = await asyncio.to_thread(clip_buildings, gdf, aoi_shape, clip_mode)
+            if gdf.empty:
+                continue
             gdf["id"] = range(idx, idx + len(gdf))
             idx += len(gdf)
-            combined_gdf = pd.concat([combined_gdf, gdf], ignore_index=True)
+            yield None, gdf
 
-    combined_gdf = combined_gdf.to_crs("EPSG:4326")
 
-    return combined_gdf
+async def process_osm_data_async(aoi_input, clip_mode="within", compact=None):
+    """Async version of process_osm_data."""
+    batches = [
+        gdf async for _, gdf in iter_osm_data_async(aoi_input, clip_mode, compact)
+    ]
+    return await asyncio.to_thread(combine_buildings, batches)
 
 
 def main():
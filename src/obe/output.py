@@ -0,0 +1,446 @@
+"""Writers for the output formats supported by obe."""
+
+import json
+import math
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:  # optional, speeds up GeoJSON output
+    orjson = None
+
+OGR_DRIVERS = {
+    "geojson": "GeoJSON",
+    "geopackage": "GPKG",
+    "shapefile": "ESRI Shapefile",
+    "geojsonseq": "GeoJSONSeq",
+}
+
+PARQUET_COMPRESSIONS = ["snappy", "zstd", "gzip", "brotli", "lz4", "none"]
+
+# Features encoded per task by write_geojson.
+GEOJSON_CHUNK_SIZE = 20_000
+
+
+def concat_batches(batches):
+    """Concatenate per-tile GeoDataFrames, or an empty EPSG:4326 frame if none."""
+    import geopandas as gpd
+    import pandas as pd
+
+    from .schema import unify_categories
+
+    if not batches:
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    return pd.concat(unify_categories(batches), ignore_index=True)
+
+
+def reduce_precision(gdf, precision):
+    """Snap coordinates to ``precision`` decimal places, keeping geometries valid."""
+    gdf = gdf.copy()
+    gdf[gdf.geometry.name] = gdf.geometry.set_precision(10.0**-precision)
+    return gdf[~gdf.geometry.is_empty].reset_index(drop=True)
+
+
+def hilbert_order(gdf):
+    """Return ``gdf`` with rows sorted along a Hilbert curve over its bounds."""
+    if len(gdf) < 2:
+        return gdf
+    distances = gdf.geometry.hilbert_distance()
+    order = np.argsort(distances.to_numpy(), kind="stable")
+    return gdf.iloc[order].reset_index(drop=True)
+
+
+def write_geoparquet(
+    gdf,
+    output_path,
+    compression="snappy",
+    compression_level=None,
+    row_group_size=None,
+    precision=None,
+    bbox_covering=False,
+    hilbert=False,
+):
+    """Write ``gdf`` as GeoParquet.
+
+    Args:
+        compression: parquet codec, one of PARQUET_COMPRESSIONS
+        compression_level: codec specific level (e.g. 1-22 for zstd)
+        row_group_size: maximum number of rows per row group
+        precision: round coordinates to this many decimal places
+        bbox_covering: add a GeoParquet 1.1 ``bbox`` covering column so readers
+            can skip row groups by their bbox statistics
+        hilbert: sort rows along a Hilbert curve so each row group covers a
+            compact area, which is what makes bbox pruning effective
+    """
+    if precision is not None:
+        gdf = reduce_precision(gdf, precision)
+    if hilbert:
+        gdf = hilbert_order(gdf)
+    kwargs = {}
+    if compression_level is not None:
+        kwargs["compression_level"] = compression_level
+    if row_group_size is not None:
+        kwargs["row_group_size"] = row_group_size
+    gdf.to_parquet(
+        output_path,
+        compression=None if compression == "none" else compression,
+        write_covering_bbox=bbox_covering,
+        **kwargs,
+    )
+
+
+DATASET_INDEX = "_index.json"
+
+# Default zoom of the quadkey grid used to partition sources without native
+# tiles (OSM, Overture); zoom 8 cells are roughly 150 km wide at the equator.
+DEFAULT_PARTITION_ZOOM = 8
+
+
+def grid_keys(gdf, zoom):
+    """Quadkey at ``zoom`` of the web mercator tile holding each centroid."""
+    import mercantile
+    import shapely
+
+    centroids = shapely.centroid(gdf.geometry.values)
+    n = 2**zoom
+    lat = np.radians(np.clip(shapely.get_y(centroids), -85.0511, 85.0511))
+    x = np.floor((shapely.get_x(centroids) + 180.0) / 360.0 * n).clip(0, n - 1)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat)) / math.pi) / 2.0 * n).clip(0, n - 1)
+    tiles = {
+        (tx, ty): mercantile.quadkey(mercantile.Tile(tx, ty, zoom))
+        for tx, ty in set(zip(x.astype(int).tolist(), y.astype(int).tolist()))
+    }
+    return np.array([tiles[key] for key in zip(x.astype(int), y.astype(int))])
+
+
+class GeoParquetDatasetWriter:
+    """Write batches of buildings as a Hive-partitioned GeoParquet dataset.
+
+    Each batch is written as ``<partition_column>=<key>/part-NNNNN.parquet``
+    in a thread pool as soon as it is submitted. Batches without a native tile
+    key are split on a quadkey grid at DEFAULT_PARTITION_ZOOM; when
+    ``partition_zoom`` is set, every batch is split on a grid of that zoom.
+    :meth:`close` waits for the writes and records every file's partition,
+    bbox and row count in ``_index.json``; :meth:`abort` cancels them instead.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        partition_column="tile",
+        partition_zoom=None,
+        max_workers=4,
+        parquet_options=None,
+    ):
+        self.output_dir = output_dir
+        self.partition_zoom = partition_zoom
+        self.partition_column = "quadkey" if partition_zoom else partition_column
+        self.parquet_options = parquet_options or {}
+        self.parts = {}
+        self.paths = []
+        self.futures = []
+        self._prepare_output_dir()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _prepare_output_dir(self):
+        index_path = os.path.join(self.output_dir, DATASET_INDEX)
+        if os.path.exists(index_path):
+            # Replace a dataset written earlier, touching only files we wrote.
+            with open(index_path) as f:
+                index = json.load(f)
+            self._remove([entry["path"] for entry in index["files"]])
+            os.remove(index_path)
+        elif os.path.isdir(self.output_dir) and os.listdir(self.output_dir):
+            raise ValueError(
+                f"Output directory is not empty and not an obe dataset: {self.output_dir}"
+            )
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def _remove(self, relative_paths):
+        for relative_path in relative_paths:
+            path = os.path.join(self.output_dir, relative_path)
+            if os.path.exists(path):
+                os.remove(path)
+            partition_dir = os.path.dirname(path)
+            if os.path.isdir(partition_dir) and not os.listdir(partition_dir):
+                shutil.rmtree(partition_dir)
+
+    def submit(self, key, gdf):
+        """Queue ``gdf`` (buildings of tile ``key``, or None) for writing."""
+        if gdf.empty:
+            return
+        if key is None or self.partition_zoom:
+            zoom = self.partition_zoom or DEFAULT_PARTITION_ZOOM
+            keys = grid_keys(gdf, zoom)
+            for grid_key in np.unique(keys):
+                self._submit_part(grid_key, gdf[keys == grid_key])
+        else:
+            self._submit_part(key, gdf)
+
+    def _submit_part(self, key, gdf):
+        number = self.parts.get(key, 0)
+        self.parts[key] = number + 1
+        relative_path = os.path.join(
+            f"{self.partition_column}={key}", f"part-{number:05d}.parquet"
+        )
+        self.paths.append(relative_path)
+        self.futures.append(
+            metrics.submit(self.executor, self._write_part, key, relative_path, gdf)
+        )
+
+    def _write_part(self, key, relative_path, gdf):
+        path = os.path.join(self.output_dir, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with metrics.stage("write", rows_in=len(gdf)) as record:
+            write_geoparquet(gdf, path, **self.parquet_options)
+            record.bytes = os.path.getsize(path)
+        return {
+            "path": relative_path,
+            "partition": str(key),
+            "rows": len(gdf),
+            "bbox": [float(v) for v in gdf.total_bounds],
+        }
+
+    def close(self):
+        """Wait for all writes and write the dataset index; returns the index."""
+        try:
+            files = [future.result() for future in self.futures]
+        finally:
+            self.executor.shutdown()
+        files.sort(key=lambda entry: entry["path"])
+        index = {
+            "partition_column": self.partition_column,
+            "total_rows": sum(entry["rows"] for entry in files),
+            "files": files,
+        }
+        with open(os.path.join(self.output_dir, DATASET_INDEX), "w") as f:
+            json.dump(index, f, indent=2)
+        return index
+
+    def abort(self):
+        """Cancel pending writes and remove the files written so far."""
+        self.executor.shutdown(cancel_futures=True)
+        self._remove(self.paths)
+
+
+def _json_default(value):
+    if hasattr(value, "tolist"):  # numpy arrays and scalars
+        return value.tolist()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "items"):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(
+            value,
+            default=_json_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(
+        value, default=_json_default, ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def _loads(text):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def encode_features(properties, geometries, precision=None):
+    """GeoJSON Features of the rows of a chunk, as a list of bytes.
+
+    ``properties`` is a DataFrame without geometry and ``geometries`` its
+    shapely geometries; coordinates are rounded to ``precision`` decimals.
+    """
+    import shapely
+
+    if precision is None:
+        geojson = [
+            (geometry or "null").encode()
+            for geometry in shapely.to_geojson(geometries)
+        ]
+    else:
+        # GEOS prints up to 17 significant digits, so the rounded values are
+        # printed again by the JSON encoder, with at most precision decimals.
+        rounded = shapely.transform(
+            geometries, lambda coords: np.round(coords, precision)
+        )
+        geojson = [
+            b"null" if geometry is None else _dumps(_loads(geometry))
+            for geometry in shapely.to_geojson(rounded)
+        ]
+    float32 = properties.select_dtypes("float32").columns
+    if len(float32):
+        # Widen through the float32 repr so 0.7 stays 0.7, not 0.699999988...
+        properties = properties.copy()
+        for name in float32:
+            values = properties[name].to_numpy()
+            properties[name] = values.astype(str).astype(np.float64)
+    records = properties.astype(object).where(properties.notna(), None)
+    return [
+        b'{"type":"Feature","properties":%s,"geometry":%s}' % (_dumps(record), geometry)
+        for record, geometry in zip(records.to_dict("records"), geojson)
+    ]
+
+
+_geojson_frame = None
+
+
+def _init_geojson_worker(properties, geometries, precision):
+    global _geojson_frame
+    _geojson_frame = properties, geometries, precision
+
+
+def _encode_rows(start, end, separator):
+    properties, geometries, precision = _geojson_frame
+    features = encode_features(
+        properties.iloc[start:end], geometries[start:end], precision
+    )
+    return separator.join(features)
+
+
+def _stop_tqdm_monitor():
+    """Stop the monitor thread tqdm leaves running after a progress bar.
+
+    tqdm starts a new one with its next progress bar.
+    """
+    import sys
+
+    tqdm = sys.modules.get("tqdm")
+    monitor = tqdm and tqdm.tqdm.monitor
+    if monitor is not None:
+        monitor.exit()
+        tqdm.tqdm.monitor = None
+
+
+def _geojson_pool(max_workers, frame):
+    """Process pool for write_geojson and its number of workers (1: no pool).
+
+    Forking only copies the frame lazily but is only safe while this is the
+    only thread of the process (tqdm's idle monitor thread is stopped for
+    it). Otherwise, e.g. under a web server or
+    ``asyncio.to_thread``, chunks are encoded serially unless ``max_workers``
+    asks for a pool, which then starts fresh interpreters and sends each of
+    them the frame.
+    """
+    import multiprocessing
+    import threading
+    from concurrent.futures import ProcessPoolExecutor
+
+    methods = multiprocessing.get_all_start_methods()
+    if max_workers != 1 and (os.cpu_count() or 1) > 1:
+        _stop_tqdm_monitor()
+    if "fork" in methods and threading.active_count() == 1:
+        method = "fork"
+    elif max_workers:
+        method = "forkserver" if "forkserver" in methods else "spawn"
+    else:
+        return None, 1
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1:
+        return None, 1
+    executor = ProcessPoolExecutor(
+        max_workers,
+        mp_context=multiprocessing.get_context(method),
+        initializer=_init_geojson_worker,
+        initargs=frame,
+    )
+    return executor, max_workers
+
+
+def write_geojson(
+    gdf,
+    output_path,
+    sequence=False,
+    precision=None,
+    max_workers=None,
+    chunk_size=GEOJSON_CHUNK_SIZE,
+):
+    """Write ``gdf`` as a GeoJSON FeatureCollection, or GeoJSONSeq if ``sequence``.
+
+    Chunks of ``chunk_size`` features are encoded in a pool of ``max_workers``
+    processes (default: one per CPU when it is safe to fork, see
+    :func:`_geojson_pool`) and written in order, so the output is the same
+    for any number of workers. orjson is used when installed.
+    """
+    if sequence:
+        header, separator, footer = b"", b"\n", b"\n"
+    else:
+        header = b'{"type":"FeatureCollection","features":[\n'
+        separator, footer = b",\n", b"\n]}\n"
+    frame = (
+        gdf.drop(columns=gdf.geometry.name),
+        np.asarray(gdf.geometry.values),
+        precision,
+    )
+    starts = range(0, len(gdf), chunk_size)
+    pool = len(starts) > 1 and max_workers != 1
+    # The metrics sampling thread would keep the pool from forking.
+    with metrics.sampling_paused() if pool else nullcontext():
+        executor = None
+        if pool:
+            executor, max_workers = _geojson_pool(max_workers, frame)
+
+        def chunks():
+            if executor is None:
+                _init_geojson_worker(*frame)
+                for start in starts:
+                    yield _encode_rows(start, start + chunk_size, separator)
+                return
+            pending = deque()
+            for start in starts:
+                pending.append(
+                    executor.submit(_encode_rows, start, start + chunk_size, separator)
+                )
+                if len(pending) >= 2 * max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+        try:
+            with open(output_path, "wb") as f:
+                f.write(header)
+                for position, features in enumerate(chunks()):
+                    if position:
+                        f.write(separator)
+                    f.write(features)
+                f.write(footer if len(gdf) else b"" if sequence else b"]}\n")
+        finally:
+            _init_geojson_worker(None, None, None)
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+
+def write_buildings(gdf, output_path, file_format, parquet_options=None):
+    """Write ``gdf`` to ``output_path`` in ``file_format``.
+
+    parquet_options are passed to write_geoparquet for the geoparquet format;
+    their precision also applies to GeoJSON and GeoJSONSeq.
+    """
+    options = parquet_options or {}
+    with metrics.stage("write", rows_in=len(gdf)) as record:
+        if file_format in ("geojson", "geojsonseq"):
+            write_geojson(
+                gdf,
+                output_path,
+                sequence=file_format == "geojsonseq",
+                precision=options.get("precision"),
+            )
+        elif file_format in OGR_DRIVERS:
+            gdf.to_file(output_path, driver=OGR_DRIVERS[file_format])
+        elif file_format == "geoparquet":
+            write_geoparquet(gdf, output_path, **options)
+        else:
+            raise ValueError(f"Unknown format: {file_format}")
+        record.bytes = os.path.getsize(output_path)
@@ -1,49 +1,60 @@
 import argparse
+import asyncio
+import json
 import os
 import subprocess
 import tempfile
 
 import geopandas as gpd
-import pandas as pd
 
+from . import metrics
+from .arrow import check_return_type, concat_tables, with_ids
+from .clip import check_clip_mode, clip_buildings, read_aoi
+from .output import concat_batches
+from .schema import compact_frame, resolve_compact
 
-def process_building_footprints(aoi_input):
-    if isinstance(aoi_input, str):
-        aoi_gdf = gpd.read_file(aoi_input)
-    elif isinstance(aoi_input, dict):
-        aoi_gdf = gpd.GeoDataFrame.from_features(aoi_input["features"])
-    else:
-        raise ValueError(
-            "aoi_input must be either a file path (str) or a GeoJSON dictionary"
-        )
 
-    combined_gdf = gpd.GeoDataFrame()
-    idx = 0
+# Optional GeoParquet dataset of Overture buildings (a local directory or any
+# URL pyarrow can read) used instead of the overturemaps CLI. It should point
+# at the equivalent of ".../theme=buildings/type=building/" of a release.
+OVERTURE_DATASET_URL = os.getenv("OBE_OVERTURE_DATASET_URL")
 
-    for aoi_row in aoi_gdf.itertuples():
-        aoi_shape = aoi_row.geometry
-        bbox = aoi_shape.bounds
-        bbox_str = ",".join(map(str, bbox))
-        print(f"Processing AOI with bounding box: {bbox_str}")
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            output_file = os.path.join(tmpdir, f"output_buildings.geojson")
-            cmd = [
-                "overturemaps",
-                "download",
-                "-f",
-                "geojson",
-                "--bbox",
-                bbox_str,
-                "-o",
-                output_file,
-                "--type",
-                "building",
-                # "-cty",
-                # "building",
-            ]
 
-            try:
+def cli_command(bbox, output_file):
+    bbox_str = ",".join(map(str, bbox))
+    return [
+        "overturemaps",
+        "download",
+        "-f",
+        "geojson",
+        "--bbox",
+        bbox_str,
+        "-o",
+        output_file,
+        "--type",
+        "building",
+        # "-cty",
+        # "building",
+    ]
+
+
+def read_cli_output(output_file, compact=False):
+    with metrics.stage("parse") as record:
+        gdf = gpd.read_file(output_file)
+        if compact:
+            compact_frame(gdf, "overture")
+        record.rows_out = len(gdf)
+    return gdf
+
+
+def download_with_cli(bbox, compact=False):
+    """Download buildings in bbox with the overturemaps CLI."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_file = os.path.join(tmpdir, f"output_buildings.geojson")
+        cmd = cli_command(bbox, output_file)
+
+        try:
+            with metrics.stage("download") as record:
                 process = subprocess.Popen(
                     cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
                 )
@@ -57,18 +68,247 @@ def process_building_footprints(aoi_input):
                 if rc != 0:
                     stderr = process.stderr.read()
                     raise RuntimeError(f"Error downloading data: {stderr}")
+                record.bytes = os.path.getsize(output_file)
+
+            gdf = read_cli_output(output_file, compact)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Error downloading data: {e.stderr}")
+    return gdf
+
+
+async def download_with_cli_async(bbox, compact=False):
+    """download_with_cli using an asyncio subprocess; parsing runs in a thread."""
+
+    async def echo(stream):
+        async for line in stream:
+            print(line.decode().strip())
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_file = os.path.join(tmpdir, "output_buildings.geojson")
+        with metrics.stage("download") as record:
+            process = await asyncio.create_subprocess_exec(
+                *cli_command(bbox, output_file),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                _, stderr = await asyncio.gather(
+                    echo(process.stdout), process.stderr.read()
+                )
+                rc = await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+            if rc != 0:
+                raise RuntimeError(f"Error downloading data: {stderr.decode()}")
+            record.bytes = os.path.getsize(output_file)
+
+        return await asyncio.to_thread(read_cli_output, output_file, compact)
+
+
+def read_dataset_table(dataset_url, bbox):
+    """Arrow table of the buildings in bbox, found with the dataset's bbox column."""
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    xmin, ymin, xmax, ymax = bbox
+    bbox_filter = (
+        (pc.field("bbox", "xmin") < xmax)
+        & (pc.field("bbox", "xmax") > xmin)
+        & (pc.field("bbox", "ymin") < ymax)
+        & (pc.field("bbox", "ymax") > ymin)
+    )
+    with metrics.stage("download") as record:
+        table = ds.dataset(dataset_url, format="parquet").to_table(filter=bbox_filter)
+        record.bytes = table.nbytes
+    return table
+
+
+def row_group_bbox(group):
+    """(xmin, ymin, xmax, ymax) of a row group from its bbox column statistics."""
+    stats = {}
+    for i in range(group.num_columns):
+        column = group.column(i)
+        name = column.path_in_schema
+        if name in ("bbox.xmin", "bbox.ymin") and column.statistics is not None:
+            stats[name] = column.statistics.min
+        elif name in ("bbox.xmax", "bbox.ymax") and column.statistics is not None:
+            stats[name] = column.statistics.max
+    if len(stats) < 4:
+        return None
+    return tuple(stats[f"bbox.{name}"] for name in ("xmin", "ymin", "xmax", "ymax"))
+
+
+def dataset_row_groups(dataset_url):
+    """Row groups of the dataset's files, read from the Parquet footers only.
+
+    Yields ``(path, index, row group metadata, bbox)``; bbox is None when the
+    row group has no bbox statistics.
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    dataset = ds.dataset(dataset_url, format="parquet")
+    for path in dataset.files:
+        metadata = pq.ParquetFile(path, filesystem=dataset.filesystem).metadata
+        for index in range(metadata.num_row_groups):
+            group = metadata.row_group(index)
+            yield path, index, group, row_group_bbox(group)
+
+
+def read_bbox_table(bbox, aoi, clip_mode="within", compact=False):
+    """Arrow version of read_bbox, clipped to aoi.
+
+    The dataset stays in Arrow, nested columns included; only the WKB
+    geometries are decoded for the clip. The CLI output is read with geopandas.
+    """
+    from .arrow import clip_table, from_geodataframe, geometries
+    from .schema import compact_table
+
+    if OVERTURE_DATASET_URL:
+        table = read_dataset_table(OVERTURE_DATASET_URL, bbox)
+        table = table.drop_columns(["bbox"])
+        if compact:
+            table = compact_table(table, "overture")
+    else:
+        table = from_geodataframe(download_with_cli(bbox, compact))
+    attributes = table.drop_columns(["geometry"])
+    return clip_table(attributes, geometries(table), aoi, clip_mode)
 
-                gdf = gpd.read_file(output_file)
-                gdf = gdf[gdf.geometry.within(aoi_shape)]
-                gdf["id"] = range(idx, idx + len(gdf))
-                idx += len(gdf)
-                combined_gdf = pd.concat([combined_gdf, gdf], ignore_index=True)
-            except subprocess.CalledProcessError as e:
-                raise RuntimeError(f"Error downloading data: {e.stderr}")
 
-    combined_gdf = combined_gdf.to_crs("EPSG:4326")
+def read_dataset(dataset_url, bbox, compact=False):
+    """Read buildings in bbox from a GeoParquet dataset using its bbox column."""
+    table = read_dataset_table(dataset_url, bbox)
 
-    return combined_gdf
+    with metrics.stage("parse") as record:
+        df = table.drop_columns(["bbox"]).to_pandas()
+        # Nested columns come back as JSON strings, as with the CLI's GeoJSON.
+        for column in df.columns:
+            if column != "geometry" and df[column].map(
+                lambda v: isinstance(v, (dict, list))
+            ).any():
+                df[column] = df[column].map(
+                    lambda v: json.dumps(v) if isinstance(v, (dict, list)) else v
+                )
+        gdf = gpd.GeoDataFrame(
+            df.drop(columns="geometry"),
+            geometry=gpd.GeoSeries.from_wkb(df["geometry"]),
+            crs="EPSG:4326",
+        )
+        if compact:
+            compact_frame(gdf, "overture")
+        record.rows_out = len(gdf)
+    return gdf
+
+
+def read_bbox(bbox, compact=False):
+    """Buildings in bbox from OVERTURE_DATASET_URL if set, else the CLI."""
+    if OVERTURE_DATASET_URL:
+        return read_dataset(OVERTURE_DATASET_URL, bbox, compact)
+    return download_with_cli(bbox, compact)
+
+
+def iter_building_footprints(
+    aoi_input, clip_mode="within", compact=None, return_type="geopandas"
+):
+    """Yield (None, GeoDataFrame) per AOI feature; Overture is read by bbox.
+
+    With return_type "arrow" pyarrow Tables are yielded instead, see obe.arrow.
+    """
+    check_clip_mode(clip_mode)
+    check_return_type(return_type)
+    aoi_gdf = read_aoi(aoi_input)
+    compact = resolve_compact(compact, aoi_gdf)
+
+    idx = 0
+
+    for aoi_row in aoi_gdf.itertuples():
+        aoi_shape = aoi_row.geometry
+        bbox = aoi_shape.bounds
+        print(f"Processing AOI with bounding box: {','.join(map(str, bbox))}")
+
+        if return_type == "arrow":
+            table = read_bbox_table(bbox, aoi_shape, clip_mode, compact)
+            if not len(table):
+                continue
+            yield None, with_ids(table, idx)
+            idx += len(table)
+            continue
+
+        gdf = read_bbox(bbox, compact)
+        gdf = clip_buildings(gdf, aoi_shape, clip_mode)
+        if gdf.empty:
+            continue
+        gdf["id"] = range(idx, idx + len(gdf))
+        idx += len(gdf)
+        yield None, gdf
+
+
+def combine_buildings(batches):
+    with metrics.stage("concat") as record:
+        combined_gdf = concat_batches(batches)
+        record.rows_out = len(combined_gdf)
+
+    return combined_gdf.to_crs("EPSG:4326")
+
+
+def process_building_footprints(
+    aoi_input, clip_mode="within", compact=None, return_type="geopandas"
+):
+    batches = [
+        gdf
+        for _, gdf in iter_building_footprints(
+            aoi_input, clip_mode, compact, return_type
+        )
+    ]
+    if return_type == "arrow":
+        return concat_tables(batches)
+    return combine_buildings(batches)
+
+
+async def iter_building_footprints_async(aoi_input, clip_mode="within", compact=None):
+    """Async version of iter_building_footprints for use in an event loop.
+
+    The CLI runs as an asyncio subprocess; dataset reads, parsing and
+    clipping run in threads.
+    """
+    check_clip_mode(clip_mode)
+    aoi_gdf = await asyncio.to_thread(read_aoi, aoi_input)
+    compact = resolve_compact(compact, aoi_gdf)
+
+    idx = 0
+
+    for aoi_row in aoi_gdf.itertuples():
+        aoi_shape = aoi_row.geometry
+        bbox = aoi_shape.bounds
+        print(f"Processing AOI with bounding box: {','.join(map(str, bbox))}")
+
+        if OVERTURE_DATASET_URL:
+            gdf = await asyncio.to_thread(
+                read_dataset, OVERTURE_DATASET_URL, bbox, compact
+            )
+        else:
+            gdf = await download_with_cli_async(bbox, compact)
+
+        gdf = await asyncio.to_thread(clip_buildings, gdf, aoi_shape, clip_mode)
+        if gdf.empty:
+            continue
+        gdf["id"] = range(idx, idx + len(gdf))
+        idx += len(gdf)
+        yield None, gdf
+
+
+async def process_building_footprints_async(
+    aoi_input, clip_mode="within", compact=None
+):
+    """Async version of process_building_footprints."""
+    batches = [
+        gdf
+        async for _, gdf in iter_building_footprints_async(
+            aoi_input, clip_mode, compact
+        )
+    ]
+    return await asyncio.to_thread(combine_buildings, batches)
 
 
 def main():
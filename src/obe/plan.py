@@ -0,0 +1,331 @@
+"""Dry-run planning of extractions.
+
+:func:`plan_extraction` lists the tiles a source would fetch for an AOI and
+estimates their size, the number of buildings and the runtime without
+downloading any building data:
+
+- Google: S2 tiles, sized with HEAD requests
+- Microsoft: quadkeys, sized with the ``Size`` column of dataset-links.csv
+- Overture: row groups of OBE_OVERTURE_DATASET_URL whose bbox statistics
+  overlap the AOI, with their exact row counts and compressed sizes
+- OSM: one snapshot per AOI feature; its size is unknown up front
+
+Rows are estimated from the tile sizes and the share of each tile covered by
+the AOI, and runtime from the throughput of earlier runs, which the ``obe``
+CLI records in THROUGHPUT_FILE after every extraction.
+"""
+
+import json
+import os
+import re
+import tempfile
+
+import shapely
+from shapely.geometry import box
+
+from .clip import read_aoi
+from .concurrency import bounded_map
+
+THROUGHPUT_FILE = os.getenv(
+    "OBE_THROUGHPUT_FILE",
+    os.path.join(os.path.expanduser("~"), ".cache", "obe", "throughput.json"),
+)
+
+# Used until a source has recorded throughput of its own.
+DEFAULT_THROUGHPUT = {
+    "google": {"bytes_per_second": 5 * 1024**2, "rows_per_byte": 1 / 110},
+    "microsoft": {"bytes_per_second": 5 * 1024**2, "rows_per_byte": 1 / 150},
+    "osm": {"bytes_per_second": 2 * 1024**2, "rows_per_byte": 1 / 400},
+    "overture": {"bytes_per_second": 20 * 1024**2, "rows_per_byte": 1 / 100},
+}
+
+# Weight of the latest run in the recorded moving averages.
+SMOOTHING = 0.3
+
+_SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+
+
+class ExtractionPlan:
+    """Tiles of a planned extraction and the estimates derived from them.
+
+    Each tile is a dict with ``key``, ``url``, ``bytes`` (None if unknown),
+    ``rows`` (estimated buildings in the AOI, None if unknown) and
+    ``coverage``, the share of the tile covered by the AOI.
+    """
+
+    def __init__(self, source, tiles, throughput, notes=None):
+        self.source = source
+        self.tiles = tiles
+        self.throughput = throughput
+        self.notes = notes or []
+
+    @property
+    def complete(self):
+        """Whether every tile has a known size."""
+        return all(tile["bytes"] is not None for tile in self.tiles)
+
+    @property
+    def total_bytes(self):
+        return sum(tile["bytes"] or 0 for tile in self.tiles)
+
+    @property
+    def estimated_rows(self):
+        if any(tile["rows"] is None for tile in self.tiles):
+            return None
+        return int(round(sum(tile["rows"] for tile in self.tiles)))
+
+    @property
+    def estimated_seconds(self):
+        if not self.complete:
+            return None
+        return self.total_bytes / self.throughput["bytes_per_second"]
+
+    def to_dict(self):
+        return {
+            "source": self.source,
+            "tiles": self.tiles,
+            "total_bytes": self.total_bytes,
+            "complete": self.complete,
+            "estimated_rows": self.estimated_rows,
+            "estimated_seconds": self.estimated_seconds,
+            "throughput": self.throughput,
+            "notes": self.notes,
+        }
+
+    def summary(self):
+        """Human readable table of the plan."""
+        from .metrics import _size
+
+        header = f"{'Tile':<32}{'Size':>11}{'Coverage':>10}{'Est. rows':>11}"
+        lines = [header, "-" * len(header)]
+        for tile in self.tiles:
+            rows = "?" if tile["rows"] is None else f"{tile['rows']:,.0f}"
+            size = "?" if tile["bytes"] is None else _size(tile["bytes"])
+            lines.append(
+                f"{str(tile['key'])[:31]:<32}{size:>11}"
+                f"{tile['coverage']:>10.0%}{rows:>11}"
+            )
+        lines.append("-" * len(header))
+        rows = self.estimated_rows
+        seconds = self.estimated_seconds
+        lines.append(
+            f"{len(self.tiles)} tiles, {_size(self.total_bytes)}"
+            f"{'' if self.complete else ' (some sizes unknown)'}, "
+            f"~{'?' if rows is None else f'{rows:,}'} buildings, "
+            f"~{'?' if seconds is None else f'{seconds:.0f}'}s"
+        )
+        lines.extend(self.notes)
+        return "\n".join(lines)
+
+
+def parse_size(text):
+    """Bytes of a size such as ``"12.5KB"`` or ``"3 MB"``; None if unparsable."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?B)\s*", str(text), re.IGNORECASE)
+    if not match:
+        return None
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def coverage(aoi, tile_polygon):
+    """Share of tile_polygon covered by aoi."""
+    area = tile_polygon.area
+    if not area:
+        return 0.0
+    return min(shapely.intersection(aoi, tile_polygon).area / area, 1.0)
+
+
+def content_length(url):
+    """Size of url from a HEAD request; 0 if it does not exist."""
+    import requests
+
+    from .fetch import request
+
+    try:
+        response = request("HEAD", url)
+    except requests.HTTPError as exc:
+        if exc.response is not None and exc.response.status_code == 404:
+            return 0
+        raise
+    length = response.headers.get("Content-Length")
+    return int(length) if length is not None else None
+
+
+def load_throughput(source):
+    """Recorded throughput of source, falling back to DEFAULT_THROUGHPUT."""
+    throughput = dict(DEFAULT_THROUGHPUT[source], runs=0)
+    try:
+        with open(THROUGHPUT_FILE) as f:
+            throughput.update(json.load(f).get(source, {}))
+    except (OSError, ValueError):
+        pass
+    return throughput
+
+
+def record_throughput(source, run):
+    """Fold the metrics of a finished run (Metrics.to_dict()) into THROUGHPUT_FILE.
+
+    Nothing is recorded when THROUGHPUT_FILE is empty (OBE_THROUGHPUT_FILE="").
+    The file is replaced atomically, so concurrent runs never read it
+    half-written; one of two simultaneous updates may be lost.
+    """
+    download = run["stages"].get("download", {})
+    nbytes = download.get("bytes", 0)
+    if not THROUGHPUT_FILE or not nbytes or not run["total_seconds"]:
+        return
+    rows = run["stages"].get("clip", {}).get("rows_in", 0)
+    try:
+        with open(THROUGHPUT_FILE) as f:
+            history = json.load(f)
+    except (OSError, ValueError):
+        history = {}
+    entry = history.get(source)
+    latest = {"bytes_per_second": nbytes / run["total_seconds"]}
+    if rows:
+        latest["rows_per_byte"] = rows / nbytes
+    if entry is None:
+        entry = dict(latest, runs=0)
+    for key, value in latest.items():
+        previous = entry.get(key, value)
+        entry[key] = (1 - SMOOTHING) * previous + SMOOTHING * value
+    entry["runs"] = entry.get("runs", 0) + 1
+    history[source] = entry
+    directory = os.path.dirname(THROUGHPUT_FILE) or "."
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".throughput-")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(history, f, indent=2)
+        os.replace(temp_path, THROUGHPUT_FILE)
+    except OSError:
+        os.remove(temp_path)
+
+
+def s2_cell_polygon(token):
+    import s2sphere
+
+    cell = s2sphere.Cell(s2sphere.CellId.from_token(token))
+    vertices = [s2sphere.LatLng.from_point(cell.get_vertex(i)) for i in range(4)]
+    return shapely.Polygon([(v.lng().degrees, v.lat().degrees) for v in vertices])
+
+
+def _union_coverage(aois, polygon):
+    return coverage(shapely.union_all(aois), polygon)
+
+
+def plan_google(aois, throughput):
+    from . import google
+
+    tokens = sorted(
+        {token for aoi in aois for token in google.get_s2_tiles(aoi.bounds)}
+    )
+    urls = {token: google.tile_url(token) for token in tokens}
+    sizes = dict(bounded_map(lambda token: content_length(urls[token]), tokens))
+    tiles = []
+    for token in tokens:
+        share = _union_coverage(aois, s2_cell_polygon(token))
+        tiles.append(_tile(token, urls[token], sizes[token], share, throughput))
+    return tiles, []
+
+
+def plan_microsoft(aois, location, throughput):
+    import mercantile
+
+    from .microsoft import covering_quadkeys, load_dataset_links, tile_urls
+
+    if not location:
+        raise ValueError("Location is required for Microsoft data source.")
+    links = load_dataset_links(location)
+    quad_keys = sorted({qk for aoi in aois for qk in covering_quadkeys(aoi.bounds)})
+    urls = tile_urls(links, location, quad_keys)
+    notes = []
+    if "Size" in links.columns:
+        rows = links[links["Location"] == location].set_index("QuadKey")["Size"]
+        sizes = {qk: parse_size(rows.get(qk)) for qk in quad_keys}
+    else:
+        notes.append("dataset-links.csv has no Size column; sized with HEAD requests")
+        sizes = dict(bounded_map(lambda qk: content_length(urls[qk]), quad_keys))
+    tiles = []
+    for quad_key in quad_keys:
+        bounds = mercantile.bounds(mercantile.quadkey_to_tile(quad_key))
+        share = _union_coverage(aois, box(*bounds))
+        tiles.append(
+            _tile(quad_key, urls[quad_key], sizes[quad_key], share, throughput)
+        )
+    return tiles, notes
+
+
+def plan_overture(aois, throughput):
+    from . import overture
+
+    if not overture.OVERTURE_DATASET_URL:
+        return [_tile("overturemaps CLI", None, None, 1.0, None)], [
+            "Overture is planned from OBE_OVERTURE_DATASET_URL, which is not set; "
+            "the overturemaps CLI gives no size information up front"
+        ]
+
+    union = shapely.union_all(aois)
+    minx, miny, maxx, maxy = union.bounds
+    tiles = []
+    row_groups = overture.dataset_row_groups(overture.OVERTURE_DATASET_URL)
+    for path, index, group, bounds in row_groups:
+        if bounds is not None and not (
+            bounds[0] < maxx
+            and bounds[2] > minx
+            and bounds[1] < maxy
+            and bounds[3] > miny
+        ):
+            continue
+        nbytes = sum(
+            group.column(i).total_compressed_size for i in range(group.num_columns)
+        )
+        share = coverage(union, box(*bounds)) if bounds is not None else 1.0
+        tiles.append(
+            {
+                "key": f"{os.path.basename(path)}#{index}",
+                "url": path,
+                "bytes": nbytes,
+                "rows": group.num_rows * share,
+                "coverage": share,
+            }
+        )
+    return tiles, []
+
+
+def plan_osm(aois):
+    tiles = [_tile(f"snapshot {i}", None, None, 1.0, None) for i in range(len(aois))]
+    return tiles, ["OSM snapshots are generated on request; their size is unknown"]
+
+
+def _tile(key, url, nbytes, share, throughput):
+    rows = None if nbytes is None else nbytes * throughput["rows_per_byte"] * share
+    return {"key": key, "url": url, "bytes": nbytes, "rows": rows, "coverage": share}
+
+
+def plan_extraction(source, aoi_input, location=None):
+    """Plan the extraction of ``source`` for an AOI without downloading it.
+
+    Returns an :class:`ExtractionPlan`; see the module docstring for how each
+    source is sized.
+    """
+    source = source.lower()
+    if source not in DEFAULT_THROUGHPUT:
+        raise ValueError(f"Unknown source: {source}")
+    aois = shapely.make_valid(read_aoi(aoi_input).geometry.values)
+    throughput = load_throughput(source)
+    if source == "google":
+        tiles, notes = plan_google(aois, throughput)
+    elif source == "microsoft":
+        tiles, notes = plan_microsoft(aois, location, throughput)
+    elif source == "overture":
+        tiles, notes = plan_overture(aois, throughput)
+    else:
+        tiles, notes = plan_osm(aois)
+    if not throughput["runs"]:
+        notes.append(
+            f"No recorded runs of {source} yet; runtime uses a default of "
+            f"{throughput['bytes_per_second'] / 1024**2:.0f} MB/s"
+        )
+    return ExtractionPlan(source, tiles, throughput, notes)
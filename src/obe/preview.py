@@ -0,0 +1,104 @@
+"""Lightweight map previews of extraction results.
+
+Serializing every vertex of every building as GeoJSON does not scale past a
+few tens of thousands of buildings in the browser. A preview instead holds
+
+- ``polygons``: a capped, deterministic sample of simplified footprint rings
+  with rounded coordinates, one row per polygon, and
+- ``density``: building counts binned on a regular grid, which is what is
+  drawn when the result is larger than the cap.
+
+Both are plain columnar DataFrames that map directly onto deck.gl layers
+(PolygonLayer and HeatmapLayer).
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+
+DEFAULT_MAX_FEATURES = 20_000
+DEFAULT_GRID_SIZE = 256
+# Simplification tolerance in degrees, about a metre at the equator.
+DEFAULT_TOLERANCE = 1e-5
+DEFAULT_PRECISION = 6
+
+
+class Preview:
+    """Preview layers of a result; ``density`` is None for small results."""
+
+    def __init__(self, total, polygons, density, bounds):
+        self.total = total
+        self.polygons = polygons
+        self.density = density
+        self.bounds = bounds
+
+    @property
+    def sampled(self):
+        return len(self.polygons) < self.total
+
+
+def sample_positions(total, max_features, seed=0):
+    """Sorted positions of a deterministic sample of at most max_features."""
+    if total <= max_features:
+        return np.arange(total)
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(total, size=max_features, replace=False))
+
+
+def polygon_rings(geometries, tolerance=DEFAULT_TOLERANCE, precision=DEFAULT_PRECISION):
+    """Simplified exterior rings of ``geometries`` as lists of [x, y]."""
+    parts = shapely.get_parts(np.asarray(geometries))
+    parts = parts[shapely.get_type_id(parts) == 3]  # polygons only
+    if len(parts) == 0:
+        return []
+    simplified = shapely.simplify(parts, tolerance, preserve_topology=False)
+    collapsed = shapely.is_empty(simplified) | (shapely.get_num_coordinates(simplified) < 4)
+    simplified[collapsed] = parts[collapsed]
+    coords, index = shapely.get_coordinates(
+        shapely.get_exterior_ring(simplified), return_index=True
+    )
+    coords = coords.round(precision)
+    splits = np.flatnonzero(np.diff(index)) + 1
+    return [ring.tolist() for ring in np.split(coords, splits)]
+
+
+def density_grid(geometries, bounds, grid_size=DEFAULT_GRID_SIZE, precision=DEFAULT_PRECISION):
+    """Building counts on a grid_size x grid_size grid over bounds."""
+    centroids = shapely.centroid(np.asarray(geometries))
+    x, y = shapely.get_x(centroids), shapely.get_y(centroids)
+    minx, miny, maxx, maxy = bounds
+    width = max(maxx - minx, 1e-9) / grid_size
+    height = max(maxy - miny, 1e-9) / grid_size
+    col = np.clip(((x - minx) / width).astype(int), 0, grid_size - 1)
+    row = np.clip(((y - miny) / height).astype(int), 0, grid_size - 1)
+    cells, counts = np.unique(row * grid_size + col, return_counts=True)
+    return pd.DataFrame(
+        {
+            "lon": (minx + (cells % grid_size + 0.5) * width).round(precision),
+            "lat": (miny + (cells // grid_size + 0.5) * height).round(precision),
+            "count": counts,
+        }
+    )
+
+
+def build_preview(
+    gdf,
+    max_features=DEFAULT_MAX_FEATURES,
+    grid_size=DEFAULT_GRID_SIZE,
+    tolerance=DEFAULT_TOLERANCE,
+    precision=DEFAULT_PRECISION,
+):
+    """Build a :class:`Preview` of ``gdf`` bounded by max_features polygons."""
+    geometries = np.asarray(gdf.geometry.values)
+    geometries = geometries[~shapely.is_empty(geometries) & ~shapely.is_missing(geometries)]
+    total = len(geometries)
+    bounds = tuple(shapely.total_bounds(geometries)) if total else None
+
+    positions = sample_positions(total, max_features)
+    polygons = pd.DataFrame(
+        {"polygon": polygon_rings(geometries[positions], tolerance, precision)}
+    )
+    density = None
+    if total > max_features:
+        density = density_grid(geometries, bounds, grid_size, precision)
+    return Preview(total, polygons, density, bounds)
@@ -0,0 +1,143 @@
+"""Compact attribute dtypes for building footprints.
+
+With default pandas dtypes the attribute columns of a large extraction can
+take more memory than the geometries: every string is a Python object and
+every number a float64. In compact mode each source parses its attributes
+straight into the dtypes declared in SCHEMAS, and any other column is
+shrunk by :func:`compact_frame`:
+
+- floats become float32
+- low-cardinality strings (OSM tags, Overture classes, ...) become categories
+- other strings become Arrow-backed ``string[pyarrow]``
+
+Compact mode is on by default for extractions whose AOI is larger than
+COMPACT_MIN_AREA_KM2.
+"""
+
+import math
+
+import pandas as pd
+
+STRING = "string[pyarrow]"
+
+SCHEMAS = {
+    "google": {
+        "latitude": "float32",
+        "longitude": "float32",
+        "area_in_meters": "float32",
+        "confidence": "float32",
+        "full_plus_code": STRING,
+    },
+    "microsoft": {
+        "height": "float32",
+        "confidence": "float32",
+    },
+    "osm": {},
+    "overture": {
+        "height": "float32",
+        "min_height": "float32",
+        "subtype": "category",
+        "class": "category",
+    },
+}
+
+COMPACT_MIN_AREA_KM2 = 10_000
+
+# Strings with at most this share of distinct values become categories.
+CATEGORY_MAX_RATIO = 0.5
+
+
+def aoi_area_km2(aoi_gdf):
+    """Approximate area of the AOI bounding boxes in km²."""
+    total = 0.0
+    for minx, miny, maxx, maxy in aoi_gdf.geometry.bounds.itertuples(index=False):
+        mid_lat = math.radians((miny + maxy) / 2)
+        total += (maxx - minx) * 111.32 * math.cos(mid_lat) * (maxy - miny) * 110.57
+    return total
+
+
+def resolve_compact(compact, aoi_gdf):
+    """Decide whether to use compact dtypes; None means "for large AOIs"."""
+    if compact is None:
+        return aoi_area_km2(aoi_gdf) >= COMPACT_MIN_AREA_KM2
+    return compact
+
+
+def _is_strings(series):
+    values = series.dropna()
+    return len(values) > 0 and values.map(type).eq(str).all()
+
+
+def compact_frame(df, source):
+    """Cast the attribute columns of ``df`` to compact dtypes, in place."""
+    schema = SCHEMAS.get(source, {})
+    geometry_name = getattr(df, "_geometry_column_name", None)
+    for column in df.columns:
+        if column == geometry_name:
+            continue
+        series = df[column]
+        if column in schema:
+            df[column] = series.astype(schema[column])
+        elif pd.api.types.is_float_dtype(series.dtype):
+            df[column] = series.astype("float32")
+        elif series.dtype == object and _is_strings(series):
+            if series.nunique() <= CATEGORY_MAX_RATIO * len(series):
+                df[column] = series.astype("category")
+            else:
+                df[column] = series.astype(STRING)
+    return df
+
+
+def unify_categories(batches):
+    """Give categorical columns the same categories in every batch.
+
+    pandas falls back to object dtype when concatenating categoricals with
+    different categories, which would undo compact mode for per-tile batches.
+    """
+    columns = {
+        column
+        for batch in batches
+        for column in batch.columns
+        if isinstance(batch[column].dtype, pd.CategoricalDtype)
+    }
+    if not columns:
+        return batches
+    categories = {column: set() for column in columns}
+    for batch in batches:
+        for column in columns & set(batch.columns):
+            series = batch[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                categories[column].update(series.cat.categories)
+            else:
+                categories[column].update(series.dropna().unique())
+    unified = []
+    for batch in batches:
+        batch = batch.copy(deep=False)
+        for column in columns & set(batch.columns):
+            dtype = pd.CategoricalDtype(sorted(categories[column], key=str))
+            batch[column] = batch[column].astype(dtype)
+        unified.append(batch)
+    return unified
+
+
+def compact_table(table, source):
+    """compact_frame for pyarrow tables.
+
+    Arrow strings already avoid Python objects, so only the SCHEMAS
+    categories are dictionary encoded; floats become float32.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    schema = SCHEMAS.get(source, {})
+    for position, field in enumerate(table.schema):
+        column = table.column(position)
+        dtype = schema.get(field.name)
+        if dtype == "float32" or (dtype is None and pa.types.is_floating(field.type)):
+            column = column.cast(pa.float32())
+        elif dtype == "category":
+            column = pc.dictionary_encode(column)
+        else:
+            continue
+        table = table.set_column(position, field.name, column)
+    return table
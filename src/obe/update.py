@@ -0,0 +1,277 @@
+"""Incremental refresh of an extraction, refetching only changed tiles.
+
+With ``download_buildings(..., update=True)`` (``obe --update``) the buildings
+of every source tile are kept in a sidecar directory ``<output>.tiles/`` and
+a manifest ``<output>.manifest.json`` records the version each one was built
+from:
+
+- Google and Microsoft tiles: the ETag and Last-Modified of a HEAD request,
+  and the SHA-256 of the content
+- Overture: the Parquet footer metadata (sizes, row counts and column
+  statistics) of the row groups of OBE_OVERTURE_DATASET_URL that the tile
+  reads; the CLI has no version
+- OSM: none, snapshots are always requested again
+
+plus a signature of the AOI geometry near the tile. A later update only
+downloads the tiles whose version changed or whose part of the AOI was
+edited, reuses the other tiles from the sidecar and rewrites the output.
+Changing any other parameter (location, clip mode, compact, format or
+parquet_options) discards the manifest and starts over.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import shapely
+
+from . import metrics
+
+MANIFEST_VERSION = 1
+
+# Degrees around a tile in which AOI edits make the tile be processed again;
+# buildings belong to the tile of their centre and may reach beyond its edge.
+TILE_MARGIN = 0.01
+
+
+def manifest_path(output_path):
+    return f"{output_path}.manifest.json"
+
+
+def tiles_dir(output_path):
+    return f"{output_path}.tiles"
+
+
+def load_manifest(output_path, params):
+    """Tile entries of the manifest, or {} if missing or made with other params."""
+    try:
+        with open(manifest_path(output_path)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest["params"] != params:
+        return {}
+    return manifest["tiles"]
+
+
+def tile_polygon(source, key):
+    """Extent of a Google S2 cell or Microsoft quadkey; None for other sources."""
+    if source == "google":
+        from .plan import s2_cell_polygon
+
+        return s2_cell_polygon(key)
+    if source == "microsoft":
+        import mercantile
+        from shapely.geometry import box
+
+        return box(*mercantile.bounds(mercantile.quadkey_to_tile(key)))
+    return None
+
+
+def aoi_signature(aois, polygon=None):
+    """Hash of the AOIs, only of their part within TILE_MARGIN of polygon if given."""
+    if polygon is not None:
+        aois = shapely.intersection(aois, polygon.buffer(TILE_MARGIN))
+    wkbs = shapely.to_wkb(shapely.normalize(aois), output_dimension=2)
+    digest = hashlib.sha256()
+    for wkb in sorted(wkbs):
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def tile_version(url):
+    """ETag and Last-Modified of url from a HEAD request."""
+    from .fetch import request
+
+    headers = request("HEAD", url).headers
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+
+
+def same_version(old, new):
+    """Whether two tile versions are known to be the same content."""
+    for field in ("etag", "last_modified", "sha256", "row_groups"):
+        if new.get(field) is not None:
+            return new[field] == old.get(field)
+    return False
+
+
+def row_groups_version(row_groups, bbox):
+    """Hash of the footer metadata of the row groups overlapping bbox."""
+    xmin, ymin, xmax, ymax = bbox
+    digest = hashlib.sha256()
+    for path, index, group, bounds in row_groups:
+        if bounds is not None and not (
+            bounds[0] < xmax
+            and bounds[2] > xmin
+            and bounds[1] < ymax
+            and bounds[3] > ymin
+        ):
+            continue
+        entry = {"path": path, "index": index, "metadata": group.to_dict()}
+        digest.update(json.dumps(entry, sort_keys=True, default=str).encode())
+    return {"row_groups": digest.hexdigest()}
+
+
+def update_buildings(
+    source,
+    aoi_input,
+    output_path,
+    file_format,
+    location=None,
+    clip_mode="within",
+    compact=None,
+    parquet_options=None,
+):
+    """Bring output_path up to date, reprocessing only tiles that changed.
+
+    A first run processes every tile. Returns the buildings of the whole
+    output like download_buildings.
+    """
+    import geopandas as gpd
+
+    from .batch import tile_groups
+    from .clip import check_clip_mode, join_buildings, read_aoi
+    from .concurrency import bounded_map
+    from .fetch import fetch_bytes
+    from .output import write_buildings, write_geoparquet
+    from .schema import resolve_compact
+
+    if file_format == "geoparquet-dataset":
+        raise ValueError("Update mode does not support geoparquet-dataset output")
+    if source == "microsoft" and not location:
+        raise ValueError("Location is required for Microsoft data source.")
+    check_clip_mode(clip_mode)
+    aoi_gdf = read_aoi(aoi_input)
+    aois = np.asarray(aoi_gdf.geometry.values)
+    compact = resolve_compact(compact, aoi_gdf)
+    params = {
+        "source": source,
+        "location": location,
+        "clip_mode": clip_mode,
+        "compact": compact,
+        "format": file_format,
+        # As read back from the manifest, e.g. tuples as lists.
+        "parquet_options": json.loads(json.dumps(parquet_options or {})),
+    }
+    previous = load_manifest(output_path, params)
+    groups = tile_groups(source, aois)
+    sidecar = tiles_dir(output_path)
+    os.makedirs(sidecar, exist_ok=True)
+
+    urls = {}
+    if source == "google":
+        from .google import parse_tile, tile_url
+
+        urls = {key: tile_url(key) for key in groups}
+    elif source == "microsoft":
+        from .microsoft import load_dataset_links, parse_tile, tile_urls
+
+        urls = tile_urls(load_dataset_links(location), location, list(groups))
+    else:
+        from .batch import plan_tiles
+
+        _, fetch = plan_tiles(source, aois, location, compact)
+
+    row_groups = None
+    if source == "overture":
+        from .overture import OVERTURE_DATASET_URL, dataset_row_groups
+
+        if OVERTURE_DATASET_URL:
+            row_groups = list(dataset_row_groups(OVERTURE_DATASET_URL))
+
+    def dataset_version(key):
+        """Version of an Overture tile, from the row groups its bbox reads."""
+        if row_groups is None:
+            return {}
+        bbox = tuple(shapely.total_bounds(aois[groups[key]]))
+        return row_groups_version(row_groups, bbox)
+
+    def sidecar_path(key):
+        return os.path.join(sidecar, f"{key}.parquet")
+
+    def refresh(key):
+        """Return (manifest entry, whether the tile was reprocessed)."""
+        positions = groups[key]
+        signature = aoi_signature(aois[positions], tile_polygon(source, key))
+        entry = previous.get(key)
+        reusable = (
+            entry is not None
+            and entry["aois"] == signature
+            and (not entry["rows"] or os.path.exists(sidecar_path(key)))
+        )
+        if key in urls:
+            url = urls[key]
+            version = tile_version(url)
+            if reusable and same_version(entry, version):
+                return dict(entry, **version), False
+            content = fetch_bytes(url)
+            version["sha256"] = hashlib.sha256(content).hexdigest()
+            if reusable and same_version(entry, {"sha256": version["sha256"]}):
+                return dict(entry, **version), False
+            if source == "google":
+                gdf = parse_tile(content, compact)
+            else:
+                gdf = parse_tile(content, compact, gzipped=url.endswith(".gz"))
+        else:
+            url = None
+            version = dataset_version(key)
+            if reusable and same_version(entry, version):
+                return entry, False
+            gdf = fetch(key)
+
+        rows = 0
+        if gdf is not None and not gdf.empty:
+            gdf = join_buildings(gdf, aois[positions], positions, clip_mode)
+            gdf = gdf.drop(columns="aoi_id")
+            rows = len(gdf)
+        if rows:
+            write_geoparquet(gdf, sidecar_path(key))
+        elif os.path.exists(sidecar_path(key)):
+            os.remove(sidecar_path(key))
+        return dict(version, url=url, aois=signature, rows=rows), True
+
+    tiles = {}
+    refreshed = 0
+    for key, (entry, changed) in bounded_map(refresh, list(groups)):
+        tiles[key] = entry
+        refreshed += changed
+    for key in set(previous) - set(tiles):
+        if os.path.exists(sidecar_path(key)):
+            os.remove(sidecar_path(key))
+    print(f"Refreshed {refreshed} of {len(tiles)} tiles")
+    metrics.annotate("tiles", len(tiles))
+    metrics.annotate("tiles_refreshed", refreshed)
+
+    with metrics.stage("read") as record:
+        batches = [
+            gpd.read_parquet(sidecar_path(key))
+            for key in sorted(tiles)
+            if tiles[key]["rows"]
+        ]
+        record.rows_out = sum(len(gdf) for gdf in batches)
+    if source == "google":
+        from .google import combine_buildings
+    elif source == "microsoft":
+        from .microsoft import combine_buildings
+    elif source == "osm":
+        from .osm import combine_buildings
+    else:
+        from .overture import combine_buildings
+    result_gdf = combine_buildings(batches)
+    if source == "microsoft":
+        result_gdf["id"] = range(len(result_gdf))
+    print(f"Processed {len(result_gdf)} building footprints.")
+
+    unchanged = not refreshed and set(tiles) == set(previous)
+    if unchanged and os.path.exists(output_path):
+        print(f"{output_path} is up to date.")
+    else:
+        print(f"Saving results to {output_path}...")
+        metrics.annotate("format", file_format)
+        write_buildings(result_gdf, output_path, file_format, parquet_options)
+
+    manifest = {"version": MANIFEST_VERSION, "params": params, "tiles": tiles}
+    with open(manifest_path(output_path), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return result_gdf
@@ -1,14 +1,45 @@
 import io
+import json
 import os
+import time
 from pathlib import Path
 
 import geopandas as gpd
 import pydeck as pdk
 import streamlit as st
 
-from src.obe.app import download_buildings
+from src.obe.jobs import FAILED, JobManager
+from src.obe.plan import plan_extraction
+from src.obe.preview import build_preview
 
 MAX_AREA_KM2 = float(os.getenv("MAX_AREA_KM2", 5000))
+# Jobs are gated on their planned download size when the source can tell it,
+# and on AOI area otherwise (OSM, or when planning fails).
+MAX_DOWNLOAD_MB = float(os.getenv("MAX_DOWNLOAD_MB", 500))
+MAX_PREVIEW_FEATURES = int(os.getenv("MAX_PREVIEW_FEATURES", 20000))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_CACHE_SIZE = int(os.getenv("JOB_CACHE_SIZE", 32))
+
+
+@st.cache_resource
+def get_job_manager():
+    """One job manager shared by every session of this server process."""
+    return JobManager(Path("temp"), max_workers=JOB_WORKERS, cache_size=JOB_CACHE_SIZE)
+
+
+@st.cache_data(ttl=3600, show_spinner="Planning extraction...")
+def get_plan(aoi_geojson, source, location):
+    """Dry-run plan of the extraction as a dict, or None if it cannot be planned."""
+    try:
+        return plan_extraction(source, aoi_geojson, location).to_dict()
+    except Exception:
+        return None
+
+
+def within_limits(plan, area_sqkm):
+    if plan is not None and plan["complete"] and plan["tiles"]:
+        return plan["total_bytes"] <= MAX_DOWNLOAD_MB * 1024**2
+    return area_sqkm <= MAX_AREA_KM2
 
 
 def calculate_area_sqkm(gdf):
@@ -19,6 +50,39 @@ def calculate_area_sqkm(gdf):
     return area_sqkm
 
 
+def preview_layers(output_gdf):
+    """Deck layers previewing the result without shipping every vertex."""
+    preview = build_preview(output_gdf, max_features=MAX_PREVIEW_FEATURES)
+    layers = []
+    if preview.density is not None:
+        layers.append(
+            pdk.Layer(
+                "HeatmapLayer",
+                data=preview.density,
+                get_position=["lon", "lat"],
+                get_weight="count",
+                aggregation="SUM",
+                radius_pixels=30,
+                opacity=0.6,
+            )
+        )
+    layers.append(
+        pdk.Layer(
+            "PolygonLayer",
+            data=preview.polygons,
+            get_polygon="polygon",
+            stroked=True,
+            filled=True,
+            extruded=False,
+            get_fill_color=[200, 30, 0, 140],
+            get_line_color=[0, 0, 0, 200],
+            line_width_min_pixels=1,
+            pickable=False,
+        )
+    )
+    return preview, layers
+
+
 st.set_page_config(
     page_title="Open Buildings Extractor",
     page_icon="🏘️",
@@ -119,6 +183,10 @@ with tabs[1]:
 
             if "gdf" in locals():
                 area_sqkm = calculate_area_sqkm(gdf)
+                plan = get_plan(
+                    json.loads(gdf.to_json()), source, location or None
+                )
+                allowed = within_limits(plan, area_sqkm)
                 bbox = gdf.total_bounds
                 view_state = pdk.ViewState(
                     longitude=(bbox[0] + bbox[2]) / 2,
@@ -148,9 +216,14 @@ with tabs[1]:
 
                 map_container = st.pydeck_chart(map_plot)
 
-                if area_sqkm > MAX_AREA_KM2:
+                if not allowed:
+                    limit = (
+                        f"{MAX_DOWNLOAD_MB:,.0f} MB of downloads"
+                        if plan is not None and plan["complete"] and plan["tiles"]
+                        else f"{MAX_AREA_KM2:,} km²"
+                    )
                     st.error(
-                        f"❌ Input area exceeds {MAX_AREA_KM2:,} km² due to server restrictions. "
+                        f"❌ Input area exceeds {limit} due to server restrictions. "
                         "For larger areas, please install and run locally: `pip install obe`"
                     )
 
@@ -162,76 +235,68 @@ with tabs[1]:
             st.subheader("Area Statistics")
             st.metric("Number of Features", len(gdf))
             st.metric("Area", f"{area_sqkm:.2f} km²")
+            if plan is not None and plan["complete"] and plan["tiles"]:
+                st.metric(
+                    "Estimated download",
+                    f"{plan['total_bytes'] / 1024**2:,.1f} MB in {len(plan['tiles'])} tiles",
+                )
+                st.metric("Estimated time", f"{plan['estimated_seconds']:.0f} s")
 
-            if area_sqkm <= MAX_AREA_KM2:
+            if allowed:
                 if st.button(
                     "🏗️ Extract Buildings", type="primary", use_container_width=True
                 ):
-                    with st.spinner("Downloading building footprints..."):
-                        try:
-                            temp_dir = Path("temp")
-                            temp_dir.mkdir(exist_ok=True)
-
-                            input_path = temp_dir / "input.geojson"
-                            output_path = temp_dir / f"buildings_{source}.{file_format}"
-
-                            with open(
-                                input_path,
-                                "w" if input_option == "Paste GeoJSON" else "wb",
-                            ) as f:
-                                f.write(
-                                    geojson_input
-                                    if input_option == "Paste GeoJSON"
-                                    else uploaded_file.getvalue()
-                                )
-
-                            download_buildings(
-                                source,
-                                str(input_path),
-                                str(output_path),
-                                file_format,
-                                location,
-                            )
-
-                            file_size = os.path.getsize(output_path)
-                            file_size_mb = file_size / (1024 * 1024)
-
-                            st.success("✨ Buildings extracted successfully!")
-                            st.info(
-                                f"📁 Output file: {output_path.name} ({file_size_mb:.2f} MB)"
-                            )
-
-                            if file_format == "geojson":
-                                output_gdf = gpd.read_file(output_path)
-                                buildings_layer = pdk.Layer(
-                                    "GeoJsonLayer",
-                                    data=output_gdf.__geo_interface__,
-                                    opacity=0.8,
-                                    stroked=True,
-                                    filled=True,
-                                    extruded=False,
-                                    get_fill_color=[200, 30, 0, 140],
-                                    get_line_color=[0, 0, 0, 200],
-                                    get_line_width=1,
-                                    pickable=True,
-                                )
-
-                                map_plot.layers.append(buildings_layer)
-                                map_container.pydeck_chart(map_plot)
-                                st.metric("Buildings found", len(output_gdf))
-
-                            with open(output_path, "rb") as f:
-                                st.download_button(
-                                    label=f"📥 Download",
-                                    data=f.read(),
-                                    file_name=output_path.name,
-                                    mime=f"application/{file_format}",
-                                    use_container_width=True,
-                                )
-
-                        except Exception as e:
-                            st.error(f"❌ Error: {str(e)}")
-                            st.error("Please check your input data and try again.")
+                    try:
+                        job = get_job_manager().submit(
+                            gdf, source, file_format, location or None
+                        )
+                        st.session_state["job_id"] = job.id
+                    except Exception as e:
+                        st.error(f"❌ Error: {str(e)}")
+
+            job_id = st.session_state.get("job_id")
+            job = get_job_manager().get(job_id) if job_id else None
+            if job is not None and not job.done:
+                progress = job.progress()
+                st.info(
+                    f"⏳ {progress['status'].capitalize()}"
+                    f"{' · ' + progress['stage'] if progress['stage'] else ''}"
+                    f" · {progress['elapsed']:.0f}s"
+                    f" · {progress['buildings']:,} buildings so far"
+                )
+                time.sleep(1)
+                st.rerun()
+            elif job is not None and job.status == FAILED:
+                st.error(f"❌ Error: {job.error}")
+                st.error("Please check your input data and try again.")
+            elif job is not None:
+                output_path = Path(job.output_path)
+                output_gdf = job.result
+                file_size = os.path.getsize(output_path)
+                file_size_mb = file_size / (1024 * 1024)
+
+                st.success("✨ Buildings extracted successfully!")
+                st.info(f"📁 Output file: {output_path.name} ({file_size_mb:.2f} MB)")
+
+                if len(output_gdf):
+                    preview, layers = preview_layers(output_gdf)
+                    map_plot.layers.extend(layers)
+                    map_container.pydeck_chart(map_plot)
+                    if preview.sampled:
+                        st.caption(
+                            f"Map shows a density heatmap and a sample of "
+                            f"{len(preview.polygons):,} buildings."
+                        )
+                st.metric("Buildings found", len(output_gdf))
+
+                with open(output_path, "rb") as f:
+                    st.download_button(
+                        label=f"📥 Download",
+                        data=f.read(),
+                        file_name=output_path.name,
+                        mime=f"application/{job.file_format}",
+                        use_container_width=True,
+                    )
         else:
             st.info("Statistics will appear here once data is loaded")
 
@@ -0,0 +1,18 @@
+import pytest
+
+from .standin import StandIn, World
+
+# Extent around the Pokhara test AOI used by the offline tests.
+STANDIN_EXTENT = (83.95, 28.19, 83.99, 28.225)
+
+
+@pytest.fixture(scope="session")
+def standin(tmp_path_factory):
+    """Local stand-in for every remote source, with obe pointed at it."""
+    world = World(STANDIN_EXTENT, density=2_000_000)
+    overture_dataset = world.write_overture(
+        str(tmp_path_factory.mktemp("overture") / "building")
+    )
+    with StandIn(world) as server:
+        with server.environment(overture_dataset=overture_dataset):
+            yield server
@@ -0,0 +1,379 @@
+"""Local stand-in for the remote building data sources.
+
+Serves deterministic synthetic buildings over HTTP in the layouts obe
+downloads from:
+
+- Google: ``/google/<s2 token>_buildings.csv.gz`` (headerless CSV, gzip)
+- Microsoft: ``/microsoft/dataset-links.csv`` and ``/microsoft/<quadkey>.csv.gz``
+  (gzip line-delimited GeoJSON features)
+- OSM raw-data API: ``/osm/v1/snapshot/``, ``/osm/v1/tasks/status/<id>`` and the
+  zipped ``obe.geojson`` snapshot
+- Overture: a local GeoParquet dataset written by :meth:`World.write_overture`
+
+Buildings are generated once for an extent and every tile serves the ones
+whose centre falls inside it, so results are identical across runs.
+
+    with StandIn(World((83.9, 28.1, 84.1, 28.3))) as standin:
+        with standin.environment():
+            download_buildings("google", "aoi.geojson", "out.parquet")
+"""
+
+import gzip
+import io
+import json
+import math
+import os
+import re
+import threading
+import uuid
+import zipfile
+import zlib
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mercantile
+import numpy as np
+import s2sphere
+
+MICROSOFT_LOCATION = "Testland"
+MICROSOFT_ZOOM = 9
+GOOGLE_LEVEL = 6
+
+
+class World:
+    """Synthetic square buildings scattered uniformly over an extent."""
+
+    def __init__(self, extent, density=200_000, seed=0):
+        minx, miny, maxx, maxy = extent
+        self.extent = extent
+        count = max(1, int(density * (maxx - minx) * (maxy - miny)))
+        rng = np.random.default_rng(seed)
+        self.lon = rng.uniform(minx, maxx, count)
+        self.lat = rng.uniform(miny, maxy, count)
+        self.half = rng.uniform(2e-5, 8e-5, count)
+        self.confidence = rng.uniform(0.6, 1.0, count).round(4)
+        self.height = rng.uniform(2.0, 30.0, count).round(2)
+        self._google = None
+        self._microsoft = None
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.lon)
+
+    def polygon(self, i):
+        x0, x1 = self.lon[i] - self.half[i], self.lon[i] + self.half[i]
+        y0, y1 = self.lat[i] - self.half[i], self.lat[i] + self.half[i]
+        return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+    def area_in_meters(self, i):
+        side = 2 * self.half[i] * 111_320
+        return round(side * side * math.cos(math.radians(self.lat[i])), 4)
+
+    def in_bounds(self, bounds):
+        minx, miny, maxx, maxy = bounds
+        mask = (
+            (self.lon >= minx) & (self.lon <= maxx) & (self.lat >= miny) & (self.lat <= maxy)
+        )
+        return np.flatnonzero(mask)
+
+    def edit(self, bounds, scale=1.5):
+        """Grow the buildings centred in bounds, changing the tiles holding them."""
+        with self._lock:
+            self.half[self.in_bounds(bounds)] *= scale
+            self._cache.clear()
+
+    def google_tiles(self):
+        """{s2 token: building indices} at the level Google publishes."""
+        if self._google is None:
+            tiles = {}
+            for i in range(len(self)):
+                latlng = s2sphere.LatLng.from_degrees(self.lat[i], self.lon[i])
+                token = (
+                    s2sphere.CellId.from_lat_lng(latlng).parent(GOOGLE_LEVEL).to_token()
+                )
+                tiles.setdefault(token, []).append(i)
+            self._google = tiles
+        return self._google
+
+    def microsoft_tiles(self):
+        """{quadkey: building indices} at the zoom Microsoft publishes."""
+        if self._microsoft is None:
+            n = 2**MICROSOFT_ZOOM
+            x = np.floor((self.lon + 180.0) / 360.0 * n).astype(int)
+            lat = np.radians(self.lat)
+            y = np.floor(
+                (1.0 - np.arcsinh(np.tan(lat)) / math.pi) / 2.0 * n
+            ).astype(int)
+            tiles = {}
+            for i, key in enumerate(zip(x, y)):
+                tiles.setdefault(key, []).append(i)
+            self._microsoft = {
+                mercantile.quadkey(mercantile.Tile(tx, ty, MICROSOFT_ZOOM)): idx
+                for (tx, ty), idx in tiles.items()
+            }
+        return self._microsoft
+
+    def cached(self, key, build):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = build()
+            return self._cache[key]
+
+    def google_tile(self, token):
+        lines = []
+        for i in self.google_tiles().get(token, []):
+            ring = ", ".join(f"{x:.7f} {y:.7f}" for x, y in self.polygon(i))
+            lines.append(
+                f"{self.lat[i]:.7f},{self.lon[i]:.7f},{self.area_in_meters(i)},"
+                f'{self.confidence[i]},"POLYGON(({ring}))",7MV8{i:08d}'
+            )
+        return gzip.compress(("\n".join(lines) + "\n").encode(), mtime=0)
+
+    def feature(self, i, properties):
+        return {
+            "type": "Feature",
+            "properties": properties,
+            "geometry": {"type": "Polygon", "coordinates": [self.polygon(i)]},
+        }
+
+    def microsoft_tile(self, quadkey):
+        lines = [
+            json.dumps(
+                self.feature(
+                    i,
+                    {"height": float(self.height[i]), "confidence": float(self.confidence[i])},
+                )
+            )
+            for i in self.microsoft_tiles().get(quadkey, [])
+        ]
+        return gzip.compress(("\n".join(lines) + "\n").encode(), mtime=0)
+
+    def microsoft_links(self, base_url):
+        rows = ["Location,QuadKey,Url,Size"]
+        quadkeys = set(self.microsoft_tiles()) | {
+            mercantile.quadkey(tile)
+            for tile in mercantile.tiles(*self.extent, zooms=MICROSOFT_ZOOM)
+        }
+        for quadkey in sorted(quadkeys):
+            size = len(self.cached(("ms", quadkey), lambda: self.microsoft_tile(quadkey)))
+            rows.append(
+                f"{MICROSOFT_LOCATION},{quadkey},{base_url}/microsoft/{quadkey}.csv.gz,{size / 1024:.1f}KB"
+            )
+        return ("\n".join(rows) + "\n").encode()
+
+    def prime(self, base_url):
+        """Build every tile payload up front so serving them is just I/O."""
+        for token in self.google_tiles():
+            self.cached(("google", token), lambda: self.google_tile(token))
+        self.cached("ms-links", lambda: self.microsoft_links(base_url))
+
+    def osm_snapshot(self, bounds):
+        features = [
+            self.feature(i, {"osm_id": int(i), "building": "yes", "tags": {"building": "yes"}})
+            for i in self.in_bounds(bounds)
+        ]
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(
+                "obe.geojson",
+                json.dumps({"type": "FeatureCollection", "features": features}),
+            )
+        return buffer.getvalue()
+
+    def write_overture(self, path, row_group_size=10_000):
+        """Write the buildings as an Overture-like GeoParquet dataset."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import shapely
+
+        os.makedirs(path, exist_ok=True)
+        order = np.lexsort((self.lon, self.lat))
+        polygons = shapely.polygons([self.polygon(i) for i in order])
+        table = pa.table(
+            {
+                "id": [f"08b{zlib.crc32(str(i).encode()):08x}{i:06d}" for i in order],
+                "geometry": shapely.to_wkb(polygons),
+                "bbox": pa.StructArray.from_arrays(
+                    [
+                        pa.array(self.lon[order] - self.half[order], pa.float32()),
+                        pa.array(self.lon[order] + self.half[order], pa.float32()),
+                        pa.array(self.lat[order] - self.half[order], pa.float32()),
+                        pa.array(self.lat[order] + self.half[order], pa.float32()),
+                    ],
+                    names=["xmin", "xmax", "ymin", "ymax"],
+                ),
+                "height": self.height[order],
+                "subtype": ["residential"] * len(order),
+            }
+        )
+        pq.write_table(
+            table, os.path.join(path, "part-00000.parquet"), row_group_size=row_group_size
+        )
+        return path
+
+
+class StandIn:
+    """Threaded HTTP server serving a :class:`World`."""
+
+    def __init__(self, world, host="127.0.0.1", port=0):
+        self.world = world
+        self.tasks = {}
+        self.throttled = 0
+        self._throttle_lock = threading.Lock()
+        handler = type("Handler", (_Handler,), {"standin": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.world.prime(self.base_url)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def throttle(self, count):
+        """Answer the next ``count`` data requests with 429 Too Many Requests."""
+        with self._throttle_lock:
+            self.throttled = count
+
+    def take_throttle(self):
+        with self._throttle_lock:
+            if self.throttled > 0:
+                self.throttled -= 1
+                return True
+            return False
+
+    def env(self, overture_dataset=None):
+        """Environment variables pointing obe at this stand-in."""
+        env = {
+            "OBE_GOOGLE_BASE_URL": f"{self.base_url}/google/",
+            "OBE_MICROSOFT_DATASET_URL": f"{self.base_url}/microsoft/dataset-links.csv",
+            "OBE_OSM_API_URL": f"{self.base_url}/osm/v1",
+        }
+        if overture_dataset:
+            env["OBE_OVERTURE_DATASET_URL"] = overture_dataset
+        return env
+
+    @contextmanager
+    def environment(self, overture_dataset=None):
+        """Point the already imported obe source modules at this stand-in."""
+        from obe import google, microsoft, osm, overture
+
+        patches = [
+            (google, "BUILDING_BASE_URL", f"{self.base_url}/google/"),
+            (microsoft, "DATASET_SOURCE_URL", f"{self.base_url}/microsoft/dataset-links.csv"),
+            (osm, "OSM_API_URL", f"{self.base_url}/osm/v1"),
+            (overture, "OVERTURE_DATASET_URL", overture_dataset),
+        ]
+        saved = [(module, name, getattr(module, name)) for module, name, _ in patches]
+        try:
+            for module, name, value in patches:
+                setattr(module, name, value)
+            yield self
+        finally:
+            for module, name, value in saved:
+                setattr(module, name, value)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    standin = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(
+        self, body, content_type="application/octet-stream", status=200, headers=None
+    ):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", f'"{zlib.crc32(body):08x}"')
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def not_found(self):
+        self.send_body(b"not found", "text/plain", status=404)
+
+    def body_for(self, path):
+        world = self.standin.world
+        if match := re.fullmatch(r"/google/(\w+)_buildings\.csv\.gz", path):
+            token = match.group(1)
+            return world.cached(("google", token), lambda: world.google_tile(token))
+        if path == "/microsoft/dataset-links.csv":
+            return world.cached(
+                "ms-links", lambda: world.microsoft_links(self.standin.base_url)
+            )
+        if match := re.fullmatch(r"/microsoft/(\d+)\.csv\.gz", path):
+            quadkey = match.group(1)
+            return world.cached(("ms", quadkey), lambda: world.microsoft_tile(quadkey))
+        if match := re.fullmatch(r"/osm/download/(\w+)\.zip", path):
+            bounds = self.standin.tasks.get(match.group(1))
+            return None if bounds is None else world.osm_snapshot(bounds)
+        return None
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        if match := re.fullmatch(r"/osm/v1/tasks/status/(\w+)", self.path):
+            task_id = match.group(1)
+            if task_id not in self.standin.tasks:
+                return self.not_found()
+            body = {
+                "status": "SUCCESS",
+                "result": {
+                    "download_url": f"{self.standin.base_url}/osm/download/{task_id}.zip"
+                },
+            }
+            return self.send_body(json.dumps(body).encode(), "application/json")
+
+        if self.standin.take_throttle():
+            return self.send_body(
+                b"slow down", "text/plain", status=429, headers={"Retry-After": "0"}
+            )
+        body = self.body_for(self.path)
+        if body is None:
+            return self.not_found()
+        self.send_body(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip("/") != "/osm/v1/snapshot":
+            return self.not_found()
+        coordinates = np.array(
+            [point for ring in _rings(payload["geometry"]) for point in ring]
+        )
+        bounds = (*coordinates.min(axis=0), *coordinates.max(axis=0))
+        task_id = uuid.uuid4().hex
+        self.standin.tasks[task_id] = bounds
+        body = {"task_id": task_id, "track_link": f"/tasks/status/{task_id}"}
+        self.send_body(json.dumps(body).encode(), "application/json")
+
+
+def _rings(geometry):
+    if geometry["type"] == "Polygon":
+        return geometry["coordinates"]
+    if geometry["type"] == "MultiPolygon":
+        return [ring for polygon in geometry["coordinates"] for ring in polygon]
+    raise ValueError(f"Unsupported geometry type: {geometry['type']}")
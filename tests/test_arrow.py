@@ -0,0 +1,93 @@
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.json as pa_json
+import pytest
+import shapely
+
+from obe.app import download_buildings
+from obe.arrow import geojson_geometries
+
+from .standin import MICROSOFT_LOCATION
+from .test_app import TEST_GEOJSON
+
+
+@pytest.mark.parametrize("source", ["google", "microsoft", "osm", "overture"])
+@pytest.mark.parametrize("clip_mode", ["within", "clip"])
+def test_arrow_matches_geopandas(standin, source, clip_mode):
+    location = MICROSOFT_LOCATION if source == "microsoft" else None
+    gdf = download_buildings(
+        source, TEST_GEOJSON, None, location=location, clip_mode=clip_mode
+    )
+    table = download_buildings(
+        source,
+        TEST_GEOJSON,
+        None,
+        location=location,
+        clip_mode=clip_mode,
+        return_type="arrow",
+    )
+    assert isinstance(table, pa.Table)
+    field = table.schema.field("geometry")
+    assert field.metadata[b"ARROW:extension:name"] == b"geoarrow.wkb"
+
+    result = gpd.GeoDataFrame.from_arrow(table)
+    assert result.crs == "EPSG:4326"
+    assert len(result) == len(gdf) > 0
+    assert set(result.columns) == set(gdf.columns)
+    assert sorted(result.geometry.to_wkb()) == sorted(gdf.geometry.to_wkb())
+
+
+def test_arrow_geoparquet_output(standin, tmp_path):
+    output_path = tmp_path / "buildings.parquet"
+    table = download_buildings(
+        "google", TEST_GEOJSON, str(output_path), return_type="arrow", compact=True
+    )
+    written = gpd.read_parquet(output_path)
+    assert written.crs == "EPSG:4326"
+    assert len(written) == len(table)
+    assert written["confidence"].dtype == "float32"
+
+
+def test_geojson_geometries_fallback():
+    polygon = '{"geometry": {"type": "Polygon", "coordinates": [[%s]]}}'
+    lines = [
+        polygon % "[0, 0], [1, 0], [1, 1], [0, 0]",
+        polygon % "[2, 2], [3, 2], [3, 3], [2, 2]",
+    ]
+    table = pa_json.read_json(pa.BufferReader("\n".join(lines).encode()))
+    polygons = geojson_geometries(table["geometry"])
+    assert list(shapely.area(polygons)) == [0.5, 0.5]
+
+    # Not only 2D polygons: parsed from the GeoJSON instead.
+    lines[1] = lines[1].replace("[3, 3]", "[3, 3, 1]")
+    table = pa_json.read_json(pa.BufferReader("\n".join(lines).encode()))
+    geometries = geojson_geometries(table["geometry"])
+    assert list(shapely.has_z(geometries)) == [False, True]
+
+
+def test_osm_table_has_the_tags_of_every_feature():
+    from obe.osm import parse_snapshot, parse_snapshot_table
+
+    def feature(x, **properties):
+        return {
+            "type": "Feature",
+            "properties": properties,
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[x, 0], [x + 1, 0], [x + 1, 1], [x, 0]]],
+            },
+        }
+
+    osm_data = {
+        "features": [
+            feature(0, osm_id=1, building="yes"),
+            feature(2, osm_id=2, building="house", name="Town hall"),
+            feature(4, osm_id=3, building="yes", **{"building:levels": 3}),
+            feature(6, osm_id=4, building="yes", **{"building:levels": "2a"}),
+        ]
+    }
+    gdf = parse_snapshot(osm_data)
+    table = parse_snapshot_table(osm_data, shapely.box(-1, -1, 10, 2))
+    assert set(table.column_names) == set(gdf.columns)
+    assert table["name"].to_pylist() == [None, "Town hall", None, None]
+    assert table["building:levels"].to_pylist() == [None, None, "3", "2a"]
@@ -0,0 +1,101 @@
+import os
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import box, mapping
+
+from obe import metrics
+from obe.app import download_buildings, main
+from obe.batch import AOI_ID_COLUMN, process_batch, write_per_aoi
+
+from .standin import MICROSOFT_LOCATION
+
+# Overlapping AOIs inside the stand-in extent, sharing tiles.
+AOIS = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "type": "Feature",
+            "properties": {"name": f"cluster-{i}"},
+            "geometry": mapping(
+                box(83.96 + i * 0.004, 28.20, 83.966 + i * 0.004, 28.206)
+            ),
+        }
+        for i in range(4)
+    ],
+}
+
+
+@pytest.mark.parametrize("source", ["google", "microsoft", "osm", "overture"])
+def test_batch_matches_separate_extractions(standin, source):
+    """Every AOI gets the same buildings as when extracted on its own."""
+    location = MICROSOFT_LOCATION if source == "microsoft" else None
+    with metrics.collect() as run:
+        result = process_batch(source, AOIS, location, id_column="name")
+
+    for feature in AOIS["features"]:
+        single = download_buildings(
+            source,
+            {"type": "FeatureCollection", "features": [feature]},
+            None,
+            location=location,
+        )
+        name = feature["properties"]["name"]
+        assert (result[AOI_ID_COLUMN] == name).sum() == len(single) > 0
+
+    # The AOIs share their tiles, which are downloaded only once.
+    assert run.info["tiles"] < run.info["aois"]
+    if source == "google":
+        assert run.stages["download"]["calls"] == run.info["tiles"]
+    elif source == "microsoft":  # plus dataset-links.csv
+        assert run.stages["download"]["calls"] == run.info["tiles"] + 1
+
+
+def test_batch_cli_writes_one_file_per_aoi(standin, tmp_path):
+    aoi_path = tmp_path / "aois.geojson"
+    empty = {
+        "type": "Feature",
+        "properties": {"name": "empty"},
+        "geometry": mapping(box(83.95, 28.19, 83.950001, 28.190001)),
+    }
+    features = AOIS["features"] + [empty]
+    gpd.GeoDataFrame.from_features(features, crs=4326).to_file(aoi_path)
+    output_dir = tmp_path / "out"
+
+    main(
+        [
+            "batch",
+            "--source",
+            "google",
+            "--input",
+            str(aoi_path),
+            "--id-column",
+            "name",
+            "--output-dir",
+            str(output_dir),
+            "--format",
+            "geoparquet",
+        ]
+    )
+
+    files = sorted(os.listdir(output_dir))
+    assert files == [f"cluster-{i}.parquet" for i in range(4)] + ["empty.parquet"]
+    first = gpd.read_parquet(output_dir / files[0])
+    assert (first[AOI_ID_COLUMN] == "cluster-0").all()
+    # An AOI without buildings still gets its (empty) file.
+    none = gpd.read_parquet(output_dir / "empty.parquet")
+    assert none.empty and list(none.columns) == list(first.columns)
+
+
+def test_per_aoi_files_do_not_collide(tmp_path):
+    ids = ["a/b", "a_b", "A", "a", "c"]
+    gdf = gpd.GeoDataFrame(
+        {AOI_ID_COLUMN: ids},
+        geometry=[box(i, 0, i + 1, 1) for i in range(len(ids))],
+        crs=4326,
+    )
+    paths = write_per_aoi(gdf, tmp_path, "geoparquet", ids)
+    assert len({path.casefold() for path in paths}) == len(ids)
+    assert os.path.basename(paths[-1]) == "c.parquet"
+    for aoi_id, path in zip(ids, paths):
+        assert list(gpd.read_parquet(path)[AOI_ID_COLUMN]) == [aoi_id]
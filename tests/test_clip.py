@@ -0,0 +1,104 @@
+import geopandas as gpd
+import pytest
+from shapely.geometry import Point, box
+
+from obe.clip import clip_buildings, join_buildings
+
+AOI = box(0, 0, 10, 10)
+
+
+@pytest.fixture
+def buildings():
+    """One building inside, one straddling the boundary, one outside."""
+    return gpd.GeoDataFrame(
+        {"name": ["inside", "straddling", "outside", "mostly_out"]},
+        geometry=[box(1, 1, 2, 2), box(9, 4, 11, 5), box(20, 20, 21, 21), box(9.5, 8, 12, 9)],
+        crs="EPSG:4326",
+    )
+
+
+@pytest.mark.parametrize(
+    "mode, expected",
+    [
+        ("within", ["inside"]),
+        ("intersects", ["inside", "straddling", "mostly_out"]),
+        ("centroid", ["inside", "straddling"]),
+        ("clip", ["inside", "straddling", "mostly_out"]),
+    ],
+)
+def test_clip_modes(buildings, mode, expected):
+    result = clip_buildings(buildings, AOI, mode)
+    assert list(result["name"]) == expected
+    assert result.crs == buildings.crs
+
+
+def test_clip_mode_cuts_at_boundary(buildings):
+    result = clip_buildings(buildings, AOI, "clip")
+    assert result.geometry.within(AOI).all()
+    assert result.geometry.iloc[1].equals(box(9, 4, 10, 5))
+
+
+def test_clip_drops_touching_lines():
+    """Buildings only touching the AOI edge do not become lines."""
+    gdf = gpd.GeoDataFrame(geometry=[box(10, 0, 11, 1)], crs="EPSG:4326")
+    assert clip_buildings(gdf, AOI, "clip").empty
+
+
+def test_clip_keeps_only_polygons():
+    """A building overlapping the AOI and touching another edge stays a polygon."""
+    aoi = box(0, 0, 2, 1).union(box(0, 1, 1, 2))
+    gdf = gpd.GeoDataFrame(
+        geometry=[box(1, 0.5, 1.5, 1.5), box(0.2, 0.2, 0.4, 0.4), box(3, 0, 4, 1)],
+        crs="EPSG:4326",
+    )
+    result = clip_buildings(gdf, aoi, "clip")
+    assert list(result.geom_type) == ["Polygon", "Polygon"]
+    assert result.geometry.iloc[0].equals(box(1, 0.5, 1.5, 1))
+    assert list(join_buildings(gdf, [aoi], [0], "clip").geom_type) == [
+        "Polygon",
+        "Polygon",
+    ]
+
+
+def test_clip_mixes_whole_and_split_buildings():
+    """A building cut in two after one that stays whole."""
+    aoi = box(0, 0, 3, 1).union(box(0, 1, 1, 3)).union(box(2, 1, 3, 3))
+    gdf = gpd.GeoDataFrame(
+        geometry=[box(-0.5, 0.2, 0.5, 0.4), box(0.5, 2, 2.5, 2.5)],
+        crs="EPSG:4326",
+    )
+    result = clip_buildings(gdf, aoi, "clip")
+    assert list(result.geom_type) == ["Polygon", "MultiPolygon"]
+    assert result.geometry.iloc[1].area == 0.5
+    joined = join_buildings(gdf, [aoi], [0], "clip")
+    assert list(joined.geom_type) == ["Polygon", "MultiPolygon"]
+
+
+def test_invalid_clip_mode(buildings):
+    with pytest.raises(ValueError):
+        clip_buildings(buildings, AOI, "nearest")
+
+
+def test_complex_aoi_matches_within():
+    """Tree-based selection agrees with the element-wise predicate."""
+    aoi = Point(0, 0).buffer(5, quad_segs=512)
+    gdf = gpd.GeoDataFrame(
+        geometry=[box(x / 2, y / 2, x / 2 + 0.3, y / 2 + 0.3) for x in range(-12, 12) for y in range(-12, 12)],
+        crs="EPSG:4326",
+    )
+    expected = gdf[gdf.geometry.within(aoi)]
+    assert clip_buildings(gdf, aoi, "within").index.equals(expected.index)
+
+
+@pytest.mark.parametrize("mode", ["within", "intersects", "centroid", "clip"])
+def test_join_buildings_matches_clip_buildings(buildings, mode):
+    """The bulk join gives every AOI what clip_buildings gives it alone."""
+    aois = [AOI, box(8, 3, 15, 10)]
+    result = join_buildings(buildings, aois, ["a", "b"], mode)
+    for aoi, aoi_id in zip(aois, ["a", "b"]):
+        expected = clip_buildings(buildings, aoi, mode)
+        joined = result[result["aoi_id"] == aoi_id]
+        assert list(joined["name"]) == list(expected["name"])
+        assert all(
+            a.equals(b) for a, b in zip(joined.geometry, expected.geometry)
+        )
@@ -0,0 +1,161 @@
+import threading
+import time
+
+import pytest
+
+from obe import metrics
+from obe.concurrency import CONTROLLER, AdaptiveController, Throttled, bounded_map
+
+
+def test_bounded_map_applies_backpressure():
+    """No more than max_in_flight calls are started ahead of the consumer."""
+    started = []
+    lock = threading.Lock()
+
+    def work(item):
+        with lock:
+            started.append(item)
+        return item * 2
+
+    results = bounded_map(work, range(100), max_workers=2, max_in_flight=3)
+    first = next(results)
+    time.sleep(0.1)
+    assert first[1] == first[0] * 2
+    assert len(started) <= 3
+    results.close()
+    assert len(started) <= 4
+
+
+def test_bounded_map_ordered():
+    def work(item):
+        time.sleep(0.01 * (5 - item))
+        return item
+
+    results = list(bounded_map(work, range(5), max_workers=5, ordered=True))
+    assert results == [(i, i) for i in range(5)]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fetch(controller, clock, seconds, nbytes=1000, url="http://tiles/a"):
+    with controller.slot(url) as slot:
+        clock.now += seconds
+        slot.bytes = nbytes
+
+
+def test_controller_grows_while_throughput_improves(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("obe.concurrency.time.perf_counter", clock)
+    controller = AdaptiveController(initial_limit=2, max_per_host=4)
+
+    for seconds in [1.0, 1.0, 0.5, 0.5, 0.5]:  # first window sets the baseline
+        fetch(controller, clock, seconds)
+    assert controller.limit("tiles") == 4  # capped
+    for _ in range(8):  # no further improvement: the limit holds
+        fetch(controller, clock, 0.5)
+    assert controller.limit("tiles") == 4
+    assert controller.hosts["tiles"].increases == 2
+
+
+def test_controller_backs_off_when_throttled():
+    controller = AdaptiveController(initial_limit=8, cooldown=60)
+    with metrics.collect() as run:
+        for _ in range(2):  # the second failure is within the cooldown
+            with pytest.raises(Throttled):
+                with controller.slot("http://tiles/a"):
+                    raise Throttled()
+    assert controller.limit("tiles") == 4
+    assert run.info["concurrency"]["tiles"]["decreases"] == 1
+    assert controller.hosts["tiles"].in_flight == 0
+
+
+def test_controller_respects_memory_budget():
+    controller = AdaptiveController(memory_budget=1500)
+    controller.tile_estimate = 1000
+    entered = threading.Event()
+
+    def second():
+        with controller.slot("http://other/b"):
+            entered.set()
+
+    with controller.slot("http://tiles/a") as slot:
+        thread = threading.Thread(target=second)
+        thread.start()
+        assert not entered.wait(0.2)  # 2000 bytes would exceed the budget
+        slot.bytes = 1000
+    assert entered.wait(5)
+    thread.join()
+
+
+def test_small_requests_do_not_feed_tile_estimates():
+    """HEAD requests and the like neither shrink the estimate nor wait for memory."""
+    controller = AdaptiveController(memory_budget=1500)
+    controller.tile_estimate = 1000
+    with controller.slot("http://tiles/a") as slot:
+        for _ in range(10):
+            with controller.slot("http://tiles/a", tile=False) as head:
+                head.bytes = 0
+        slot.bytes = 1000
+    assert controller.tile_estimate == 1000
+    assert controller.hosts["tiles"].window_count == 1
+    assert controller.reserved == 0
+
+
+def test_throttled_downloads_are_retried(standin):
+    from obe.app import download_buildings
+
+    from .test_app import TEST_GEOJSON
+
+    expected = len(download_buildings("google", TEST_GEOJSON, None))
+    standin.throttle(3)
+    with metrics.collect() as run:
+        result = download_buildings("google", TEST_GEOJSON, None)
+    CONTROLLER.hosts.clear()
+
+    assert len(result) == expected
+    assert run.info["retries"] == 3
+    (host,) = run.info["concurrency"].values()
+    assert host["decreases"] >= 1
+
+
+def test_retry_delay_is_capped():
+    import requests
+
+    from obe.fetch import MAX_RETRY_DELAY, retry_delay
+
+    response = requests.Response()
+    response.status_code = 429
+    response.headers["Retry-After"] = "86400"
+    exc = requests.HTTPError(response=response)
+    assert retry_delay(exc, 0) == MAX_RETRY_DELAY
+    response.headers["Retry-After"] = "2"
+    assert retry_delay(exc, 0) == 2
+    assert retry_delay(requests.Timeout(), 20) == MAX_RETRY_DELAY
+
+
+def test_requests_have_a_default_timeout(monkeypatch):
+    import requests
+
+    from obe import fetch
+
+    timeouts = []
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            timeouts.append(kwargs["timeout"])
+            response = requests.Response()
+            response.status_code = 200
+            response._content = b""
+            return response
+
+    monkeypatch.setattr(fetch, "get_session", Session)
+    fetch.request("GET", "http://example.invalid/a")
+    fetch.request("GET", "http://example.invalid/b", timeout=5)
+    CONTROLLER.hosts.pop("example.invalid", None)
+    assert timeouts == [fetch.TIMEOUT, 5]
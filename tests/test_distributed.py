@@ -0,0 +1,108 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from shapely.geometry import box, mapping
+
+from obe.app import download_buildings
+from obe.distributed import (
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    WorkQueue,
+    create_queue,
+    merge,
+)
+
+from .standin import MICROSOFT_LOCATION, StandIn, World
+
+# Spans several Google S2 cells and Microsoft quadkeys.
+EXTENT = (82.5, 27.5, 85.5, 29.0)
+AOI = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "type": "Feature",
+            "properties": {},
+            "geometry": mapping(box(82.6, 27.6, 85.4, 28.9)),
+        }
+    ],
+}
+
+
+@pytest.fixture(scope="module")
+def wide_standin():
+    with StandIn(World(EXTENT, density=2_000)) as server:
+        with server.environment():
+            yield server
+
+
+def test_expired_leases_and_failures_are_retried(tmp_path):
+    queue = WorkQueue(tmp_path)
+    queue.create({"max_attempts": 2}, {"a": [0], "b": [0]})
+
+    assert queue.claim("crashed", lease_seconds=0.05) == ("a", [0])
+    assert queue.claim("slow", lease_seconds=60) == ("b", [0])
+    assert queue.claim("other") is None
+    time.sleep(0.1)
+    # The crashed worker's lease expired, so its tile is handed out again.
+    assert queue.claim("other", lease_seconds=60) == ("a", [0])
+    assert not queue.complete("a", "crashed", 10)
+    assert queue.complete("a", "other", 10)
+
+    queue.fail("b", "slow", "boom", max_attempts=2)
+    assert queue.counts() == {DONE: 1, QUEUED: 1}
+    assert queue.claim("slow") == ("b", [0])
+    queue.fail("b", "slow", "boom again", max_attempts=2)
+    assert queue.counts() == {DONE: 1, FAILED: 1}
+    with pytest.raises(ValueError, match="boom again"):
+        merge(tmp_path)
+
+
+@pytest.mark.parametrize("source", ["google", "microsoft"])
+def test_workers_share_an_extraction(wide_standin, tmp_path, source):
+    location = MICROSOFT_LOCATION if source == "microsoft" else None
+    queue_dir = tmp_path / "queue"
+    count = create_queue(queue_dir, source, AOI, location)
+    assert count > 3
+
+    # A worker that died holding a tile: the others take it over.
+    queue = WorkQueue(queue_dir)
+    abandoned, _ = queue.claim("crashed", lease_seconds=1)
+
+    env = {**os.environ, **wide_standin.env()}
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-m", "obe.app", "worker", "--queue", str(queue_dir)]
+            + ["--worker-id", f"worker-{i}", "--parallel", "2"],
+            env=env,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for i in range(3)
+    ]
+    completed = 0
+    for worker in workers:
+        stdout, _ = worker.communicate(timeout=300)
+        assert worker.returncode == 0, stdout
+        completed += int(stdout.split("Completed ")[1].split()[0])
+    assert completed == count
+
+    tiles = {tile["key"]: tile for tile in queue.tiles()}
+    assert queue.counts() == {DONE: count}
+    assert tiles[abandoned]["attempts"] == 2
+    assert RUNNING not in {tile["status"] for tile in tiles.values()}
+
+    output_path = tmp_path / "merged.parquet"
+    merged = merge(queue_dir, str(output_path))
+    single = download_buildings(source, AOI, None, location=location)
+    assert len(merged) == len(single) > 0
+    assert sorted(merged.geometry.to_wkb()) == sorted(single.geometry.to_wkb())
+    if source == "microsoft":
+        # Ids are numbered in the same order as by a single-process run.
+        by_id = merged.set_index("id").geometry.to_wkb()
+        assert by_id.equals(single.set_index("id").geometry.to_wkb())
+    assert os.path.exists(output_path)
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Budget for the cumulative import time of obe.app, in microseconds. Generous
+# enough for slow CI runners, far below the >1s it costs when the source
+# modules are imported eagerly.
+IMPORT_BUDGET_US = int(os.getenv("OBE_IMPORT_BUDGET_US", 150_000))
+
+HEAVY_MODULES = [
+    "geopandas",
+    "pandas",
+    "shapely",
+    "s2sphere",
+    "mercantile",
+    "requests",
+    "tqdm",
+]
+
+
+def run_python(code, *flags):
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def parse_importtime(stderr):
+    """Return {module: cumulative_us} from `python -X importtime` output."""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        try:
+            timings[module.strip()] = int(cumulative)
+        except ValueError:
+            continue  # header line
+    return timings
+
+
+def test_import_app_skips_heavy_dependencies():
+    """Importing obe.app must not import any source dependency."""
+    code = (
+        "import sys, obe.app; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = run_python(code)
+    assert result.stdout.strip() == ""
+
+
+def test_help_skips_heavy_dependencies():
+    """`obe --help` must not import any source dependency."""
+    code = (
+        "import sys\n"
+        "from obe.app import main\n"
+        "sys.argv = ['obe', '--help']\n"
+        "try:\n"
+        "    main()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print('LOADED=' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = run_python(code)
+    assert result.stdout.rstrip().splitlines()[-1] == "LOADED="
+
+
+def test_import_time_budget():
+    """Cumulative import time of obe.app stays within the budget."""
+    result = run_python("import obe.app", "-X", "importtime")
+    timings = parse_importtime(result.stderr)
+    if "obe.app" not in timings:
+        pytest.fail("obe.app not found in -X importtime output")
+    assert timings["obe.app"] < IMPORT_BUDGET_US, (
+        f"import obe.app took {timings['obe.app']}us "
+        f"(budget {IMPORT_BUDGET_US}us)"
+    )
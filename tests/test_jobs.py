@@ -0,0 +1,76 @@
+import os
+
+import geopandas as gpd
+
+from obe.jobs import DONE, FAILED, JobManager, job_key
+
+from .test_app import TEST_GEOJSON
+
+
+def aoi_gdf():
+    return gpd.GeoDataFrame.from_features(TEST_GEOJSON["features"], crs="EPSG:4326")
+
+
+def test_job_key_ignores_properties():
+    with_props = aoi_gdf().assign(name="pokhara")
+    assert job_key(aoi_gdf(), "google", "geojson") == job_key(with_props, "google", "geojson")
+    assert job_key(aoi_gdf(), "google", "geojson") != job_key(aoi_gdf(), "osm", "geojson")
+
+
+def test_job_key_ignores_feature_order():
+    aoi = aoi_gdf()
+    two = gpd.GeoDataFrame(
+        geometry=[aoi.geometry[0], aoi.geometry[0].buffer(0.01)], crs="EPSG:4326"
+    )
+    reordered = two.iloc[::-1].reset_index(drop=True)
+    assert job_key(two, "google", "geojson") == job_key(reordered, "google", "geojson")
+
+
+def test_identical_requests_share_one_job(standin, tmp_path):
+    manager = JobManager(tmp_path, max_workers=2)
+    try:
+        first = manager.submit(aoi_gdf(), "google", "geoparquet")
+        second = manager.submit(aoi_gdf(), "google", "geoparquet")
+        assert first is second
+        assert first.wait(timeout=60)
+        assert first.status == DONE, first.error
+        assert len(first.result) > 0
+        assert os.path.exists(first.output_path)
+        assert first.progress()["buildings"] == len(first.result)
+
+        other = manager.submit(aoi_gdf(), "google", "geojson")
+        assert other is not first
+        assert os.path.dirname(other.output_path) != os.path.dirname(first.output_path)
+        assert other.wait(timeout=60) and other.status == DONE
+    finally:
+        manager.shutdown()
+
+
+def test_cache_is_bounded(standin, tmp_path):
+    manager = JobManager(tmp_path, max_workers=1, cache_size=1)
+    try:
+        first = manager.submit(aoi_gdf(), "google", "geoparquet")
+        first.wait(timeout=60)
+        second = manager.submit(aoi_gdf(), "osm", "geoparquet")
+        second.wait(timeout=60)
+        third = manager.submit(aoi_gdf(), "overture", "geoparquet")
+        third.wait(timeout=60)
+        assert manager.get(first.id) is None
+        assert not os.path.exists(first.output_path)
+        assert manager.get(third.id) is third
+    finally:
+        manager.shutdown()
+
+
+def test_failed_jobs_are_retried(tmp_path):
+    manager = JobManager(tmp_path, max_workers=1)
+    try:
+        failed = manager.submit(aoi_gdf(), "microsoft", "geoparquet")
+        failed.wait(timeout=60)
+        assert failed.status == FAILED
+        assert "Location is required" in failed.error
+        retry = manager.submit(aoi_gdf(), "microsoft", "geoparquet")
+        assert retry is not failed
+        retry.wait(timeout=60)
+    finally:
+        manager.shutdown()
@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from obe import metrics
+
+def fake_download(size):
+    with metrics.stage("download") as record:
+        record.bytes = size
+    return size
+
+
+def test_stages_are_aggregated():
+    """Repeated stages add up their calls, bytes and rows."""
+    with metrics.collect() as run:
+        for _ in range(3):
+            fake_download(100)
+        with metrics.stage("clip", rows_in=10) as record:
+            record.rows_out = 4
+
+    data = run.to_dict()
+    assert data["stages"]["download"]["calls"] == 3
+    assert data["stages"]["download"]["bytes"] == 300
+    assert data["stages"]["clip"]["rows_in"] == 10
+    assert data["stages"]["clip"]["rows_out"] == 4
+    assert data["total_seconds"] >= data["stages"]["clip"]["seconds"]
+
+
+def test_stage_is_noop_without_collect():
+    """Instrumented code runs unchanged when nothing is collecting."""
+    assert metrics.current() is None
+    assert fake_download(10) == 10
+
+
+def test_submit_propagates_to_worker_threads():
+    """Stages run in executor threads are recorded in the active run."""
+    with metrics.collect() as run:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [metrics.submit(executor, fake_download, 5) for _ in range(8)]
+            assert sum(f.result() for f in futures) == 40
+
+    assert run.to_dict()["stages"]["download"]["calls"] == 8
+
+
+def test_summary_and_json_export(tmp_path):
+    """The run can be printed and exported as JSON."""
+    with metrics.collect() as run:
+        metrics.annotate("source", "google")
+        fake_download(2048)
+
+    summary = run.summary()
+    assert "download" in summary
+    assert "source: google" in summary
+
+    path = tmp_path / "metrics.json"
+    run.write_json(path)
+    with open(path) as f:
+        data = json.load(f)
+    assert data["info"]["source"] == "google"
+    assert data["stages"]["download"]["bytes"] == 2048
+
+
+def test_stage_peak_is_sampled_while_it_runs():
+    """A stage's peak memory is its own, not the process peak so far."""
+    if metrics.rss_bytes() is None:
+        pytest.skip("no way to read the resident set size here")
+    with metrics.collect() as run:
+        with metrics.stage("allocate"):
+            buffer = b"x" * (200 * 1024**2)
+            time.sleep(5 * metrics.SAMPLE_INTERVAL)
+            del buffer
+        with metrics.stage("idle"):
+            time.sleep(5 * metrics.SAMPLE_INTERVAL)
+
+    stages = run.to_dict()["stages"]
+    allocate, idle = stages["allocate"], stages["idle"]
+    assert allocate["peak_rss_bytes"] > idle["peak_rss_bytes"] + 100 * 1024**2
+
+
+def test_sampling_paused():
+    """The sampling thread can be stopped, e.g. for a fork."""
+
+    def sampling():
+        return any(thread.name == "obe-metrics" for thread in threading.enumerate())
+
+    with metrics.collect():
+        assert sampling()
+        with metrics.sampling_paused():
+            assert not sampling()
+        assert sampling()
+    assert not sampling()
@@ -0,0 +1,179 @@
+import json
+import re
+import threading
+
+import geopandas as gpd
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+import shapely
+
+from obe import output
+from obe.output import write_buildings, write_geojson
+
+
+@pytest.fixture
+def buildings():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(83.9, 84.0, 2000)
+    y = rng.uniform(28.1, 28.2, 2000)
+    return gpd.GeoDataFrame(
+        {"confidence": rng.uniform(0.6, 1.0, 2000)},
+        geometry=shapely.box(x, y, x + 1e-4, y + 1e-4),
+        crs="EPSG:4326",
+    )
+
+
+def test_geoparquet_defaults_roundtrip(buildings, tmp_path):
+    path = tmp_path / "default.parquet"
+    write_buildings(buildings, path, "geoparquet")
+    result = gpd.read_parquet(path)
+    assert len(result) == len(buildings)
+    assert "bbox" not in result.columns
+
+
+def test_geoparquet_tuned_output(buildings, tmp_path):
+    path = tmp_path / "tuned.parquet"
+    write_buildings(
+        buildings,
+        path,
+        "geoparquet",
+        {
+            "compression": "zstd",
+            "compression_level": 9,
+            "row_group_size": 250,
+            "precision": 5,
+            "bbox_covering": True,
+            "hilbert": True,
+        },
+    )
+
+    parquet = pq.ParquetFile(path)
+    assert parquet.metadata.num_row_groups == 8
+    assert parquet.metadata.row_group(0).column(0).compression == "ZSTD"
+    geo = json.loads(parquet.schema_arrow.metadata[b"geo"])
+    assert "covering" in geo["columns"]["geometry"]
+
+    result = gpd.read_parquet(path)
+    assert len(result) == len(buildings)
+    coords = shapely.get_coordinates(result.geometry.values)
+    assert np.allclose(coords, coords.round(5))
+
+    # Hilbert ordering keeps each row group spatially compact.
+    first = result.iloc[:250].total_bounds
+    assert (first[2] - first[0]) * (first[3] - first[1]) < 0.5 * 0.1 * 0.1
+
+
+def test_bbox_covering_enables_pruned_reads(buildings, tmp_path):
+    path = tmp_path / "pruned.parquet"
+    write_buildings(
+        buildings,
+        path,
+        "geoparquet",
+        {"row_group_size": 100, "bbox_covering": True, "hilbert": True},
+    )
+    subset = gpd.read_parquet(path, bbox=(83.9, 28.1, 83.92, 28.12))
+    expected = buildings.cx[83.9:83.92, 28.1:28.12]
+    assert len(subset) >= len(expected)
+    assert len(subset) < len(buildings)
+
+
+@pytest.mark.parametrize("sequence", [False, True])
+def test_geojson_output_is_independent_of_workers(buildings, tmp_path, sequence):
+    buildings["name"] = [f"building {i}" for i in range(len(buildings))]
+    buildings.loc[5, "confidence"] = np.nan
+    outputs = set()
+    for max_workers, chunk_size in [(1, 2000), (1, 300), (3, 300)]:
+        path = tmp_path / f"{max_workers}-{chunk_size}.geojson"
+        write_geojson(buildings, path, sequence, 6, max_workers, chunk_size)
+        outputs.add(path.read_bytes())
+    assert len(outputs) == 1
+
+    result = gpd.read_file(path)
+    assert result.crs == "EPSG:4326"
+    assert list(result["name"]) == list(buildings["name"])
+    assert result["confidence"].isna().sum() == 1
+    coords = shapely.get_coordinates(result.geometry.values)
+    assert np.allclose(coords, shapely.get_coordinates(buildings.geometry.values))
+    coordinates = b"".join(re.findall(rb'"coordinates":([^}]*)', outputs.pop()))
+    numbers = re.findall(rb"\d+\.?\d*", coordinates)
+    assert max(len(number.partition(b".")[2]) for number in numbers) == 6
+
+
+def test_geojson_pool_outside_the_main_thread(buildings, tmp_path):
+    """Without fork, the pool is only used when max_workers asks for it."""
+    outputs = []
+
+    def write(max_workers):
+        path = tmp_path / f"{max_workers}.geojson"
+        write_geojson(buildings, path, max_workers=max_workers, chunk_size=300)
+        outputs.append(path.read_bytes())
+
+    for max_workers in (None, 2):
+        thread = threading.Thread(target=write, args=(max_workers,))
+        thread.start()
+        thread.join()
+    write(1)
+    assert len(outputs) == 3 and len(set(outputs)) == 1
+
+
+def test_geojson_output_without_orjson(buildings, tmp_path, monkeypatch):
+    path = tmp_path / "orjson.geojsonseq"
+    write_buildings(buildings, path, "geojsonseq")
+    monkeypatch.setattr(output, "orjson", None)
+    write_buildings(buildings, tmp_path / "json.geojsonseq", "geojsonseq")
+    assert (tmp_path / "json.geojsonseq").read_bytes() == path.read_bytes()
+    assert len(path.read_text().splitlines()) == len(buildings)
+
+
+def test_empty_geojson_output(buildings, tmp_path):
+    write_buildings(buildings.iloc[:0], tmp_path / "empty.geojson", "geojson")
+    assert len(gpd.read_file(tmp_path / "empty.geojson")) == 0
+
+
+def test_geojson_pool_after_progress_bar():
+    """tqdm's monitor thread does not keep the CLI from forking a pool."""
+    import subprocess
+    import sys
+
+    code = """
+import os, numpy as np, pandas as pd
+from tqdm import tqdm
+from obe import output
+for _ in tqdm(range(3)):
+    pass
+os.cpu_count = lambda: 2
+frame = (pd.DataFrame(), np.array([]), None)
+executor, workers = output._geojson_pool(None, frame)
+print(executor is not None, workers)
+executor.shutdown()
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    )
+    assert result.stdout.split() == ["True", "2"]
+
+
+def test_geojson_float32_attributes(buildings, tmp_path):
+    """Compact float32 columns are written with their float32 digits."""
+    buildings["confidence"] = np.array([0.7, 0.85] * 1000, dtype="float32")
+    buildings.loc[3, "confidence"] = np.nan
+    path = tmp_path / "compact.geojsonseq"
+    write_buildings(buildings, path, "geojsonseq")
+    lines = path.read_text().splitlines()
+    assert '"confidence":0.7}' in lines[0]
+    assert '"confidence":0.85}' in lines[1]
+    assert '"confidence":null}' in lines[3]
+
+
+def test_dataset_writer_abort(buildings, tmp_path):
+    output_dir = tmp_path / "dataset"
+    writer = output.GeoParquetDatasetWriter(str(output_dir), partition_zoom=10)
+    writer.submit(None, buildings)
+    writer.abort()
+    assert not list(output_dir.rglob("*.parquet"))
+
+    # Nothing is left behind that would block the next run.
+    writer = output.GeoParquetDatasetWriter(str(output_dir), partition_zoom=10)
+    writer.submit(None, buildings)
+    assert writer.close()["total_rows"] == len(buildings)
@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+
+import pytest
+
+from obe import metrics, plan
+from obe.app import download_buildings
+from obe.plan import (
+    content_length,
+    load_throughput,
+    parse_size,
+    plan_extraction,
+    record_throughput,
+)
+
+from .standin import MICROSOFT_LOCATION
+from .test_app import TEST_GEOJSON
+
+
+@pytest.fixture
+def throughput_file(tmp_path, monkeypatch):
+    path = tmp_path / "throughput.json"
+    monkeypatch.setattr(plan, "THROUGHPUT_FILE", str(path))
+    return path
+
+
+def test_parse_size():
+    assert parse_size("12.5KB") == 12800
+    assert parse_size("3 MB") == 3 * 1024**2
+    assert parse_size(None) is None
+
+
+@pytest.mark.parametrize("source", ["google", "microsoft"])
+def test_plan_sizes_match_downloads(standin, throughput_file, source):
+    """Planned tiles and sizes are the ones the extraction downloads."""
+    location = MICROSOFT_LOCATION if source == "microsoft" else None
+    planned = plan_extraction(source, TEST_GEOJSON, location)
+    with metrics.collect() as run:
+        download_buildings(source, TEST_GEOJSON, None, location=location)
+
+    downloaded = run.stages["download"]
+    assert planned.complete
+    assert planned.estimated_seconds > 0
+    if source == "microsoft":
+        # One more download for dataset-links.csv, whose Size column is
+        # rounded to 0.1 KB.
+        assert len(planned.tiles) == downloaded["calls"] - 1
+        for tile in planned.tiles:
+            assert tile["bytes"] == pytest.approx(content_length(tile["url"]), abs=52)
+    else:
+        assert len(planned.tiles) == downloaded["calls"]
+        assert planned.total_bytes == downloaded["bytes"]
+
+
+def test_plan_overture_from_row_groups(standin, throughput_file):
+    planned = plan_extraction("overture", TEST_GEOJSON)
+    result = download_buildings("overture", TEST_GEOJSON, None)
+    assert planned.tiles and planned.complete
+    assert planned.estimated_rows >= len(result) * 0.5
+
+
+def test_plan_overture_without_dataset_is_unknown(throughput_file, monkeypatch):
+    from obe import overture
+
+    monkeypatch.setattr(overture, "OVERTURE_DATASET_URL", None)
+    planned = plan_extraction("overture", TEST_GEOJSON)
+    assert len(planned.tiles) == 1 and not planned.complete
+    assert planned.estimated_rows is None
+    assert planned.estimated_seconds is None
+    assert "?" in planned.summary()
+
+
+def test_recorded_throughput_drives_runtime(standin, throughput_file):
+    with metrics.collect() as run:
+        download_buildings("google", TEST_GEOJSON, None)
+    record_throughput("google", run.to_dict())
+
+    planned = plan_extraction("google", TEST_GEOJSON)
+    assert planned.throughput["runs"] == 1
+    expected = planned.total_bytes / planned.throughput["bytes_per_second"]
+    assert planned.estimated_seconds == pytest.approx(expected)
+    assert planned.estimated_seconds == pytest.approx(run.total_seconds, rel=0.01)
+
+
+def test_throughput_file_is_never_half_written(throughput_file):
+    run = {"stages": {"download": {"bytes": 10**6}}, "total_seconds": 1.0}
+    record_throughput("google", run)
+    stop = threading.Event()
+
+    def record():
+        while not stop.is_set():
+            record_throughput("google", run)
+
+    writers = [threading.Thread(target=record) for _ in range(4)]
+    for writer in writers:
+        writer.start()
+    try:
+        for _ in range(200):
+            with open(throughput_file) as f:
+                assert json.load(f)["google"]["runs"] >= 1
+    finally:
+        stop.set()
+        for writer in writers:
+            writer.join()
+    assert os.listdir(os.path.dirname(throughput_file)) == ["throughput.json"]
+
+
+def test_throughput_recording_can_be_turned_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(plan, "THROUGHPUT_FILE", "")
+    monkeypatch.chdir(tmp_path)
+    run = {"stages": {"download": {"bytes": 1}}, "total_seconds": 1.0}
+    record_throughput("google", run)
+    assert load_throughput("google")["runs"] == 0
+    assert os.listdir(tmp_path) == []
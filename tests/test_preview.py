@@ -0,0 +1,53 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, box
+
+from obe.preview import build_preview
+
+
+def make_buildings(count):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(83.9, 84.0, count)
+    y = rng.uniform(28.1, 28.2, count)
+    return gpd.GeoDataFrame(
+        geometry=shapely.box(x, y, x + 1e-4, y + 1e-4), crs="EPSG:4326"
+    )
+
+
+def test_small_result_sends_every_polygon():
+    preview = build_preview(make_buildings(100), max_features=1000)
+    assert preview.total == 100
+    assert not preview.sampled
+    assert preview.density is None
+    assert len(preview.polygons) == 100
+    ring = preview.polygons["polygon"].iloc[0]
+    assert ring[0] == ring[-1]
+    assert all(round(x, 6) == x for x, _ in ring)
+
+
+def test_large_result_is_capped_with_density():
+    gdf = make_buildings(5000)
+    preview = build_preview(gdf, max_features=500, grid_size=32)
+    assert preview.sampled
+    assert len(preview.polygons) == 500
+    assert preview.density["count"].sum() == 5000
+    assert len(preview.density) <= 32 * 32
+    # The sample is deterministic so reruns show the same preview.
+    again = build_preview(gdf, max_features=500, grid_size=32)
+    assert preview.polygons["polygon"].tolist() == again.polygons["polygon"].tolist()
+
+
+def test_multipolygons_and_empties():
+    gdf = gpd.GeoDataFrame(
+        geometry=[
+            MultiPolygon([box(0, 0, 1, 1), box(2, 2, 3, 3)]),
+            shapely.Polygon(),
+            box(5, 5, 6, 6),
+        ],
+        crs="EPSG:4326",
+    )
+    preview = build_preview(gdf)
+    assert preview.total == 2
+    assert len(preview.polygons) == 3
+    assert preview.bounds == (0.0, 0.0, 6.0, 6.0)
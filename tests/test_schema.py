@@ -0,0 +1,44 @@
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import Point, box
+
+from obe.output import concat_batches
+from obe.schema import STRING, compact_frame, resolve_compact
+
+
+def make_batch(classes):
+    return gpd.GeoDataFrame(
+        {
+            "class": classes,
+            "name": [f"building {i}" for i in range(len(classes))],
+            "height": [3.5] * len(classes),
+        },
+        geometry=[Point(i, 0) for i in range(len(classes))],
+        crs="EPSG:4326",
+    )
+
+
+def test_compact_frame_dtypes():
+    gdf = compact_frame(make_batch(["house", "house", "garage", "house"]), "overture")
+    assert gdf["height"].dtype == "float32"
+    assert isinstance(gdf["class"].dtype, pd.CategoricalDtype)
+    assert gdf["name"].dtype == STRING
+    assert gdf.geometry.name == "geometry"
+
+
+def test_categories_survive_concat():
+    batches = [
+        compact_frame(make_batch(["house", "house"]), "osm"),
+        compact_frame(make_batch(["garage", "garage", "shed"]), "osm"),
+    ]
+    result = concat_batches(batches)
+    assert isinstance(result["class"].dtype, pd.CategoricalDtype)
+    assert list(result["class"]) == ["house", "house", "garage", "garage", "shed"]
+
+
+def test_resolve_compact_by_area():
+    small = gpd.GeoDataFrame(geometry=[box(85.3, 27.7, 85.4, 27.8)], crs="EPSG:4326")
+    large = gpd.GeoDataFrame(geometry=[box(80, 26, 88, 30)], crs="EPSG:4326")
+    assert resolve_compact(None, small) is False
+    assert resolve_compact(None, large) is True
+    assert resolve_compact(True, small) is True
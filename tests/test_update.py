@@ -0,0 +1,127 @@
+import json
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import box, mapping
+
+from obe import metrics
+from obe.app import download_buildings
+from obe.update import manifest_path
+
+from .standin import MICROSOFT_LOCATION, StandIn, World
+from .test_distributed import AOI, EXTENT
+
+
+@pytest.fixture
+def editable_standin():
+    """A stand-in of its own, as the tests edit its buildings."""
+    with StandIn(World(EXTENT, density=2_000)) as server:
+        with server.environment():
+            yield server
+
+
+@pytest.mark.parametrize("source", ["google", "microsoft"])
+def test_update_refetches_only_changed_tiles(editable_standin, tmp_path, source):
+    location = MICROSOFT_LOCATION if source == "microsoft" else None
+    output_path = str(tmp_path / "buildings.parquet")
+
+    def update(aoi):
+        with metrics.collect() as run:
+            result = download_buildings(
+                source, aoi, output_path, location=location, update=True
+            )
+        # Microsoft always reads dataset-links.csv.
+        tiles = run.stages.get("download", {}).get("calls", 0)
+        return result, run.info, tiles - (source == "microsoft")
+
+    def assert_matches_fresh_extraction(result, aoi):
+        fresh = download_buildings(source, aoi, None, location=location)
+        assert len(result) == len(fresh) > 0
+        assert sorted(result.geometry.to_wkb()) == sorted(fresh.geometry.to_wkb())
+        written = gpd.read_parquet(output_path)
+        assert sorted(written.geometry.to_wkb()) == sorted(fresh.geometry.to_wkb())
+
+    _, info, downloads = update(AOI)
+    assert info["tiles_refreshed"] == info["tiles"] == downloads > 3
+    with open(manifest_path(output_path)) as f:
+        tiles = json.load(f)["tiles"]
+    assert len(tiles) == info["tiles"]
+    assert all(tile["etag"] and tile["sha256"] for tile in tiles.values())
+
+    # Nothing changed upstream: HEAD requests only.
+    _, info, downloads = update(AOI)
+    assert info["tiles_refreshed"] == downloads == 0
+
+    editable_standin.world.edit((84.0, 28.0, 84.1, 28.1))
+    result, info, downloads = update(AOI)
+    assert info["tiles_refreshed"] == downloads == 1
+    assert_matches_fresh_extraction(result, AOI)
+
+    # Moving the east edge of the AOI only touches the tiles along it.
+    edited = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {},
+                "geometry": mapping(box(82.6, 27.6, 85.45, 28.9)),
+            }
+        ],
+    }
+    result, info, downloads = update(edited)
+    assert 0 < info["tiles_refreshed"] == downloads < info["tiles"]
+    assert_matches_fresh_extraction(result, edited)
+
+
+def test_update_overture_follows_row_group_metadata(tmp_path):
+    """Overture tiles are refreshed when their row groups change, at any URL."""
+    world = World(EXTENT, density=2_000)
+    dataset = str(tmp_path / "latest")
+    world.write_overture(dataset, row_group_size=500)
+    output_path = str(tmp_path / "buildings.parquet")
+    aois = {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": {}, "geometry": mapping(aoi)}
+            for aoi in (box(82.7, 27.7, 83.0, 28.0), box(84.5, 28.3, 84.8, 28.6))
+        ],
+    }
+
+    def update():
+        with metrics.collect() as run:
+            result = download_buildings("overture", aois, output_path, update=True)
+        return result, run.info
+
+    with StandIn(world) as server, server.environment(overture_dataset=dataset):
+        _, info = update()
+        assert info["tiles_refreshed"] == info["tiles"] == 2
+        _, info = update()
+        assert info["tiles_refreshed"] == 0
+
+        # Same dataset URL, new data in the second AOI only.
+        world.edit((84.6, 28.4, 84.7, 28.5))
+        world.write_overture(dataset, row_group_size=500)
+        result, info = update()
+        assert info["tiles_refreshed"] == 1
+        fresh = download_buildings("overture", aois, None)
+        assert sorted(result.geometry.to_wkb()) == sorted(fresh.geometry.to_wkb())
+
+
+def test_update_rewrites_output_with_new_options(editable_standin, tmp_path):
+    import pyarrow.parquet as pq
+
+    output_path = str(tmp_path / "buildings.parquet")
+
+    def compression():
+        return pq.ParquetFile(output_path).metadata.row_group(0).column(0).compression
+
+    download_buildings("google", AOI, output_path, update=True)
+    assert compression() == "SNAPPY"
+    download_buildings(
+        "google",
+        AOI,
+        output_path,
+        update=True,
+        parquet_options={"compression": "zstd"},
+    )
+    assert compression() == "ZSTD"